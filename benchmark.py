@@ -0,0 +1,260 @@
+import json
+import time
+import socket
+import platform
+import argparse
+import subprocess
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+
+import protocol
+from mot.tracker import KalmanFilter, FastKalmanFilter, Tracker
+from mot.tracker.boxes import iou_matrix, iou_cost, xyah_to_tlbr
+from mot.tracker.hungarian import assignment, linear_assignment, sparse_assignment
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--output", default="benchmark.json", help="output json file")
+parser.add_argument("--sizes", default="10,100,1000", help="numbers of objects to benchmark")
+parser.add_argument("--gating", default="200x300", help="tracks x detections of the gating benchmark")
+parser.add_argument("--payloads", default="1024,65536,1048576", help="frame sizes in bytes of the framing benchmark")
+parser.add_argument("--repeat", default="50", help="number of timed runs of each benchmark")
+parser.add_argument("--seed", default="0", help="random seed of the synthetic data")
+parser.add_argument("--compare", default=None, help="previous json results to compare with")
+
+
+def measure(func, repeat, warmup=3):
+    """Time repeated calls of func
+
+    Return:
+        dictionary of timing statistics in microseconds
+    """
+    for _ in range(warmup):
+        func()
+
+    timings = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings[i] = time.perf_counter() - start
+
+    timings *= 1e6
+    return {
+        'runs': repeat,
+        'mean_us': float(timings.mean()),
+        'p50_us': float(np.percentile(timings, 50)),
+        'p95_us': float(np.percentile(timings, 95)),
+        'min_us': float(timings.min()) }
+
+def random_xyah(rng, n, width=1920, height=1080):
+    """Random (x, y, a, h) boxes spread over a frame"""
+    boxes = np.empty((n, 4))
+    boxes[:, 0] = rng.uniform(0, width, n)
+    boxes[:, 1] = rng.uniform(0, height, n)
+    boxes[:, 2] = rng.uniform(0.3, 0.6, n)
+    boxes[:, 3] = rng.uniform(40, 200, n)
+    return boxes
+
+
+class SyntheticScene:
+    """Objects moving at constant velocity with noisy and missing detections"""
+
+    def __init__(self, rng, n_objects, width=1920, height=1080,
+                noise=2., miss_rate=0.05):
+        self.rng = rng
+        self.width = width
+        self.height = height
+        self.noise = noise
+        self.miss_rate = miss_rate
+        self.boxes = random_xyah(rng, n_objects, width, height)
+        self.velocities = rng.normal(0, 3, (n_objects, 2))
+
+    def step(self):
+        """Move the objects one frame forward and return the detections"""
+        self.boxes[:, :2] += self.velocities
+        self.boxes[:, 0] %= self.width
+        self.boxes[:, 1] %= self.height
+
+        detected = self.rng.random(len(self.boxes)) >= self.miss_rate
+        detections = self.boxes[detected].copy()
+        detections[:, :2] += self.rng.normal(0, self.noise, (len(detections), 2))
+        detections[:, 3] += self.rng.normal(0, self.noise, len(detections))
+        return detections
+
+
+def bench_kalman(rng, sizes, repeat, gating=(200, 300)):
+    results = []
+    filters = [ ("kalman", KalmanFilter()), ("fast_kalman", FastKalmanFilter()) ]
+
+    for name, kf in filters:
+        mean, covariance = kf.initiate(random_xyah(rng, 1)[0])
+        measurement = mean[:4] + 1
+        results.append(dict(name=name+".predict", n=1,
+                            **measure(lambda: kf.predict(mean, covariance), repeat)))
+        results.append(dict(name=name+".update", n=1,
+                            **measure(lambda: kf.update(mean, covariance, measurement), repeat)))
+
+        for n in sizes:
+            measurements = random_xyah(rng, n)
+            means, covariances = kf.initiate_batch(measurements)
+            results.append(dict(name=name+".predict_batch", n=n,
+                        **measure(lambda: kf.predict_batch(means, covariances), repeat)))
+            results.append(dict(name=name+".update_batch", n=n,
+                        **measure(lambda: kf.update_batch(means, covariances, measurements+1), repeat)))
+            results.append(dict(name=name+".gating_distance", n=n,
+                        **measure(lambda: kf.gating_distance(means, covariances,
+                                                            measurements, only_position=True), repeat)))
+
+        # Predicted tracks against the detections of a crowded frame
+        n_tracks, n_detections = gating
+        means, covariances = kf.predict_batch(*kf.initiate_batch(random_xyah(rng, n_tracks)))
+        measurements = random_xyah(rng, n_detections)
+        for suffix, only_position in [ ("", False), ("_pos", True) ]:
+            results.append(dict(name=name+".gating_matrix"+suffix, n=n_tracks,
+                        detections=n_detections,
+                        **measure(lambda: kf.gating_distance(means, covariances,
+                                                            measurements, only_position), repeat)))
+
+    return results
+
+def bench_association(rng, sizes, repeat):
+    results = []
+    for n in sizes:
+        tracks = xyah_to_tlbr(random_xyah(rng, n))
+        detections = tracks + rng.normal(0, 2, tracks.shape)
+        cost = iou_cost(tracks, detections, max_cost=0.7)
+
+        results.append(dict(name="boxes.iou_matrix", n=n,
+                    **measure(lambda: iou_matrix(tracks, detections), repeat)))
+        results.append(dict(name="hungarian.linear_assignment", n=n,
+                    **measure(lambda: linear_assignment(cost, max_cost=0.7), repeat)))
+        results.append(dict(name="hungarian.sparse_assignment", n=n,
+                    **measure(lambda: sparse_assignment(cost, max_cost=0.7), repeat)))
+        results.append(dict(name="hungarian.assignment", n=n,
+                    **measure(lambda: assignment(cost, max_cost=0.7), repeat)))
+
+    return results
+
+def bench_framing(rng, payloads, repeat):
+    """Round trip of tracking messages through the wire protocol over a local
+    socket pair, as done by the client and server on each frame
+
+    Messages are sent by one persistent thread, large messages exceed the
+    socket buffer and cannot be sent from the receiving thread.
+    """
+    results = []
+    tlahs = random_xyah(rng, 1)
+
+    for size in payloads:
+        frame = rng.integers(0, 256, size, dtype=np.uint8)
+        sender, receiver = socket.socketpair()
+        reader = protocol.MessageReader(receiver)
+        outbox = Queue()
+
+        def send():
+            while True:
+                buffers = outbox.get()
+                if buffers is None:
+                    return
+                protocol.send_message(sender, protocol.MSG_TRACK, 0, buffers)
+
+        thread = Thread(target=send, daemon=True)
+        thread.start()
+
+        def round_trip():
+            outbox.put(protocol.encode_tracking(True, tlahs, frame))
+            _, _, payload = reader.recv()
+            protocol.decode_tracking(payload)
+
+        stats = measure(round_trip, repeat)
+        stats['mb_per_s'] = size / stats['mean_us']
+        results.append(dict(name="protocol.round_trip", n=size, **stats))
+
+        outbox.put(None)
+        thread.join()
+        sender.close()
+        receiver.close()
+
+    return results
+
+def bench_tracker(rng, sizes, repeat):
+    """End-to-end tracker steps on synthetic scenes"""
+    results = []
+    for name, fast_kalman in [ ("tracker.step", False), ("tracker.step_fast_kalman", True) ]:
+        for n in sizes:
+            scene = SyntheticScene(rng, n)
+            tracker = Tracker(fast_kalman=fast_kalman)
+
+            # Let the tracks get confirmed before timing
+            for _ in range(tracker.n_init+2):
+                tracker.step(scene.step())
+
+            stats = measure(lambda: tracker.step(scene.step()), repeat, warmup=0)
+            stats['tracks'] = int(tracker.n_tracks)
+            results.append(dict(name=name, n=n, **stats))
+
+    return results
+
+
+def environment():
+    """Describe the machine and the code version of a benchmark run"""
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                        stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() }
+
+def compare(results, baseline_path):
+    """Print the ratio of the mean timings to those of a previous run"""
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+
+    previous = { (r['name'], r['n']): r for r in baseline['results'] }
+    print("Compared with {} ({})".format(baseline_path, baseline['environment']['commit']))
+    for result in results:
+        key = (result['name'], result['n'])
+        if key not in previous:
+            continue
+        ratio = result['mean_us'] / previous[key]['mean_us']
+        print("  {:<32} n={:<8} {:6.2f}x {}".format(key[0], key[1], ratio,
+                                    "(slower)" if ratio > 1.1 else ""))
+
+def main(args):
+    sizes = [ int(v) for v in args['sizes'].split(",") ]
+    payloads = [ int(v) for v in args['payloads'].split(",") ]
+    repeat = int(args['repeat'])
+    gating = tuple( int(v) for v in args['gating'].split("x") )
+    rng = np.random.default_rng(int(args['seed']))
+
+    benchmarks = [
+        ("kalman", lambda: bench_kalman(rng, sizes, repeat, gating)),
+        ("association", lambda: bench_association(rng, sizes, repeat)),
+        ("framing", lambda: bench_framing(rng, payloads, repeat)),
+        ("tracker", lambda: bench_tracker(rng, sizes, repeat)) ]
+
+    results = []
+    for name, bench in benchmarks:
+        print("Run {} benchmarks".format(name))
+        for result in bench():
+            print("  {name:<32} n={n:<8} mean: {mean_us:10.1f}us  p95: {p95_us:10.1f}us".format(**result))
+            results.append(result)
+
+    with open(args['output'], "w") as f:
+        json.dump({ 'environment': environment(), 'results': results }, f, indent=2)
+    print("Results written to {}".format(args['output']))
+
+    if args['compare']:
+        compare(results, args['compare'])
+
+if __name__ == "__main__":
+    args = vars(parser.parse_args())
+    main(args)
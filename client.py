@@ -1,29 +1,35 @@
 import time
 import socket
-import pickle
 import argparse
-from threading import Thread
+from threading import Thread, Condition
 
 import cv2
 import numpy as np
 
-from multimedia import VideoStream
+import protocol
+from multimedia import VideoStream, ParallelVideoStream
+from mot.tracker.boxes import xyah_to_tlbr, tlbr_to_xyah
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--capture", default="0", help="video source")
 parser.add_argument("--ip", default="127.0.0.1", help="server ip to connect")
 parser.add_argument("--port", default="9999", help="serivce port")
+parser.add_argument("--pipeline", default="0", help="maximum frames in flight, 0 to wait for every result")
+parser.add_argument("--decoders", default="1", help="number of decoding processes, 1 to decode in a thread")
+parser.add_argument("--profile", default="0", help="ask the server to profile the first frames of the session, needs a server run with --client_profile")
+parser.add_argument("--profile_mode", default="cprofile", choices=protocol.PROFILE_MODES, help="server profiling mode")
+parser.add_argument("--roi", action="store_true", help="send only the search window suggested by the server")
 
 
-HEADER_SIZE = 10
-
 GLOBAL = {
     'tracking': {
         'topLeft': None,
         'bottomRight': None,
         # 'tlahs': [],
         'state': False,
-        'clicked': False
+        'clicked': False,
+        'roi': None,
+        'predicted': False
     },
 }
 
@@ -34,7 +40,9 @@ def reset_global():
         'topLeft': None,
         'bottomRight': None,
         'state': False,
-        'clicked': False
+        'clicked': False,
+        'roi': None,
+        'predicted': False
     }
 
 def select_and_track(event, x, y, flags, param):
@@ -57,29 +65,160 @@ def select_and_track(event, x, y, flags, param):
     else:
         pass
 
-def recv_data(conn):
-    full_msg = b''
-    new_msg = True
-
-    while True:
-        msg = conn.recv(4096)
-
-        if new_msg:
-            msglen = int(msg[:HEADER_SIZE])
-            new_msg = False
-
-        full_msg += msg
+def recv_data(reader):
+    msg_type, seq, payload = reader.recv()
+    if msg_type == protocol.MSG_REJECT:
+        raise protocol.RejectedError(protocol.decode_reject(payload))
+    if msg_type != protocol.MSG_RESULT:
+        raise protocol.ProtocolError("Unexpected message type %d" % msg_type)
 
-        if len(full_msg)-HEADER_SIZE == msglen:
-            data = pickle.loads(full_msg[HEADER_SIZE:])
-            return data
+    state, tlahs, _, roi, predicted = protocol.decode_tracking(payload)
+    return { 'seq': seq, 'tlahs': tlahs.tolist(), 'state': state, 'roi': roi, 'predicted': predicted }
 
 def send_data(conn, data):
-    global HEADER_SIZE
+    protocol.send_message(conn,
+                        protocol.MSG_TRACK, data['seq'],
+                        protocol.encode_tracking(
+                                    data['state'], data['tlahs'],
+                                    data['frame'], data.get('roi')))
+
+def crop_roi(frame, roi):
+    """Crop the search window out of the frame
+
+    Return:
+        (crop, roi) where roi is the (x1, y1, x2, y2) window clamped to the
+        frame, or (frame, None) if the window does not overlap the frame
+    """
+    height, width = frame.shape[:2]
+    x1, y1 = max(int(roi[0]), 0), max(int(roi[1]), 0)
+    x2, y2 = min(int(np.ceil(roi[2])), width), min(int(np.ceil(roi[3])), height)
+
+    if x2 <= x1 or y2 <= y1:
+        return frame, None
+
+    return frame[y1:y2, x1:x2], (x1, y1, x2, y2)
+
+class PipelinedConnection:
+    """Non-blocking connection to the tracking server
+
+    The UI loop submits tracking requests and polls for results without ever
+    touching the socket. A sender thread keeps up to `window` frames in flight,
+    each tagged with its sequence number, and a receiver thread keeps only the
+    newest result. When the server falls behind, a frame waiting to be sent is
+    replaced by the newer one (stale frame dropping) instead of piling up.
+    """
+
+    def __init__(self, conn, window=4):
+        """
+        Parameters:
+            - conn: socket connected to the server
+            - window: maximum number of frames in flight
+        """
+        self.conn = conn
+        self.reader = protocol.MessageReader(conn)
+        self.window = window
+
+        self.seq = 0
+        self.dropped = 0
+        self.closed = False
+        self.error = None
+
+        self._cond = Condition()
+        self._control = None    # reset message (no reply expected)
+        self._pending = None    # newest frame waiting for a free slot
+        self._in_flight = 0
+        self._result = None
+
+        self._sender = Thread(target=self._send_loop, daemon=True)
+        self._receiver = Thread(target=self._recv_loop, daemon=True)
+        self._sender.start()
+        self._receiver.start()
+
+    def submit(self, data):
+        """Queue a request for sending and return its sequence number
+
+        Requests with `state` False reset the tracking on the server side and
+        are never dropped, but they discard the frame still waiting to be sent.
+        """
+        with self._cond:
+            self.seq += 1
+            data['seq'] = self.seq
+
+            if not data['state']:
+                if self._pending is not None:
+                    self.dropped += 1
+                    self._pending = None
+                self._control = data
+            else:
+                if self._pending is not None:
+                    self.dropped += 1
+                self._pending = data
+
+            self._cond.notify_all()
+            return data['seq']
+
+    def poll(self):
+        """Return the newest result received since the last poll, or None"""
+        with self._cond:
+            result, self._result = self._result, None
+            return result
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self.conn.close()
+
+    def _send_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: (
+                    self.closed
+                    or self._control is not None
+                    or (self._pending is not None and self._in_flight < self.window)))
+                if self.closed:
+                    return
+
+                if self._control is not None:
+                    data, self._control = self._control, None
+                else:
+                    data, self._pending = self._pending, None
+                    self._in_flight += 1
+
+            try:
+                send_data(self.conn, data)
+            except OSError:
+                self.close()
+                return
+
+    def _recv_loop(self):
+        while True:
+            try:
+                data = recv_data(self.reader)
+            except (OSError, protocol.ProtocolError) as e:
+                self.error = e
+                self.close()
+                return
+
+            with self._cond:
+                self._in_flight = max(self._in_flight-1, 0)
+                if self._result is None or data['seq'] > self._result['seq']:
+                    self._result = data
+                self._cond.notify_all()
+
+def apply_result(data, stream):
+    """Update tracking status with a result from the server"""
+    global GLOBAL
 
-    msg = pickle.dumps(data)
-    msg = bytes(f"{len(msg):<{HEADER_SIZE}}", 'utf-8')+msg
-    conn.sendall(msg)
+    GLOBAL['tracking']['state'] = data['state']
+    GLOBAL['tracking']['roi'] = data['roi']
+    GLOBAL['tracking']['predicted'] = data['predicted']
+    if data['state']:
+        tl_x, tl_y, br_x, br_y = xyah_to_tlbr(data['tlahs'][0]).astype(int).tolist()
+        GLOBAL['tracking']['topLeft'] = (tl_x, tl_y)
+        GLOBAL['tracking']['bottomRight'] = (br_x, br_y)
+    else:
+        stream.state = "pause"
 
 def main(args):
 
@@ -88,11 +227,27 @@ def main(args):
     print("Connect to {}:{}".format(args['ip'], args['port']))
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client_socket.connect((args['ip'], int(args['port'])))
+    reader = protocol.MessageReader(client_socket)
+    seq = 0
+
+    # Ask the server to profile this session
+    if int(args['profile']) > 0:
+        protocol.send_message(client_socket, protocol.MSG_PROFILE, 0,
+                            protocol.encode_profile(int(args['profile']), args['profile_mode']))
+
+    # Network I/O runs in background threads in pipelined mode
+    pipelined = None
+    if int(args['pipeline']) > 0:
+        pipelined = PipelinedConnection(client_socket, window=int(args['pipeline']))
+    min_seq = 0 # results of requests older than this one are stale
 
     # Connect to video source
     # =======================
     print("Stream video {}".format(args['capture']))
-    stream = VideoStream(args['capture'])
+    if int(args['decoders']) > 1:
+        stream = ParallelVideoStream(args['capture'], workers=int(args['decoders']))
+    else:
+        stream = VideoStream(args['capture'])
     stream.start()
 
     # Interactive interface to the client user
@@ -111,15 +266,22 @@ def main(args):
         # Get new frame if it is started
         else:
             frame = stream.read()
+            if frame is None:
+                break
             prev_frame = frame
 
         if GLOBAL['tracking']['clicked']:
+            seq += 1
             data = {
+                'seq': seq,
                 'tlahs': [(0, 0, 0, 0)],
                 'state': GLOBAL['tracking']['state'],
                 'frame': None
             }
-            send_data(client_socket, data)
+            if pipelined is not None:
+                min_seq = pipelined.submit(data)
+            else:
+                send_data(client_socket, data)
             stream.state = "pause"
 
         # If it is tracking, then it should communicate with server
@@ -129,33 +291,56 @@ def main(args):
             # ====================================
             tl_x, tl_y = GLOBAL['tracking']['topLeft']
             br_x, br_y = GLOBAL['tracking']['bottomRight']
-            cx, cy = (tl_x+br_x)/2, (tl_y+br_y)/2
-            w, h = (tl_x-br_x), (br_y-tl_y)
+            tlah = tlbr_to_xyah([min(tl_x, br_x), min(tl_y, br_y),
+                                max(tl_x, br_x), max(tl_y, br_y)])
+            # Only send the search window in ROI mode, full frame otherwise
+            region, roi = frame, None
+            if args['roi'] and GLOBAL['tracking']['roi'] is not None:
+                region, roi = crop_roi(frame, GLOBAL['tracking']['roi'])
+
+            seq += 1
             data = {
-                'tlahs': [(cx, cy, abs(w/h), h)],
+                'seq': seq,
+                'tlahs': [tlah],
                 'state': GLOBAL['tracking']['state'],
                 'frame': cv2.imencode(
                                     '.jpg',
-                                    frame,
-                                    [int(cv2.IMWRITE_JPEG_QUALITY), 90])[1]
+                                    region,
+                                    [int(cv2.IMWRITE_JPEG_QUALITY), 90])[1],
+                'roi': roi
             }
-            send_data(client_socket, data)
-
-            # Recv processed frame from server
-            # ===============================
-            data = recv_data(client_socket) # without frame information
-            print(data)
-
-            # Update tracking status
-            GLOBAL['tracking']['state'] = data['state']
-            if data['state']:
-                cx, cy, a, h = data['tlahs'][0]
-                tl_x, tl_y = int(cx-(a*h/2)), int(cy-h/2)
-                br_x, br_y = int(cx+(a*h/2)), int(cy+h/2)
-                GLOBAL['tracking']['topLeft'] = (tl_x, tl_y)
-                GLOBAL['tracking']['bottomRight'] = (br_x, br_y)
+            # Submit without waiting in pipelined mode, the result is applied
+            # to the newest frame once it arrives
+            if pipelined is not None:
+                pipelined.submit(data)
+
             else:
-                stream.state = "pause"
+                send_data(client_socket, data)
+
+                # Recv processed frame from server
+                # ===============================
+                try:
+                    data = recv_data(reader) # without frame information
+                except (OSError, protocol.ProtocolError) as e:
+                    print("Connection closed by server: {}".format(e))
+                    break
+                print(data)
+
+                # Update tracking status
+                apply_result(data, stream)
+
+        # Apply the newest result from the server in pipelined mode
+        if pipelined is not None:
+            if pipelined.closed:
+                print("Connection closed by server: {}".format(pipelined.error))
+                break
+            data = pipelined.poll()
+            if data is not None and data['seq'] >= min_seq and GLOBAL['tracking']['state']:
+                apply_result(data, stream)
+
+                # Drop results of the frames still in flight when target is lost
+                if not data['state']:
+                    min_seq = pipelined.seq + 1
 
         # Show selected rectangle if user has clicked
         if GLOBAL['tracking']['clicked']:
@@ -167,12 +352,13 @@ def main(args):
         # Show tracking state
         # - Red border on the screen when is not in tracking
         # - Green border on the screen when is in tracking
+        # - Yellow target box when it is only predicted by the server
         if GLOBAL['tracking']['state']:
             cv2.rectangle(frame, (0, 0), stream.resolution, (0, 255, 0), 2)
             cv2.rectangle(frame,
                     GLOBAL['tracking']['topLeft'],
                     GLOBAL['tracking']['bottomRight'],
-                    (0 ,255, 0), 2)
+                    (0, 255, 255) if GLOBAL['tracking']['predicted'] else (0 ,255, 0), 2)
         else:
             cv2.rectangle(frame, (0, 0), stream.resolution, (0, 0, 255), 2)
 
@@ -185,6 +371,8 @@ def main(args):
         if key == ord('q') or key == 27: # q or esc key
             stream.state = "stop"
             cv2.destroyAllWindows()
+            if pipelined is not None:
+                pipelined.close()
             break
         elif key == 32: # space key
             if stream.state == "pause":
@@ -192,6 +380,8 @@ def main(args):
             elif stream.state == "start":
                 stream.state = "pause"
 
+    stream.stop()
+
 
 if __name__ == "__main__":
     args = vars(parser.parse_args())
@@ -4,10 +4,20 @@ import argparse
 
 import torch
 
-from multimedia.player import VideoPlayer
+from multimedia import VideoStream, ParallelVideoStream
+from mot.detector import DetectionCache
 from mot.detector.models import ObjectDetector
+from mot.tracker import Tracker
+from mot.pipeline import OfflinePipeline
+from profiling import FrameProfiler
 
-parser = argparse.ArgumentParser("-c", "--config", default="config.json", help="configuration file")
+parser = argparse.ArgumentParser()
+parser.add_argument("-c", "--config", default="config.json", help="configuration file")
+parser.add_argument("--output", default="tracks.txt", help="output file of tracking results")
+parser.add_argument("--format", default="csv", choices=["csv", "columnar"], help="output format")
+parser.add_argument("--batch_size", default="8", help="number of frames per detection batch")
+parser.add_argument("--queue_size", default="16", help="maximum number of frames between two pipeline stages")
+parser.add_argument("--decoders", default="1", help="number of decoding processes, 1 to decode in a thread")
 
 def main(args):
 
@@ -19,18 +29,48 @@ def main(args):
     with open(args['config'], "r") as f:
         config = json.loads(f.read())
 
-    # Construct video player
-    video_player = VideoPlayer(config['video']['path'],
-                        (config['video']['width'], config['video']['height']))
+    # Construct video stream
+    resolution = (config['video']['width'], config['video']['height'])
+    if int(args['decoders']) > 1:
+        stream = ParallelVideoStream(config['video']['path'],
+                                    resolution=resolution,
+                                    workers=int(args['decoders']))
+    else:
+        stream = VideoStream(config['video']['path'], resolution=resolution)
 
     # Construct object detector
-    detector = ObjectDetector(backend="")
+    # Detections are cached per video, so re-runs replay them without inference
+    detection_config = config['model']['detection']
+    cache = None
+    if detection_config.get('cache'):
+        cache = DetectionCache.for_video(config['video']['path'],
+                                        detection_config['cache'],
+                                        tag=os.path.basename(detection_config['path']))
+    detector = ObjectDetector(backend=detection_config.get('backend', "fasterrcnn"),
+                            cache=cache,
+                            model_path=detection_config['path'],
+                            device='cuda' if use_gpu else 'cpu')
 
     # Construct object tracker
-    tracker = None
+    tracker = Tracker(**config['tracker'])
 
     # Tracking Pipeline
     # =================
+    # Decode, detect, track and write concurrently for maximum throughput
+    # Each stage is profiled over its first frames when DEEPSORT_PROFILE is set
+    pipeline = OfflinePipeline(stream, detector, tracker,
+                            batch_size=int(args['batch_size']),
+                            queue_size=int(args['queue_size']),
+                            profiler=lambda stage: FrameProfiler.from_env("pipeline-"+stage))
+    stream.start()
+    try:
+        reports = pipeline.run(args['output'], columnar=args['format'] == "columnar")
+    finally:
+        stream.stop()
+        detector.close()
+
+    for report in reports:
+        print("[{stage:>6}] frames: {frames:6d} - fps: {fps:8.2f} - busy fps: {busy_fps:8.2f}".format(**report))
 
 if __name__ == "__main__":
     args = vars(parser.parse_args())
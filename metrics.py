@@ -0,0 +1,260 @@
+"""Low overhead latency histograms and throughput counters of the server
+
+Latencies are counted in fixed log-spaced buckets, so recording a sample is
+one logarithm and one increment, memory is constant whatever the number of
+samples, and percentiles are read from the cumulative counts with a relative
+error bounded by the bucket width (about 5%).
+"""
+import json
+import math
+import time
+from collections import deque
+from threading import Lock, Thread
+from urllib.parse import urlsplit, parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class LatencyHistogram:
+    """Histogram of latencies in log-spaced buckets"""
+
+    def __init__(self, min_value=1e-6, max_value=100., growth=1.1):
+        """
+        Parameters:
+            - min_value: smallest resolved latency in seconds
+            - max_value: largest resolved latency in seconds
+            - growth: ratio between the bounds of two consecutive buckets
+        """
+        self.min_value = min_value
+        self._scale = 1. / math.log(growth)
+        self._growth = growth
+        self._counts = [0] * (int(math.log(max_value/min_value)*self._scale) + 2)
+        self._lock = Lock()
+
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def record(self, seconds):
+        if seconds <= self.min_value:
+            bucket = 0
+        else:
+            bucket = min(int(math.log(seconds/self.min_value)*self._scale) + 1,
+                        len(self._counts)-1)
+
+        with self._lock:
+            self._counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentiles(self, quantiles=(0.5, 0.95, 0.99)):
+        """Return the upper bound of the bucket holding each quantile"""
+        with self._lock:
+            counts = list(self._counts)
+            count = self.count
+
+        results = []
+        for q in quantiles:
+            if count == 0:
+                results.append(0.)
+                continue
+
+            rank, cumulated = q*count, 0
+            for bucket, n in enumerate(counts):
+                cumulated += n
+                if cumulated >= rank:
+                    break
+            results.append(min(self.min_value * self._growth**bucket, self.max))
+
+        return results
+
+    def summary(self):
+        """Return the histogram statistics in milliseconds"""
+        p50, p95, p99 = self.percentiles()
+        with self._lock:
+            count, total, max_value = self.count, self.total, self.max
+        return {
+            'count': count,
+            'mean_ms': 1000*total/count if count > 0 else 0.,
+            'p50_ms': 1000*p50,
+            'p95_ms': 1000*p95,
+            'p99_ms': 1000*p99,
+            'max_ms': 1000*max_value }
+
+
+class FrameCounter:
+    """Count frames and measure the recent frame rate
+
+    Frames are ticked from the session, executor and worker threads, so the
+    count and the recent frame times are guarded like the histograms.
+    """
+
+    def __init__(self, window=128):
+        self.count = 0
+        self._times = deque(maxlen=window)
+        self._lock = Lock()
+
+    def tick(self):
+        now = time.monotonic()
+        with self._lock:
+            self.count += 1
+            self._times.append(now)
+
+    def fps(self, timeout=5.):
+        """Frame rate over the last frames, 0 if no frame came recently"""
+        with self._lock:
+            times = list(self._times)
+        if len(times) < 2 or time.monotonic() - times[-1] > timeout:
+            return 0.
+        return (len(times)-1) / max(times[-1]-times[0], 1e-9)
+
+
+class Metrics:
+    """Per stage latency histograms and frame counter of one scope
+
+    Samples recorded in a scope with a parent are also recorded in the
+    parent, so each session feeds the server wide statistics as well.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.histograms = {}
+        self.frames = FrameCounter()
+        self.started = time.monotonic()
+
+    def record(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        histogram.record(seconds)
+
+        if self.parent is not None:
+            self.parent.record(stage, seconds)
+
+    def tick(self):
+        self.frames.tick()
+        if self.parent is not None:
+            self.parent.tick()
+
+    def time(self, stage):
+        """Context manager recording the duration of its block"""
+        return _Timer(self, stage)
+
+    def summary(self):
+        return {
+            'uptime_s': time.monotonic() - self.started,
+            'frames': self.frames.count,
+            'fps': self.frames.fps(),
+            'stages': { stage: histogram.summary()
+                        for stage, histogram in list(self.histograms.items()) } }
+
+
+class _Timer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.stage, time.perf_counter() - self.start)
+
+
+class ServerStats:
+    """Server wide statistics: global metrics, per session metrics and
+    gauges (e.g. queue depths) sampled when a report is built
+
+    The HTTP endpoint also exposes operator actions (e.g. profiling a session)
+    registered with `action`, run by a POST request on /<action>?<parameters>.
+    """
+
+    def __init__(self):
+        self.metrics = Metrics()
+        self.sessions = {}
+        self.gauges = {}
+        self.actions = {}
+        self._lock = Lock()
+
+    def session(self, name):
+        """Create the metrics of a new session"""
+        metrics = Metrics(parent=self.metrics)
+        with self._lock:
+            self.sessions[name] = metrics
+        return metrics
+
+    def remove(self, name):
+        with self._lock:
+            self.sessions.pop(name, None)
+
+    def gauge(self, name, func):
+        """Register a function sampled in each report"""
+        self.gauges[name] = func
+
+    def action(self, name, func):
+        """Register an operator action, called with the query parameters as
+        string keyword arguments and returning a JSON serializable result
+        """
+        self.actions[name] = func
+
+    def report(self):
+        with self._lock:
+            sessions = dict(self.sessions)
+
+        return {
+            'timestamp': time.time(),
+            'global': self.metrics.summary(),
+            'gauges': { name: func() for name, func in self.gauges.items() },
+            'sessions': { name: metrics.summary() for name, metrics in sessions.items() } }
+
+    def serve(self, ip, port):
+        """Serve the report as JSON over HTTP from a background thread, and
+        the actions on POST requests
+        """
+        stats = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code, content):
+                body = json.dumps(content).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._reply(200, stats.report())
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                func = stats.actions.get(url.path.strip("/"))
+                if func is None:
+                    self._reply(404, { 'error': "unknown action %s" % url.path })
+                    return
+
+                try:
+                    result = func(**dict(parse_qsl(url.query)))
+                except (TypeError, ValueError, KeyError) as e:
+                    self._reply(400, { 'error': str(e.args[0]) if e.args else repr(e) })
+                    return
+                self._reply(200, result)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((ip, port), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def log_periodically(self, interval):
+        """Print the report as one JSON line every `interval` seconds"""
+        def log():
+            while True:
+                time.sleep(interval)
+                print(json.dumps({ 'stats': self.report() }), flush=True)
+
+        Thread(target=log, daemon=True).start()
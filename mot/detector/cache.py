@@ -0,0 +1,132 @@
+import os
+
+import numpy as np
+
+
+# One record per detected object
+RECORD_DTYPE = np.dtype([
+    ('box', '<f4', (4,)),   # tlbr box
+    ('score', '<f4'),
+    ('label', '<i4')])
+
+# One entry per frame: (frame index, first record, number of records)
+INDEX_DTYPE = np.dtype([
+    ('frame', '<i8'),
+    ('start', '<i8'),
+    ('count', '<i8')])
+
+
+class DetectionCache:
+    """Persistent per-video cache of precomputed detections
+
+    Detections are stored in two append-only binary files next to each other:
+        - <path>.det: detection records (`RECORD_DTYPE`) of all frames
+        - <path>.idx: frame index entries (`INDEX_DTYPE`)
+
+    Records are read through a memory map, so looking up the detections of a
+    frame neither parses text nor loads the whole file in memory.
+    """
+    def __init__(self, path):
+        """
+        Parameters:
+            - path: cache path prefix, usually one per video
+        """
+        self.path = path
+        self.data_path = path + ".det"
+        self.index_path = path + ".idx"
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        # Frame index -> (start, count)
+        self._index = {}
+        self._n_records = 0
+        if os.path.exists(self.index_path) and os.path.exists(self.data_path):
+            n_entries = os.path.getsize(self.index_path) // INDEX_DTYPE.itemsize
+            entries = np.fromfile(self.index_path, dtype=INDEX_DTYPE, count=n_entries)
+            n_records = os.path.getsize(self.data_path) // RECORD_DTYPE.itemsize
+
+            # Drop the entries and records of a partially written frame
+            entries = entries[entries['start']+entries['count'] <= n_records]
+            if len(entries) > 0:
+                self._n_records = int((entries['start']+entries['count']).max())
+            self._index = { int(f): (int(s), int(c)) for f, s, c in entries.tolist() }
+
+            os.truncate(self.index_path, len(entries)*INDEX_DTYPE.itemsize)
+            os.truncate(self.data_path, self._n_records*RECORD_DTYPE.itemsize)
+
+        self._records = None
+        self._data_file = None
+        self._index_file = None
+
+    @staticmethod
+    def for_video(video_path, cache_dir, tag="fasterrcnn"):
+        """Create the cache of a video file in the cache directory
+
+        The cache is keyed by the video file name, size and modification time,
+        so a modified video never reuses stale detections. The tag identifies
+        the detection model that produced the detections.
+        """
+        stat = os.stat(video_path)
+        name = "%s.%d.%d.%s" % (os.path.basename(video_path),
+                                stat.st_size, int(stat.st_mtime), tag)
+        return DetectionCache(os.path.join(cache_dir, name))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, frame):
+        return int(frame) in self._index
+
+    def _map(self):
+        """Memory map the records, remapping when the file has grown"""
+        if self._data_file is not None:
+            self._data_file.flush()
+            self._index_file.flush()
+
+        if self._records is None or len(self._records) < self._n_records:
+            self._records = np.memmap(self.data_path, dtype=RECORD_DTYPE,
+                                    mode='r', shape=(self._n_records,))
+        return self._records
+
+    def get(self, frame):
+        """Return the detection records of a frame
+
+        Return:
+            structured ndarray of `RECORD_DTYPE`, a view into the memory map
+        """
+        start, count = self._index[int(frame)]
+        if count == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return self._map()[start:start+count]
+
+    def put(self, frame, boxes, scores, labels):
+        """Append the detections of a frame to the cache"""
+        if int(frame) in self._index:
+            return
+
+        records = np.zeros(len(boxes), dtype=RECORD_DTYPE)
+        records['box'] = np.asarray(boxes).reshape(-1, 4)
+        records['score'] = scores
+        records['label'] = labels
+
+        if self._data_file is None:
+            self._data_file = open(self.data_path, 'ab')
+            self._index_file = open(self.index_path, 'ab')
+
+        # An index entry pointing at records that never reached the disk is
+        # dropped when the cache is opened again
+        entry = np.array([(int(frame), self._n_records, len(records))], dtype=INDEX_DTYPE)
+        self._data_file.write(records.tobytes())
+        self._index_file.write(entry.tobytes())
+
+        self._index[int(frame)] = (self._n_records, len(records))
+        self._n_records += len(records)
+
+    def close(self):
+        if self._data_file is not None:
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = None
+            self._index_file = None
+        self._records = None
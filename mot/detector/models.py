@@ -0,0 +1,172 @@
+import os
+
+import numpy as np
+import torch
+from torchvision.models.detection import fasterrcnn_resnet50_fpn
+
+from .cache import DetectionCache
+
+
+def _records_to_result(records):
+    """Convert cached detection records to a detection result"""
+    return {
+        'boxes': np.array(records['box']),
+        'scores': np.array(records['score']),
+        'labels': np.array(records['label']) }
+
+
+class FasterRCNNBackend:
+    """Torchvision Faster R-CNN detector running a batch of frames at once"""
+    name = "fasterrcnn"
+
+    def __init__(self, model_path=None, device=None):
+        """
+        Parameters:
+            - model_path: path to a state dict of the detector, the COCO
+                pretrained weights are used if it does not exist
+            - device: cuda or cpu device
+        """
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+
+        if model_path is not None and os.path.exists(model_path):
+            self.model = fasterrcnn_resnet50_fpn(num_classes=91, pretrained=False,
+                                                pretrained_backbone=False)
+            self.model.load_state_dict(torch.load(model_path, map_location=self.device))
+        else:
+            self.model = fasterrcnn_resnet50_fpn(num_classes=91, pretrained=True)
+        self.model.to(self.device)
+        self.model.eval()
+
+    def __call__(self, frames, frame_ids):
+        """Detect objects in uint8 BGR frames"""
+        inputs = [ torch.from_numpy(np.ascontiguousarray(frame[..., ::-1]))
+                        .to(self.device).permute(2, 0, 1).float().div_(255.)
+                    for frame in frames ]
+
+        with torch.no_grad():
+            predictions = self.model(inputs)
+
+        return [ {
+            'boxes': prediction['boxes'].cpu().numpy(),
+            'scores': prediction['scores'].cpu().numpy(),
+            'labels': prediction['labels'].cpu().numpy() }
+            for prediction in predictions ]
+
+
+class ReplayBackend:
+    """Detector replaying precomputed detections from a `DetectionCache`"""
+    name = "replay"
+
+    def __init__(self, cache):
+        if cache is None:
+            raise ValueError("Replay backend requires a detection cache")
+        self.cache = cache
+
+    def __call__(self, frames, frame_ids):
+        results = []
+        for frame_id in frame_ids:
+            if frame_id not in self.cache:
+                raise KeyError("Frame %d is not in detection cache %s" % (
+                                                    frame_id, self.cache.path))
+            results.append(_records_to_result(self.cache.get(frame_id)))
+        return results
+
+
+class ObjectDetector:
+    """Object detector with swappable backends
+
+    Here are the available backends:
+        - fasterrcnn: torchvision Faster R-CNN (default)
+        - replay: read detections from the detection cache only
+
+    When a cache is given to a model backend, frames already in the cache are
+    replayed and the detections of the other frames are appended to it, so
+    the first pass over a video fills the cache and every later pass (e.g.
+    when tuning tracker parameters) runs without inference. Detections are
+    cached before score and class filtering, so the thresholds can be changed
+    without invalidating the cache.
+    """
+    BACKENDS = {
+        FasterRCNNBackend.name: FasterRCNNBackend,
+        ReplayBackend.name: ReplayBackend,
+    }
+
+    def __init__(self, backend="fasterrcnn", cache=None,
+                score_threshold=0.7, classes=(1,), **kwargs):
+        """
+        Parameters:
+            - backend: name of the detection backend
+            - cache: a `DetectionCache`, a cache path, or None
+            - score_threshold: minimum confidence of reported detections
+            - classes: class labels to report (COCO label 1 is person), or
+                None for all classes
+            - kwargs: extra arguments of the backend (model_path, device)
+        """
+        backend = backend or FasterRCNNBackend.name
+        if backend not in self.BACKENDS:
+            raise ValueError("Unknown detector backend '%s', expected one of %s" % (
+                                                backend, list(self.BACKENDS)))
+
+        if isinstance(cache, str):
+            cache = DetectionCache(cache)
+        self.cache = cache
+
+        if backend == ReplayBackend.name:
+            self.backend = ReplayBackend(cache)
+        else:
+            self.backend = self.BACKENDS[backend](**kwargs)
+
+        self.score_threshold = score_threshold
+        self.classes = None if classes is None else np.asarray(classes)
+
+    def _filter(self, result):
+        keep = result['scores'] >= self.score_threshold
+        if self.classes is not None:
+            keep &= np.isin(result['labels'], self.classes)
+        return { key: value[keep] for key, value in result.items() }
+
+    def __call__(self, frames, frame_ids=None):
+        """Detect objects in a batch of frames
+
+        Parameters:
+        - frames: list of ndarray
+            uint8 BGR frames
+        - frame_ids: list of int
+            frame indices in the video, required to use the cache
+
+        Return:
+        - list of dict
+            One dictionary per frame with numpy arrays 'boxes' (Nx4 tlbr),
+            'scores' (N) and 'labels' (N)
+        """
+        if frame_ids is None:
+            if self.cache is not None or isinstance(self.backend, ReplayBackend):
+                raise ValueError("Frame indices are required to use the detection cache")
+            return [ self._filter(r) for r in self.backend(frames, frame_ids) ]
+
+        results = [None] * len(frames)
+
+        # Replay cached frames, detect the others
+        missing = []
+        for i, frame_id in enumerate(frame_ids):
+            if self.cache is not None and frame_id in self.cache:
+                results[i] = _records_to_result(self.cache.get(frame_id))
+            else:
+                missing.append(i)
+
+        if len(missing) > 0:
+            detected = self.backend([ frames[i] for i in missing ],
+                                    [ frame_ids[i] for i in missing ])
+            for i, result in zip(missing, detected):
+                results[i] = result
+                if self.cache is not None:
+                    self.cache.put(frame_ids[i],
+                                result['boxes'], result['scores'], result['labels'])
+
+        return [ self._filter(r) for r in results ]
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
@@ -0,0 +1,130 @@
+from threading import Lock
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+import torch
+
+
+class FramePreprocessor:
+    """Convert uint8 BGR HWC frames into float32 RGB CHW detector inputs
+
+    The conversion writes straight into preallocated buffers, casting,
+    transposing and scaling in place, instead of going through float64
+    intermediate copies of the full frame. Buffers are kept in a pool keyed by
+    shape and handed back with `release`, so there is no allocation in steady
+    state. Frames larger than the detector input size are first downscaled
+    into a pooled uint8 buffer, which also makes the conversion cheaper.
+
+    The number of pooled buffers is bounded: when frames come in many shapes
+    (e.g. cropped regions of interest), the buffers of the least recently used
+    shapes are dropped first.
+    """
+    def __init__(self, input_size=None, pool_size=16, max_buffers=None):
+        """
+        Parameters:
+            - input_size: size of the shorter side of the detector input,
+                frames with a larger shorter side are downscaled to it. None
+                to keep frames at their own size.
+            - pool_size: maximum number of free buffers kept for each shape
+            - max_buffers: maximum number of free buffers kept in each pool
+                whatever their shapes, 4*pool_size by default
+        """
+        self.input_size = input_size
+        self.pool_size = pool_size
+        self.max_buffers = max_buffers or 4*pool_size
+
+        self._lock = Lock()
+        self._tensors = _BufferPool()
+        self._frames = _BufferPool()
+
+    def _acquire(self, pool, shape, allocate):
+        with self._lock:
+            buffer = pool.pop(shape)
+        if buffer is None:
+            buffer = allocate(shape)
+        return buffer
+
+    def _release(self, pool, buffer):
+        with self._lock:
+            pool.push(tuple(buffer.shape), buffer, self.pool_size, self.max_buffers)
+
+    def release(self, tensor):
+        """Give a tensor returned by the preprocessor back to the pool"""
+        self._release(self._tensors, tensor)
+
+    def __call__(self, frame):
+        """Preprocess a frame
+
+        Parameters:
+        - frame: ndarray
+            uint8 BGR frame of shape (H, W, 3)
+
+        Return:
+        - (tensor, float)
+            float32 RGB tensor of shape (3, H', W') with values in [0, 1], and
+            the scale factor applied to the frame (boxes detected on the tensor
+            should be divided by it)
+        """
+        height, width = frame.shape[:2]
+        scale = 1.
+        resized = None
+
+        # Downscale large frames to the detector input size
+        if self.input_size is not None and min(height, width) > self.input_size:
+            scale = self.input_size / min(height, width)
+            height, width = int(round(height*scale)), int(round(width*scale))
+            resized = self._acquire(self._frames, (height, width, 3),
+                                    lambda shape: np.empty(shape, dtype=np.uint8))
+            cv2.resize(frame, (width, height), dst=resized, interpolation=cv2.INTER_AREA)
+            frame = resized
+
+        # Cast, swap channels and transpose in a single pass per channel
+        tensor = self._acquire(self._tensors, (3, height, width),
+                            lambda shape: torch.empty(shape, dtype=torch.float32))
+        source = torch.from_numpy(frame)
+        for channel in range(3):
+            tensor[channel].copy_(source[:, :, 2-channel])
+        tensor.mul_(1./255)
+
+        if resized is not None:
+            self._release(self._frames, resized)
+
+        return tensor, scale
+
+
+class _BufferPool:
+    """Free buffers by shape, shapes ordered from least to most recently used"""
+
+    def __init__(self):
+        self._free = OrderedDict()
+        self.count = 0
+
+    def pop(self, shape):
+        free = self._free.get(shape)
+        if not free:
+            return None
+        buffer = free.pop()
+        self.count -= 1
+        if len(free) == 0:
+            del self._free[shape]
+        else:
+            self._free.move_to_end(shape)
+        return buffer
+
+    def push(self, shape, buffer, per_shape, total):
+        free = self._free.get(shape, [])
+        if len(free) >= per_shape:
+            return
+        free.append(buffer)
+        self._free[shape] = free
+        self._free.move_to_end(shape)
+        self.count += 1
+
+        # Evict the buffers of the least recently used shapes
+        while self.count > total:
+            oldest, buffers = next(iter(self._free.items()))
+            buffers.pop()
+            self.count -= 1
+            if len(buffers) == 0:
+                del self._free[oldest]
@@ -0,0 +1,240 @@
+import time
+from queue import Queue, Empty, Full
+from threading import Thread, Event
+
+import numpy as np
+
+from .store import TrackWriter
+from .tracker.boxes import tlbr_to_xyah
+
+
+class Stage(Thread):
+    """One stage of a processing pipeline running in its own thread
+
+    A stage takes batches of up to `batch_size` items from its input queue,
+    processes them with `func` (a list of items in, a list of items out) and
+    puts the results in its output queue. A source stage has no input queue,
+    its `func` is an iterable yielding the items. The end of the stream is
+    propagated downstream with a None item.
+
+    Queues are bounded, so a slow stage applies back pressure on the stages
+    before it instead of letting items pile up in memory. When a stage fails,
+    the whole pipeline is aborted and the error is kept in `error`.
+    """
+
+    def __init__(self, name, func, inbox=None, outbox=None, batch_size=1,
+                abort=None, profiler=None):
+        """
+        Parameters:
+            - name: name of the stage in the reports
+            - func: batch processing function, or an iterable for a source stage
+            - inbox: input queue, None for a source stage
+            - outbox: output queue, None for a sink stage
+            - batch_size: maximum number of items passed to func at once
+            - abort: event shared by all the stages of the pipeline
+            - profiler: function creating the profiler of the stage thread
+                from the stage name (e.g. `FrameProfiler.from_env`), which
+                returns None when the stage is not profiled
+        """
+        super().__init__(name=name)
+        self.daemon = True
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.abort = abort or Event()
+        self.profiler = profiler
+
+        self.count = 0      # number of processed items
+        self.busy = 0.      # seconds spent in func
+        self.elapsed = 0.   # seconds from start to end of stream
+        self.error = None
+
+    def _get(self):
+        while not self.abort.is_set():
+            try:
+                return self.inbox.get(timeout=0.1)
+            except Empty:
+                pass
+        return None
+
+    def _put(self, item):
+        while self.outbox is not None and not self.abort.is_set():
+            try:
+                self.outbox.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def _batches(self):
+        """Yield the batches of the input queue until the end of stream"""
+        if self.inbox is None:
+            iterator = iter(self.func)
+            while not self.abort.is_set():
+                start = time.perf_counter()
+                item = next(iterator, None)
+                self.busy += time.perf_counter() - start
+                if item is None:
+                    return
+                yield [item]
+            return
+
+        finished = False
+        while not finished:
+            batch = []
+            while len(batch) < self.batch_size:
+                item = self._get()
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+
+            if len(batch) > 0:
+                yield batch
+
+    def run(self):
+        start = time.perf_counter()
+        profiler = self.profiler(self.name) if self.profiler is not None else None
+        try:
+            for batch in self._batches():
+                if self.inbox is None:
+                    results = batch
+                else:
+                    begin = time.perf_counter()
+                    results = self.func(batch)
+                    self.busy += time.perf_counter() - begin
+
+                self.count += len(batch)
+                for result in results:
+                    self._put(result)
+
+                if profiler is not None and profiler.active:
+                    profiler.step(len(batch))
+
+        except Exception as e:
+            self.error = e
+            self.abort.set()
+
+        finally:
+            self._put(None)
+            self.elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.stop()
+
+    def report(self):
+        """Return the stage throughput as a dictionary"""
+        return {
+            'stage': self.name,
+            'frames': self.count,
+            'busy_fps': self.count / self.busy if self.busy > 0 else float('inf'),
+            'fps': self.count / self.elapsed if self.elapsed > 0 else float('inf') }
+
+
+class OfflinePipeline:
+    """Throughput oriented tracking of a video file
+
+    Decoding, batched object detection, tracking and result writing run as
+    four concurrent stages connected by bounded queues:
+
+        [decode] -> [detect] -> [track] -> [write]
+
+    Each stage keeps its own thread busy as long as the stages around it
+    keep up, so the total throughput is bounded by the slowest stage rather
+    than by the sum of all of them. Tracking results are written either as
+    "frame,id,x,y,a,h" lines or to an indexed columnar track file.
+    """
+
+    def __init__(self, stream, detector, tracker, batch_size=8, queue_size=16, profiler=None):
+        """
+        Parameters:
+            - stream: started video stream (`VideoStream` or `ParallelVideoStream`)
+            - detector: `ObjectDetector`
+            - tracker: `Tracker`
+            - batch_size: number of frames per detection batch
+            - queue_size: maximum number of items between two stages
+            - profiler: function creating the profiler of each stage thread
+                from the stage name, or None
+        """
+        self.stream = stream
+        self.detector = detector
+        self.tracker = tracker
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.profiler = profiler
+        self.stages = []
+
+    def _decode(self):
+        frame_id = 0
+        while True:
+            frame = self.stream.read()
+            if frame is None:
+                return
+            # Frames returned by the stream are only valid until the next read
+            yield (frame_id, frame.copy())
+            frame_id += 1
+
+    def _detect(self, batch):
+        frame_ids = [ frame_id for frame_id, _ in batch ]
+        frames = [ frame for _, frame in batch ]
+        results = self.detector(frames, frame_ids)
+        return [ (frame_id, result['boxes'])
+                for frame_id, result in zip(frame_ids, results) ]
+
+    def _track(self, batch):
+        results = []
+        for frame_id, boxes in batch:
+            self.tracker.step(tlbr_to_xyah(np.asarray(boxes).reshape(-1, 4)))
+            ids, xyahs = self.tracker.confirmed()
+            results.append((frame_id, ids, xyahs))
+        return results
+
+    def _writer(self, output):
+        def write(batch):
+            if isinstance(output, TrackWriter):
+                for frame_id, ids, xyahs in batch:
+                    output.append(frame_id, ids, xyahs)
+                return []
+
+            lines = []
+            for frame_id, ids, xyahs in batch:
+                for tid, (x, y, a, h) in zip(ids.tolist(), xyahs.tolist()):
+                    lines.append("{},{},{},{},{},{}\n".format(frame_id, tid, x, y, a, h))
+            output.writelines(lines)
+            return []
+        return write
+
+    def run(self, output_path, columnar=False):
+        """Track the whole video and write the results to `output_path`
+
+        Parameters:
+            - output_path: output text file, or track file directory
+            - columnar: write a columnar track file instead of text lines
+
+        Return:
+            list of per stage reports (see `Stage.report`)
+        """
+        abort = Event()
+        queues = [ Queue(maxsize=self.queue_size) for _ in range(3) ]
+
+        output = TrackWriter(output_path) if columnar else open(output_path, "w")
+        with output:
+            self.stages = [
+                Stage("decode", self._decode(), outbox=queues[0],
+                    abort=abort, profiler=self.profiler),
+                Stage("detect", self._detect, queues[0], queues[1],
+                    batch_size=self.batch_size, abort=abort, profiler=self.profiler),
+                Stage("track", self._track, queues[1], queues[2],
+                    batch_size=self.batch_size, abort=abort, profiler=self.profiler),
+                Stage("write", self._writer(output), queues[2],
+                    batch_size=self.batch_size, abort=abort, profiler=self.profiler) ]
+
+            for stage in self.stages:
+                stage.start()
+            for stage in self.stages:
+                stage.join()
+
+        for stage in self.stages:
+            if stage.error is not None:
+                raise stage.error
+
+        return [ stage.report() for stage in self.stages ]
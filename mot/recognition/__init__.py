@@ -0,0 +1 @@
+from .gallery import FeatureGallery, cosine_distance
@@ -0,0 +1,113 @@
+import os
+import warnings
+
+import numpy as np
+import torch
+import torchvision
+from torchvision.ops import roi_align
+
+
+class FeatureExtractor:
+    """Batched re-identification feature extractor
+
+    All the detections of one or several frames are cropped and resized into a
+    single (K, 3, H, W) tensor with `roi_align`, then embedded with one forward
+    pass per `batch_size` crops instead of one forward pass per detection.
+
+    The embedding network is a ResNet-18 backbone without its classification
+    head. Weights of a re-identification model trained on this architecture
+    can be loaded from `model_path` (e.g. config['model']['recognition']['path']).
+    Without them the network is randomly initialized and its features are
+    meaningless for re-identification, which is only useful for testing.
+    """
+    MEAN = [0.485, 0.456, 0.406]
+    STD = [0.229, 0.224, 0.225]
+
+    def __init__(self, model_path=None, device="cpu", input_size=(128, 64), batch_size=64):
+        """
+        Parameters:
+            - model_path: path to the state dict of the embedding network,
+                None to run with random weights (a warning is issued)
+            - device: cuda or cpu device
+            - input_size: (height, width) of the crops fed to the network
+            - batch_size: maximum number of crops in a forward pass
+        """
+        self.device = torch.device(device)
+        self.input_size = tuple(input_size)
+        self.batch_size = batch_size
+
+        self.model = torchvision.models.resnet18()
+        self.model.fc = torch.nn.Identity()
+        if model_path is None:
+            warnings.warn("FeatureExtractor runs without re-identification weights, "
+                        "appearance features are random", RuntimeWarning)
+        elif not os.path.exists(model_path):
+            raise FileNotFoundError("Re-identification weights not found: %s" % model_path)
+        else:
+            self.model.load_state_dict(torch.load(model_path, map_location=self.device))
+        self.model.to(self.device)
+        self.model.eval()
+
+        self.feature_dim = 512
+        self._mean = torch.tensor(self.MEAN, device=self.device).view(1, 3, 1, 1)
+        self._std = torch.tensor(self.STD, device=self.device).view(1, 3, 1, 1)
+
+    def crop(self, frames, boxes):
+        """Crop and resize all the boxes of all the frames into one batch
+
+        Parameters:
+        - frames: list of ndarray
+            uint8 BGR frames of shape (H, W, 3)
+        - boxes: list of ndarray
+            Nx4 dimensional tlbr boxes of each frame
+
+        Return:
+        - tensor
+            (K, 3, input_height, input_width) float tensor in RGB order, where K
+            is the total number of boxes
+        """
+        crops = []
+        for frame, frame_boxes in zip(frames, boxes):
+            frame_boxes = np.asarray(frame_boxes, dtype=np.float32).reshape(-1, 4)
+            if len(frame_boxes) == 0:
+                continue
+
+            image = torch.from_numpy(np.ascontiguousarray(frame[..., ::-1]))
+            image = image.to(self.device).permute(2, 0, 1).unsqueeze(0).float()
+            rois = torch.from_numpy(frame_boxes).to(self.device)
+            crops.append(roi_align(image, [rois], self.input_size, aligned=True))
+
+        if len(crops) == 0:
+            return torch.zeros((0, 3)+self.input_size, device=self.device)
+
+        return torch.cat(crops)
+
+    def __call__(self, frames, boxes):
+        """Extract L2 normalized appearance features of all the boxes
+
+        Parameters:
+        - frames: ndarray or list of ndarray
+            a single uint8 BGR frame or a list of frames
+        - boxes: ndarray or list of ndarray
+            Nx4 dimensional tlbr boxes of the frame, or a list with the boxes
+            of each frame
+
+        Return:
+        - ndarray
+            KxD dimensional float32 features, in the order of the boxes
+        """
+        if isinstance(frames, np.ndarray) and frames.ndim == 3:
+            frames, boxes = [frames], [boxes]
+
+        crops = self.crop(frames, boxes)
+        features = []
+        with torch.no_grad():
+            for start in range(0, len(crops), self.batch_size):
+                batch = (crops[start:start+self.batch_size]/255. - self._mean) / self._std
+                embedding = self.model(batch)
+                features.append(torch.nn.functional.normalize(embedding, dim=1))
+
+        if len(features) == 0:
+            return np.zeros((0, self.feature_dim), dtype=np.float32)
+
+        return torch.cat(features).cpu().numpy()
@@ -0,0 +1,170 @@
+import numpy as np
+
+
+# Maximum number of (gallery feature, detection) similarities computed at
+# once by `FeatureGallery.distance`
+SIMILARITY_CHUNK = 1 << 20
+
+
+def cosine_distance(a, b, normalized=False):
+    """Compute pairwise cosine distance between two sets of features
+
+    Parameters:
+    - a: ndarray
+        NxD dimensional features
+    - b: ndarray
+        MxD dimensional features
+    - normalized: bool
+        If True, features are assumed to be already L2 normalized
+
+    Return:
+    - ndarray
+        NxM dimensional matrix, element (i, j) is 1 - cos(a[i], b[j])
+    """
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if not normalized:
+        a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+        b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+
+    return 1. - np.dot(a, b.T)
+
+
+class FeatureGallery:
+    """Bounded appearance feature gallery of the tracks
+
+    Every track owns a ring buffer of its `budget` most recent L2 normalized
+    appearance features. All ring buffers live in one preallocated
+    (capacity, budget, dim) array, so the distance between the tracks and the
+    new detections is computed with a few large matrix products, over chunks
+    of tracks that bound the size of the intermediate similarities.
+    """
+    def __init__(self, feature_dim, budget=100, capacity=64):
+        """
+        Parameters:
+            - feature_dim: dimension of the appearance features
+            - budget: maximum number of features kept for each track
+            - capacity: initial number of track slots, grows automatically
+        """
+        self.feature_dim = feature_dim
+        self.budget = budget
+
+        self._slots = {}    # track id -> slot index
+        self._free = []
+        self._features = np.zeros((0, budget, feature_dim), dtype=np.float32)
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._heads = np.zeros(0, dtype=np.int64)
+        self._grow(max(int(capacity), 1))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, track_id):
+        return int(track_id) in self._slots
+
+    def _grow(self, capacity):
+        old_capacity = len(self._counts)
+
+        features = np.zeros((capacity, self.budget, self.feature_dim), dtype=np.float32)
+        features[:old_capacity] = self._features
+        counts = np.zeros(capacity, dtype=np.int64)
+        counts[:old_capacity] = self._counts
+        heads = np.zeros(capacity, dtype=np.int64)
+        heads[:old_capacity] = self._heads
+
+        self._features, self._counts, self._heads = features, counts, heads
+        self._free.extend(range(capacity-1, old_capacity-1, -1))
+
+    def _slot(self, track_id):
+        """Return the slot of the track, allocating one if needed"""
+        slot = self._slots.get(track_id)
+        if slot is None:
+            if not self._free:
+                self._grow(2*len(self._counts))
+            slot = self._free.pop()
+            self._counts[slot] = 0
+            self._heads[slot] = 0
+            self._slots[track_id] = slot
+        return slot
+
+    def update(self, track_ids, features):
+        """Append new features to the galleries of the tracks
+
+        Parameters:
+        - track_ids: ndarray
+            N dimensional track ids
+        - features: ndarray
+            NxD dimensional features, one row for each entry of `track_ids`
+        """
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.feature_dim)
+        features = features / np.maximum(
+                        np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+        slots = np.array([ self._slot(int(tid)) for tid in track_ids ], dtype=np.int64)
+
+        # Features of the same track are written in order, one round at a time
+        remaining = np.arange(len(slots))
+        while len(remaining) > 0:
+            _, first = np.unique(slots[remaining], return_index=True)
+            rows = remaining[first]
+            s = slots[rows]
+
+            self._features[s, self._heads[s]] = features[rows]
+            self._heads[s] = (self._heads[s]+1) % self.budget
+            self._counts[s] = np.minimum(self._counts[s]+1, self.budget)
+
+            remaining = np.delete(remaining, first)
+
+    def remove(self, track_ids):
+        """Release the galleries of the given tracks"""
+        for tid in track_ids:
+            slot = self._slots.pop(int(tid), None)
+            if slot is not None:
+                self._free.append(slot)
+
+    def retain(self, track_ids):
+        """Release the galleries of all tracks not in `track_ids`"""
+        keep = set(int(tid) for tid in track_ids)
+        self.remove([ tid for tid in self._slots if tid not in keep ])
+
+    def distance(self, track_ids, features):
+        """Compute the appearance cost matrix between tracks and detections
+
+        The distance between a track and a detection is the smallest cosine
+        distance between the detection feature and any feature in the gallery
+        of the track. Tracks without any feature have infinite distance.
+
+        Parameters:
+        - track_ids: ndarray
+            N dimensional track ids
+        - features: ndarray
+            MxD dimensional detection features
+
+        Return:
+        - ndarray
+            NxM dimensional cost matrix
+        """
+        features = np.asarray(features, dtype=np.float32).reshape(-1, self.feature_dim)
+        features = features / np.maximum(
+                        np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+
+        cost_matrix = np.full((len(track_ids), len(features)), np.inf)
+        known = np.array([ int(tid) in self._slots for tid in track_ids ], dtype=bool)
+        if not np.any(known) or len(features) == 0:
+            return cost_matrix
+
+        slots = np.array([ self._slots[int(tid)] for tid in np.asarray(track_ids)[known] ])
+        max_similarity = np.empty((len(slots), len(features)), dtype=np.float32)
+        chunk = max(SIMILARITY_CHUNK // (self.budget*len(features)), 1)
+
+        for start in range(0, len(slots), chunk):
+            chunk_slots = slots[start:start+chunk]
+            gallery = self._features[chunk_slots]               # (k, budget, D)
+            valid = np.arange(self.budget)[None, :] < self._counts[chunk_slots][:, None]
+
+            similarity = np.matmul(gallery, features.T)         # (k, budget, M)
+            similarity[~valid] = -np.inf
+            max_similarity[start:start+chunk] = similarity.max(axis=1)
+
+        cost_matrix[known] = 1. - max_similarity
+
+        return cost_matrix
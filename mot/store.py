@@ -0,0 +1,282 @@
+import os
+
+import numpy as np
+
+
+# Columns of a track record: frame index, track id and (x, y, a, h) box
+TRACK_COLUMNS = (
+    ('frame', '<i4'),
+    ('id', '<i4'),
+    ('x', '<f4'),
+    ('y', '<f4'),
+    ('a', '<f4'),
+    ('h', '<f4'))
+
+# One entry per frame or per track: (key, first record, number of records)
+INDEX_DTYPE = np.dtype([
+    ('key', '<i8'),
+    ('start', '<i8'),
+    ('count', '<i8')])
+
+
+def _column_path(path, name):
+    return os.path.join(path, name + ".bin")
+
+def _index_path(path, name):
+    return os.path.join(path, name + ".idx")
+
+def _runs(keys):
+    """Index entries of the runs of equal values of a sorted key array"""
+    keys = np.asarray(keys)
+    if len(keys) == 0:
+        return np.zeros(0, dtype=INDEX_DTYPE)
+
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+    entries = np.zeros(len(starts), dtype=INDEX_DTYPE)
+    entries['key'] = keys[starts]
+    entries['start'] = starts
+    entries['count'] = np.diff(np.append(starts, len(keys)))
+    return entries
+
+def _track_index(ids):
+    """Build the per track index of an id column
+
+    Return:
+        (entries, order) where order lists the records sorted by track id (in
+        frame order within a track) and entries index runs of that order
+    """
+    order = np.argsort(ids, kind='stable').astype(np.int64)
+    return _runs(np.asarray(ids)[order]), order
+
+
+class TrackWriter:
+    """Append-only columnar writer of track records
+
+    A track file is a directory holding one raw little-endian file per
+    column (<path>/frame.bin, <path>/id.bin, ...). Records are appended to
+    all the columns at once, so reading one column back never touches the
+    others and every column can be memory mapped as a plain NumPy array.
+    Records must be appended in frame order.
+
+    Two indexes are kept next to the columns:
+        - frame.idx: one `INDEX_DTYPE` entry per frame, appended as soon as
+            the records of a frame are complete
+        - id.idx and id.order: the records sorted by track id and one entry
+            per track into that order, rebuilt when the writer is closed
+    """
+    def __init__(self, path, append=False):
+        """
+        Parameters:
+            - path: track file directory
+            - append: keep the records already in the directory, otherwise
+                the directory is cleared
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        # Drop the records that have not been written to all the columns
+        n_rows = count_rows(path) if append else 0
+        self._files = {}
+        for name, dtype in TRACK_COLUMNS:
+            column_path = _column_path(path, name)
+            if not os.path.exists(column_path):
+                open(column_path, 'wb').close()
+            os.truncate(column_path, n_rows*np.dtype(dtype).itemsize)
+            self._files[name] = open(column_path, 'ab')
+
+        # Rebuild the frame index of the kept records, the entry of the last
+        # frame stays pending as more records of that frame may follow
+        entries = _runs(read_columns(path)['frame'])
+        self._pending = entries[-1:].copy()
+        with open(_index_path(path, "frame"), 'wb') as f:
+            f.write(entries[:-1].tobytes())
+        self._index_file = open(_index_path(path, "frame"), 'ab')
+
+        self.n_rows = n_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, frames, ids, xyahs):
+        """Append records to the track file
+
+        Parameters:
+            - frames: N frame indices, or a single frame index for all records
+            - ids: N track ids
+            - xyahs: Nx4 dimensional (x, y, a, h) boxes
+        """
+        xyahs = np.asarray(xyahs).reshape(-1, 4)
+        n = len(xyahs)
+        if n == 0:
+            return
+
+        frames = np.broadcast_to(np.asarray(frames, dtype=np.int64), (n,))
+        if np.any(np.diff(frames) < 0) or (len(self._pending) > 0
+                                            and frames[0] < self._pending['key'][0]):
+            raise ValueError("Track records must be appended in frame order")
+
+        columns = {
+            'frame': frames,
+            'id': np.asarray(ids).reshape(n),
+            'x': xyahs[:, 0], 'y': xyahs[:, 1], 'a': xyahs[:, 2], 'h': xyahs[:, 3] }
+
+        for name, dtype in TRACK_COLUMNS:
+            self._files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+        # Merge the first frame with the pending entry, write the completed ones
+        entries = _runs(frames)
+        entries['start'] += self.n_rows
+        if len(self._pending) > 0 and self._pending['key'][0] == entries['key'][0]:
+            entries['start'][0] = self._pending['start'][0]
+            entries['count'][0] += self._pending['count'][0]
+        else:
+            entries = np.concatenate([self._pending, entries])
+
+        self._index_file.write(entries[:-1].tobytes())
+        self._pending = entries[-1:].copy()
+        self.n_rows += n
+
+    def close(self):
+        if len(self._files) == 0:
+            return
+
+        self._index_file.write(self._pending.tobytes())
+        self._index_file.close()
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+        # Records sorted by track id, frame order is kept within each track
+        entries, order = _track_index(read_columns(self.path)['id'])
+        order.tofile(os.path.join(self.path, "id.order"))
+        entries.tofile(_index_path(self.path, "id"))
+
+
+def count_rows(path):
+    """Number of complete records of a track file"""
+    counts = []
+    for name, dtype in TRACK_COLUMNS:
+        column_path = _column_path(path, name)
+        size = os.path.getsize(column_path) if os.path.exists(column_path) else 0
+        counts.append(size // np.dtype(dtype).itemsize)
+    return min(counts)
+
+
+def read_columns(path):
+    """Memory map the columns of a track file
+
+    Return:
+        dictionary of read-only arrays, one per column of `TRACK_COLUMNS`
+    """
+    n_rows = count_rows(path)
+    columns = {}
+    for name, dtype in TRACK_COLUMNS:
+        if n_rows == 0:
+            columns[name] = np.zeros(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(_column_path(path, name), dtype=dtype,
+                                    mode='r', shape=(n_rows,))
+    return columns
+
+
+class TrackStore:
+    """Memory mapped reader of a track file with frame and track lookups
+
+    Records of a frame range are a contiguous slice of the columns, so
+    `frames` returns views into the memory maps. Records of a track are
+    scattered over the file, `track` gathers them through the track index,
+    reading only the pages holding them. Nothing else is loaded in memory
+    but the two small indexes.
+    """
+    def __init__(self, path):
+        """
+        Parameters:
+            - path: track file directory
+        """
+        self.path = path
+        self.columns = read_columns(path)
+        self.n_rows = count_rows(path)
+
+        # Indexes are rebuilt in memory when missing or out of date (e.g.
+        # the writer has not been closed)
+        self._frame_index = self._load_index("frame")
+        if self._frame_index is None:
+            self._frame_index = _runs(self.columns['frame'])
+
+        self._track_index = self._load_index("id")
+        order_path = os.path.join(path, "id.order")
+        if self._track_index is not None and os.path.exists(order_path) \
+                and os.path.getsize(order_path) == self.n_rows*8:
+            self._order = np.memmap(order_path, dtype='<i8', mode='r') \
+                            if self.n_rows > 0 else np.zeros(0, dtype=np.int64)
+        else:
+            self._track_index, self._order = _track_index(self.columns['id'])
+
+    def _load_index(self, name):
+        index_path = _index_path(self.path, name)
+        if not os.path.exists(index_path):
+            return None
+
+        entries = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        if entries['count'].sum() != self.n_rows:
+            return None
+        return entries
+
+    def __len__(self):
+        return self.n_rows
+
+    def frame_range(self):
+        """Return the (first, last) frame indices of the track file"""
+        if len(self._frame_index) == 0:
+            return None
+        return int(self._frame_index['key'][0]), int(self._frame_index['key'][-1])
+
+    def track_ids(self):
+        """Return the ids of all the tracks"""
+        return self._track_index['key'].copy()
+
+    def _slice(self, start, end):
+        return { name: column[start:end] for name, column in self.columns.items() }
+
+    def frames(self, first, last=None):
+        """Return the records of the frames first..last (both included)
+
+        Return:
+            dictionary of column views, one per column of `TRACK_COLUMNS`
+        """
+        last = first if last is None else last
+        keys = self._frame_index['key']
+        lo = np.searchsorted(keys, first, side='left')
+        hi = np.searchsorted(keys, last, side='right')
+        if lo >= hi:
+            return self._slice(0, 0)
+
+        entries = self._frame_index[lo:hi]
+        return self._slice(int(entries['start'][0]),
+                        int(entries['start'][-1] + entries['count'][-1]))
+
+    def track(self, tid):
+        """Return the records of a track in frame order
+
+        Return:
+            dictionary of column arrays, one per column of `TRACK_COLUMNS`
+        """
+        keys = self._track_index['key']
+        i = np.searchsorted(keys, tid)
+        if i >= len(keys) or keys[i] != tid:
+            return { name: column[:0] for name, column in self.columns.items() }
+
+        entry = self._track_index[i]
+        rows = np.asarray(self._order[entry['start']:entry['start']+entry['count']])
+
+        # Records of a track are in frame order, a contiguous track is a view
+        if len(rows) > 0 and rows[-1] - rows[0] == len(rows) - 1:
+            return self._slice(int(rows[0]), int(rows[-1]) + 1)
+        return { name: np.asarray(column[rows]) for name, column in self.columns.items() }
+
+    def xyahs(self, records):
+        """Stack the box columns of lookup results into a Nx4 array"""
+        return np.stack([ records[name] for name in "xyah" ], axis=1)
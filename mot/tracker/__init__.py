@@ -0,0 +1,2 @@
+from .kalman import KalmanFilter, FastKalmanFilter
+from .tracker import Tracker, TrackState
@@ -0,0 +1,130 @@
+import numpy as np
+
+
+# Bounding box formats used across the project, every function operates on
+# the last axis of [..., 4] shaped ndarrays or torch tensors
+#   - xyah: center position (x, y), aspect ratio a (width/height), height h
+#   - tlbr: top left corner (x1, y1), bottom right corner (x2, y2)
+#   - tlwh: top left corner (x1, y1), width w, height h
+
+
+def _is_tensor(boxes):
+    return type(boxes).__module__.split(".")[0] == "torch"
+
+
+def _stack(boxes, columns):
+    """Stack columns along the last axis with the library of the input"""
+    if _is_tensor(boxes):
+        import torch
+        return torch.stack(columns, dim=-1)
+    return np.stack(columns, axis=-1)
+
+
+def _as_boxes(boxes):
+    if _is_tensor(boxes):
+        return boxes
+    return np.asarray(boxes, dtype=np.float64)
+
+
+def xyah_to_tlbr(boxes):
+    boxes = _as_boxes(boxes)
+    cx, cy, a, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    w = a*h
+    return _stack(boxes, [cx-w/2, cy-h/2, cx+w/2, cy+h/2])
+
+
+def tlbr_to_xyah(boxes):
+    boxes = _as_boxes(boxes)
+    x1, y1, x2, y2 = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    w, h = x2-x1, y2-y1
+    return _stack(boxes, [(x1+x2)/2, (y1+y2)/2, w/h, h])
+
+
+def tlwh_to_tlbr(boxes):
+    boxes = _as_boxes(boxes)
+    x1, y1, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    return _stack(boxes, [x1, y1, x1+w, y1+h])
+
+
+def tlbr_to_tlwh(boxes):
+    boxes = _as_boxes(boxes)
+    x1, y1, x2, y2 = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    return _stack(boxes, [x1, y1, x2-x1, y2-y1])
+
+
+def xyah_to_tlwh(boxes):
+    boxes = _as_boxes(boxes)
+    cx, cy, a, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    w = a*h
+    return _stack(boxes, [cx-w/2, cy-h/2, w, h])
+
+
+def tlwh_to_xyah(boxes):
+    boxes = _as_boxes(boxes)
+    x1, y1, w, h = boxes[..., 0], boxes[..., 1], boxes[..., 2], boxes[..., 3]
+    return _stack(boxes, [x1+w/2, y1+h/2, w/h, h])
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Compute pairwise intersection over union between two sets of boxes
+
+    Box corners are inclusive pixel coordinates, as in the original IoU of
+    the server: a box spans x2-x1+1 by y2-y1+1 pixels, so boxes sharing only
+    their border still overlap by one pixel row or column.
+
+    Parameters:
+    - boxes_a: ndarray or tensor
+        Nx4 dimensional boxes in tlbr format
+    - boxes_b: ndarray or tensor
+        Mx4 dimensional boxes in tlbr format
+
+    Return:
+    - ndarray or tensor
+        NxM dimensional matrix, element (i, j) is the IoU between box i of
+        `boxes_a` and box j of `boxes_b`
+    """
+    boxes_a, boxes_b = _as_boxes(boxes_a), _as_boxes(boxes_b)
+    if _is_tensor(boxes_a):
+        import torch
+        maximum, minimum = torch.maximum, torch.minimum
+    else:
+        boxes_a, boxes_b = boxes_a.reshape(-1, 4), boxes_b.reshape(-1, 4)
+        maximum, minimum = np.maximum, np.minimum
+
+    # Intersection rectangle of every pair
+    tl_x = maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    tl_y = maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    br_x = minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    br_y = minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    inter_area = (br_x-tl_x+1).clip(min=0) * (br_y-tl_y+1).clip(min=0)
+
+    area_a = (boxes_a[:, 2]-boxes_a[:, 0]+1) * (boxes_a[:, 3]-boxes_a[:, 1]+1)
+    area_b = (boxes_b[:, 2]-boxes_b[:, 0]+1) * (boxes_b[:, 3]-boxes_b[:, 1]+1)
+    union_area = area_a[:, None] + area_b[None, :] - inter_area
+
+    return inter_area / union_area.clip(min=1e-12)
+
+
+def iou_cost(boxes_a, boxes_b, max_cost=np.inf, gate=None):
+    """Compute the IoU based cost matrix (1 - IoU) for linear assignment
+
+    Parameters:
+    - boxes_a: ndarray
+        Nx4 dimensional boxes in tlbr format (e.g. tracks)
+    - boxes_b: ndarray
+        Mx4 dimensional boxes in tlbr format (e.g. detections)
+    - max_cost: float
+        Pairs whose cost is larger than `max_cost` are gated out
+    - gate: ndarray
+        Optional NxM dimensional boolean mask, pairs set to False are gated out
+
+    Return:
+    - ndarray
+        NxM dimensional cost matrix where gated pairs are set to np.inf
+    """
+    cost_matrix = 1. - iou_matrix(boxes_a, boxes_b)
+    cost_matrix[cost_matrix > max_cost] = np.inf
+    if gate is not None:
+        cost_matrix[~gate] = np.inf
+
+    return cost_matrix
@@ -0,0 +1,288 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.csgraph
+from scipy.optimize import linear_sum_assignment
+
+
+# Offset added to the gating threshold for pairs that are not allowed to be
+# matched, so the solver still sees a finite (feasible) cost matrix
+GATED_COST_OFFSET = 1e-5
+
+# `assignment` only solves a problem with `sparse_assignment` when its cost
+# matrix has at least SPARSE_MIN_ENTRIES entries and at most a
+# SPARSE_MAX_DENSITY fraction of candidate pairs. Below that, the constant
+# cost of labeling the components outweighs the smaller problems.
+SPARSE_MIN_ENTRIES = 250000
+SPARSE_MAX_DENSITY = 0.05
+
+
+def _empty_result(n_rows, n_cols):
+    matches = np.empty((0, 2), dtype=np.int64)
+    unmatched_rows = np.arange(n_rows, dtype=np.int64)
+    unmatched_cols = np.arange(n_cols, dtype=np.int64)
+    return matches, unmatched_rows, unmatched_cols
+
+
+def _split_result(matches, n_rows, n_cols):
+    """Derive unmatched rows and columns from the matched pairs"""
+    matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+
+    row_mask = np.ones(n_rows, dtype=bool)
+    row_mask[matches[:, 0]] = False
+    col_mask = np.ones(n_cols, dtype=bool)
+    col_mask[matches[:, 1]] = False
+
+    return matches, np.flatnonzero(row_mask), np.flatnonzero(col_mask)
+
+
+def linear_assignment(cost_matrix, max_cost=np.inf):
+    """Solve the linear assignment problem on a dense cost matrix
+
+    The problem is solved with the Jonker-Volgenant variant of the hungarian
+    algorithm shipped with scipy. Pairs whose cost exceeds `max_cost` are never
+    reported as matches.
+
+    Parameters:
+    - cost_matrix: ndarray or scipy.sparse matrix
+        NxM dimensional cost matrix between N rows (tracks) and M columns
+        (detections). Non-finite entries are treated as gated out, as well as
+        the entries that are not stored in a sparse matrix.
+    - max_cost: float
+        Gating threshold, pairs with a larger cost are disregarded
+
+    Return:
+    - (ndarray, ndarray, ndarray)
+        Kx2 dimensional array of matched (row, col) indices, indices of the
+        unmatched rows, and indices of the unmatched columns.
+    """
+    if scipy.sparse.issparse(cost_matrix):
+        coo = scipy.sparse.coo_matrix(cost_matrix)
+        cost_matrix = np.full(coo.shape, np.inf)
+        cost_matrix[coo.row, coo.col] = coo.data
+    cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+    n_rows, n_cols = cost_matrix.shape
+    if n_rows == 0 or n_cols == 0:
+        return _empty_result(n_rows, n_cols)
+
+    gated = ~np.isfinite(cost_matrix) | (cost_matrix > max_cost)
+    if gated.all():
+        return _empty_result(n_rows, n_cols)
+
+    # Replace gated entries by a value just above every admissible cost
+    if np.any(gated):
+        if np.isfinite(max_cost):
+            fill_value = max_cost + GATED_COST_OFFSET
+        else:
+            fill_value = np.abs(cost_matrix[~gated]).max()*2 + 1.
+        cost_matrix = np.where(gated, fill_value, cost_matrix)
+
+    rows, cols = linear_sum_assignment(cost_matrix)
+    valid = ~gated[rows, cols]
+    matches = np.stack([rows[valid], cols[valid]], axis=1)
+
+    return _split_result(matches, n_rows, n_cols)
+
+
+def sparse_assignment(cost_matrix, max_cost=np.inf):
+    """Solve the linear assignment problem on a sparse set of candidate pairs
+
+    After gating, most of the tracks can only be matched with a handful of
+    detections. The bipartite graph of candidate pairs is split into connected
+    components and each component is solved independently, which turns one
+    big O((N+M)^3) problem into many tiny ones. Components that consist of a
+    single candidate pair are matched without calling the solver at all.
+
+    Parameters:
+    - cost_matrix: ndarray or scipy.sparse matrix
+        NxM dimensional cost matrix. For a dense matrix, the candidate pairs
+        are the finite entries no larger than `max_cost`. For a sparse matrix,
+        the candidate pairs are its explicitly stored entries no larger than
+        `max_cost`.
+    - max_cost: float
+        Gating threshold, pairs with a larger cost are disregarded
+
+    Return:
+    - (ndarray, ndarray, ndarray)
+        Kx2 dimensional array of matched (row, col) indices, indices of the
+        unmatched rows, and indices of the unmatched columns.
+    """
+    if scipy.sparse.issparse(cost_matrix):
+        coo = scipy.sparse.coo_matrix(cost_matrix)
+        rows, cols, costs = coo.row, coo.col, coo.data.astype(np.float64)
+        n_rows, n_cols = coo.shape
+    else:
+        cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+        n_rows, n_cols = cost_matrix.shape
+        rows, cols = np.nonzero(np.isfinite(cost_matrix) & (cost_matrix <= max_cost))
+        costs = cost_matrix[rows, cols]
+
+    keep = np.isfinite(costs) & (costs <= max_cost)
+    rows, cols, costs = rows[keep].astype(np.int64), cols[keep].astype(np.int64), costs[keep]
+    if len(costs) == 0:
+        return _empty_result(n_rows, n_cols)
+
+    # Label connected components of the bipartite graph. Rows are nodes
+    # [0, N) and columns are nodes [N, N+M).
+    n_nodes = n_rows + n_cols
+    graph = scipy.sparse.coo_matrix(
+                    (np.ones(len(costs)), (rows, cols+n_rows)),
+                    shape=(n_nodes, n_nodes))
+    _, labels = scipy.sparse.csgraph.connected_components(graph, directed=False)
+    pair_labels = labels[rows]
+    row_counts = np.bincount(labels[:n_rows], minlength=n_nodes)
+    col_counts = np.bincount(labels[n_rows:], minlength=n_nodes)
+
+    # Components with a single row or a single column (including single
+    # pairs) are solved by their cheapest pair, all at once
+    star = (row_counts[pair_labels] == 1) | (col_counts[pair_labels] == 1)
+    order = np.lexsort((costs[star], pair_labels[star]))
+    star_labels = pair_labels[star][order]
+    first = np.ones(len(star_labels), dtype=bool)
+    first[1:] = star_labels[1:] != star_labels[:-1]
+    matches = [np.stack([rows[star][order][first], cols[star][order][first]], axis=1)]
+
+    general = ~star
+    if not np.any(general):
+        return _split_result(matches[0], n_rows, n_cols)
+
+    # Index of each row and column within its component, from one stable
+    # sort of the nodes by component label
+    local_index = np.empty(n_nodes, dtype=np.int64)
+    for offset, node_labels in ((0, labels[:n_rows]), (n_rows, labels[n_rows:])):
+        node_order = np.argsort(node_labels, kind='stable')
+        sorted_labels = node_labels[node_order]
+        group_starts = np.searchsorted(sorted_labels, sorted_labels, side='left')
+        local_index[offset + node_order] = np.arange(len(node_order)) - group_starts
+
+    # Solve the remaining components one by one
+    order = np.argsort(pair_labels[general], kind='stable')
+    comp_rows = rows[general][order]
+    comp_cols = cols[general][order]
+    comp_costs = costs[general][order]
+    comp_labels = pair_labels[general][order]
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(comp_labels)) + 1, [len(comp_labels)]])
+
+    if np.isfinite(max_cost):
+        fill_value = max_cost + GATED_COST_OFFSET
+    else:
+        fill_value = np.abs(costs).max()*2 + 1.
+
+    local_rows = local_index[comp_rows]
+    local_cols = local_index[comp_cols + n_rows]
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        label = comp_labels[start]
+        r, c = local_rows[start:end], local_cols[start:end]
+
+        sub_matrix = np.full((row_counts[label], col_counts[label]), fill_value)
+        sub_matrix[r, c] = comp_costs[start:end]
+        candidate = np.zeros(sub_matrix.shape, dtype=bool)
+        candidate[r, c] = True
+
+        # Map local indices back through the pairs of the component
+        global_rows = np.empty(sub_matrix.shape[0], dtype=np.int64)
+        global_rows[r] = comp_rows[start:end]
+        global_cols = np.empty(sub_matrix.shape[1], dtype=np.int64)
+        global_cols[c] = comp_cols[start:end]
+
+        sub_rows, sub_cols = linear_sum_assignment(sub_matrix)
+        valid = candidate[sub_rows, sub_cols]
+        matches.append(np.stack([
+                        global_rows[sub_rows[valid]],
+                        global_cols[sub_cols[valid]]], axis=1))
+
+    return _split_result(np.concatenate(matches), n_rows, n_cols)
+
+
+def assignment(cost_matrix, max_cost=np.inf):
+    """Solve the linear assignment problem with the fastest of the dense and
+    sparse solvers for the given cost matrix
+
+    Large matrices with few candidate pairs go to `sparse_assignment`, all
+    the others to `linear_assignment`. Both return the same optimal cost.
+
+    Parameters:
+    - cost_matrix: ndarray or scipy.sparse matrix
+        NxM dimensional cost matrix
+    - max_cost: float
+        Gating threshold, pairs with a larger cost are disregarded
+
+    Return:
+    - (ndarray, ndarray, ndarray)
+        Kx2 dimensional array of matched (row, col) indices, indices of the
+        unmatched rows, and indices of the unmatched columns.
+    """
+    n_entries = cost_matrix.shape[0] * cost_matrix.shape[1]
+    if n_entries < SPARSE_MIN_ENTRIES:
+        return linear_assignment(cost_matrix, max_cost)
+
+    if scipy.sparse.issparse(cost_matrix):
+        n_candidates = cost_matrix.nnz
+    else:
+        cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+        n_candidates = np.count_nonzero(cost_matrix <= max_cost)
+
+    if n_candidates > SPARSE_MAX_DENSITY * n_entries:
+        return linear_assignment(cost_matrix, max_cost)
+    return sparse_assignment(cost_matrix, max_cost)
+
+
+def matching_cascade(cost_matrix, track_ages, max_cost=np.inf,
+                    cascade_depth=30, sparse=None):
+    """Run the DeepSORT matching cascade
+
+    Tracks that have been updated more recently are given priority. At level
+    k of the cascade, only the tracks that were last updated k+1 frames ago are
+    matched against the detections that are still unmatched.
+
+    Parameters:
+    - cost_matrix: ndarray or scipy.sparse matrix
+        NxM dimensional cost matrix between N tracks and M detections
+    - track_ages: ndarray
+        N dimensional vector, number of frames since each track was last
+        updated with a measurement
+    - max_cost: float
+        Gating threshold, pairs with a larger cost are disregarded
+    - cascade_depth: int
+        Number of cascade levels, should be the maximum track age
+    - sparse: bool
+        Solve each level with `sparse_assignment` (True) or
+        `linear_assignment` (False), None to let `assignment` pick the
+        solver of each level
+
+    Return:
+    - (ndarray, ndarray, ndarray)
+        Kx2 dimensional array of matched (track, detection) indices, indices
+        of the unmatched tracks, and indices of the unmatched detections.
+    """
+    if scipy.sparse.issparse(cost_matrix):
+        cost_matrix = scipy.sparse.csr_matrix(cost_matrix)
+    else:
+        cost_matrix = np.asarray(cost_matrix, dtype=np.float64)
+    n_rows, n_cols = cost_matrix.shape
+    track_ages = np.asarray(track_ages).reshape(-1)
+    if sparse is None:
+        solver = assignment
+    else:
+        solver = sparse_assignment if sparse else linear_assignment
+
+    matches = []
+    unmatched_cols = np.arange(n_cols, dtype=np.int64)
+    for level in range(cascade_depth):
+        if len(unmatched_cols) == 0:
+            break
+
+        level_rows = np.flatnonzero(track_ages == 1+level)
+        if len(level_rows) == 0:
+            continue
+
+        sub_matrix = cost_matrix[level_rows][:, unmatched_cols]
+        level_matches, _, remaining = solver(sub_matrix, max_cost)
+        matches.append(np.stack([
+                        level_rows[level_matches[:, 0]],
+                        unmatched_cols[level_matches[:, 1]]], axis=1))
+        unmatched_cols = unmatched_cols[remaining]
+
+    if len(matches) == 0:
+        return _empty_result(n_rows, n_cols)
+
+    return _split_result(np.concatenate(matches), n_rows, n_cols)
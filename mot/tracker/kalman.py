@@ -2,6 +2,84 @@ import numpy as np
 import scipy.linalg
 
 
+# Table for the 0.95 quantile of the chi-square distribution with N degrees of
+# freedom (contains values for N=1, ..., 9). It is used as the gating threshold
+# of the squared mahalanobis distance.
+chi2inv95 = {
+    1: 3.8415,
+    2: 5.9915,
+    3: 7.8147,
+    4: 9.4877,
+    5: 11.070,
+    6: 12.592,
+    7: 14.067,
+    8: 15.507,
+    9: 16.919}
+
+def _inverse_lower(factors):
+    """Invert a batch of lower triangular matrices by forward substitution
+
+    Each step solves one row of the inverses for the whole batch at once,
+    which is much cheaper than `np.linalg.inv` on many small matrices.
+
+    Parameters:
+    - factors: ndarray
+        NxDxD dimensional lower triangular matrices (e.g. Cholesky factors)
+
+    Return:
+    - ndarray
+        NxDxD dimensional lower triangular inverses
+    """
+    n_dim = factors.shape[-1]
+    inverses = np.zeros_like(factors)
+    for i in range(n_dim):
+        # Row i of L^-1 is (e_i - sum_{k<i} L[i, k] L^-1[k]) / L[i, i]
+        row = -np.einsum('nk,nkj->nj', factors[:, i, :i], inverses[:, :i])
+        row[:, i] += 1.
+        inverses[:, i] = row / factors[:, i, i, None]
+    return inverses
+
+def _expanded_distances(track_quadratic, measurement_quadratic,
+                        weighted_means, offsets, measurements):
+    """Evaluate (z-u)^T S^-1 (z-u) = z^T S^-1 z - 2 u^T S^-1 z + u^T S^-1 u for
+    all the pairs of tracks and measurements with a single matrix product
+
+    The track and measurement terms are stacked into NxK and KxM matrices, so
+    the NxM result is written once instead of once per term.
+
+    Parameters:
+    - track_quadratic: ndarray
+        NxQ dimensional track coefficients of z^T S^-1 z (e.g. flattened S^-1)
+    - measurement_quadratic: ndarray
+        MxQ dimensional matching measurement terms (e.g. flattened z z^T)
+    - weighted_means: ndarray
+        NxD dimensional S^-1 u of the tracks
+    - offsets: ndarray
+        N dimensional u^T S^-1 u of the tracks
+    - measurements: ndarray
+        MxD dimensional measurements z
+
+    Return:
+    - ndarray
+        The NxM dimensional squared mahalanobis distances
+    """
+    n_quadratic = track_quadratic.shape[1]
+    n_terms = n_quadratic + measurements.shape[1] + 1
+
+    tracks = np.empty((len(track_quadratic), n_terms))
+    tracks[:, :n_quadratic] = track_quadratic
+    tracks[:, n_quadratic:-1] = -2. * weighted_means
+    tracks[:, -1] = offsets
+
+    terms = np.empty((n_terms, len(measurements)))
+    terms[:n_quadratic] = measurement_quadratic.T
+    terms[n_quadratic:-1] = measurements.T
+    terms[-1] = 1.
+
+    squared_maha = np.dot(tracks, terms)
+    np.maximum(squared_maha, 0., out=squared_maha)
+    return squared_maha
+
 class KalmanFilter:
     """Kalman filter for predicting bounding boxes in image space
 
@@ -19,6 +97,8 @@ class KalmanFilter:
     The motion model is a constant velocity model. The bounding box location
     (x, y, a, h) is taken as direct observation.
     """
+    covariance_shape = (8, 8)
+
     def __init__(self):
         """
         Attributes:
@@ -179,3 +259,506 @@ class KalmanFilter:
             kalman_gain, projected_covariance, kalman_gain.T))
 
         return mean, covariance
+
+    def initiate_batch(self, measurements):
+        """Create tracks from a batch of unassociated measurements
+
+        Parameters:
+        - measurements: ndarray
+            Nx4 dimensional bounding box coordinates (x, y, a, h)
+
+        Return:
+        - (ndarray, ndarray)
+            Return the Nx8 mean matrix and Nx8x8 covariance tensor of the new
+            tracks.
+        """
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        n_tracks = len(measurements)
+
+        # Mean matrix
+        means = np.zeros((n_tracks, 8))
+        means[:, :4] = measurements
+
+        # Covariance tensor
+        heights = measurements[:, 3]
+        std = np.empty((n_tracks, 8))
+        std[:, [0, 1, 3]] = (2 * self._std_position * heights)[:, None]
+        std[:, 2] = 1e-2
+        std[:, [4, 5, 7]] = (10 * self._std_velocity * heights)[:, None]
+        std[:, 6] = 1e-5
+        covariances = np.zeros((n_tracks, 8, 8))
+        covariances[:, np.arange(8), np.arange(8)] = np.square(std)
+
+        return means, covariances
+
+    def predict_batch(self, means, covariances):
+        """Run Kalman filter prediction step on a batch of tracks
+
+        Parameters:
+        - means: ndarray
+            The Nx8 dimensional mean matrix of the object states at the
+            previous time step.
+        - covariances: ndarray
+            The Nx8x8 dimensional covariance tensor of the object states at the
+            previous time step.
+
+        Return:
+        - (ndarray, ndarray)
+            Returns the mean matrix and covariance tensor of the predicted states
+        """
+        # Noise for covariance tensor
+        heights = means[:, 3]
+        std = np.empty((len(means), 8))
+        std[:, [0, 1, 3]] = (self._std_position * heights)[:, None]
+        std[:, 2] = 1e-2
+        std[:, [4, 5, 7]] = (self._std_velocity * heights)[:, None]
+        std[:, 6] = 1e-5
+
+        # Update mean matrix and covariance tensor
+        means = np.dot(means, self._motion_mat.T)
+        covariances = np.matmul(
+                            np.matmul(self._motion_mat, covariances),
+                            self._motion_mat.T)
+        covariances[:, np.arange(8), np.arange(8)] += np.square(std)
+
+        return means, covariances
+
+    def _project_batch(self, means, covariances):
+        """Project a batch of means and covariances to measurement space
+
+        Parameters:
+        - means: ndarray
+            The Nx8 dimensional predicted mean matrix
+        - covariances: ndarray
+            The Nx8x8 dimensional predicted covariance tensor
+
+        Return:
+        - (ndarray, ndarray)
+            Projected means in measurement space (Nx4 dimensional), and
+            projected covariances in measurement space (Nx4x4 dimensional)
+        """
+        # Noise for projected covariance tensor
+        heights = means[:, 3]
+        std = np.empty((len(means), 4))
+        std[:, [0, 1, 3]] = (self._std_position * heights)[:, None]
+        std[:, 2] = 1e-1
+
+        # The projection matrix only selects the position part of the state
+        projected_means = means[:, :4].copy()
+        projected_covariances = covariances[:, :4, :4].copy()
+        projected_covariances[:, np.arange(4), np.arange(4)] += np.square(std)
+
+        return projected_means, projected_covariances
+
+    def update_batch(self, means, covariances, measurements):
+        """Run Kalman filter correction step on a batch of tracks
+
+        Parameters:
+        - means: ndarray
+            The Nx8 dimensional predicted mean matrix.
+        - covariances: ndarray
+            The Nx8x8 dimensional predicted covariance tensor.
+        - measurements: ndarray
+            The Nx4 dimensional measurement matrix, one (x, y, a, h) row for
+            each track.
+
+        Return:
+        - (ndarray, ndarray)
+            Returns the measurement-corrected state distributions
+        """
+        projected_means, projected_covariances = self._project_batch(means, covariances)
+
+        # Calculate kalman gain. The projected covariances are symmetric, so
+        # solving S K^T = H P for every track at once gives the gain directly.
+        cross_covariances = np.matmul(covariances, self._project_mat.T)
+        kalman_gains = np.linalg.solve(
+                                projected_covariances,
+                                np.swapaxes(cross_covariances, 1, 2))
+        kalman_gains = np.swapaxes(kalman_gains, 1, 2)
+
+        # Update means and covariances with measurements
+        innovations = measurements - projected_means
+        means = means + np.einsum('nij,nj->ni', kalman_gains, innovations)
+        covariances = covariances - np.matmul(
+                                np.matmul(kalman_gains, projected_covariances),
+                                np.swapaxes(kalman_gains, 1, 2))
+
+        return means, covariances
+
+    def gating_distance(self, means, covariances, measurements, only_position=False):
+        """Compute squared mahalanobis distance between tracks and measurements
+
+        Parameters:
+        - means: ndarray
+            The Nx8 dimensional predicted mean matrix of the tracks.
+        - covariances: ndarray
+            The Nx8x8 dimensional predicted covariance tensor of the tracks.
+        - measurements: ndarray
+            The Mx4 dimensional measurement matrix, each row is (x, y, a, h)
+        - only_position: bool
+            If True, distance computation is done with respect to the bounding
+            box center position (x, y) only.
+
+        Return:
+        - ndarray
+            The NxM dimensional distance matrix, where element (i, j) is the
+            squared mahalanobis distance between track i and measurement j.
+            Compare it against `chi2inv95` to gate out unlikely associations.
+        """
+        means = np.asarray(means, dtype=np.float64).reshape(-1, 8)
+        covariances = np.asarray(covariances, dtype=np.float64).reshape(-1, 8, 8)
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+
+        # Project all tracks to measurement space at once
+        projected_means, projected_covariances = self._project_batch(means, covariances)
+        if only_position:
+            projected_means = projected_means[:, :2]
+            projected_covariances = projected_covariances[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        # Factor each innovation covariance once to get its inverse S^-1
+        chol_factors = np.linalg.cholesky(projected_covariances)
+        inv_chol_factors = _inverse_lower(chol_factors)
+        precisions = np.matmul(np.swapaxes(inv_chol_factors, 1, 2), inv_chol_factors)
+
+        # Expand the distance so that all the pairs are solved together with
+        # one matrix product. Both sides are centered first to keep the
+        # expansion numerically stable.
+        n_dim = measurements.shape[1]
+        center = measurements.mean(axis=0) if len(measurements) else 0.
+        measurements = measurements - center
+        projected_means = projected_means - center
+
+        # S^-1 is symmetric, z^T S^-1 z only needs its upper triangle with
+        # the off-diagonal terms counted twice
+        rows, cols = np.triu_indices(n_dim)
+        quadratic = precisions[:, rows, cols] * np.where(rows == cols, 1., 2.)
+        weighted_means = np.einsum('nij,nj->ni', precisions, projected_means)
+        return _expanded_distances(
+                    quadratic,
+                    measurements[:, rows] * measurements[:, cols],
+                    weighted_means,
+                    np.einsum('ni,ni->n', weighted_means, projected_means),
+                    measurements)
+
+
+class FastKalmanFilter:
+    """Kalman filter exploiting the structure of the constant velocity model
+
+    The motion matrix of `KalmanFilter` only couples each coordinate of
+    (x, y, a, h) with its own velocity, the process and measurement noises are
+    diagonal and the projection selects the position rows. A covariance that
+    starts block diagonal (as built by `initiate`) therefore stays made of four
+    independent 2x2 (position, velocity) blocks forever, and the filter reduces
+    to closed-form scalar math on each coordinate, without any 8x8 product or
+    matrix factorization.
+
+    Means are the same 8 dimensional vectors as `KalmanFilter`. Covariances
+    are stored as 4x3 matrices, one row per coordinate holding the
+    (position variance, position-velocity covariance, velocity variance) of
+    its block. `to_full` and `from_full` convert between both forms.
+    """
+    covariance_shape = (4, 3)
+
+    def __init__(self, check=False, rtol=1e-6, atol=1e-9):
+        """
+        Parameters:
+        - check: bool
+            Accuracy mode, every result is compared with the one of the
+            general `KalmanFilter` and an AssertionError is raised when they
+            differ. It is much slower than both filters, use it to validate.
+        - rtol, atol: float
+            Relative and absolute tolerances of the accuracy mode
+        """
+        self._std_position = 1. / 20
+        self._std_velocity = 1. / 160
+
+        # Noise standard deviations of (x, y, a, h) are `h*scale + offset`,
+        # the aspect ratio one does not depend on the height
+        self._height_scale = np.array([1., 1., 0., 1.])
+        self._aspect_offset = np.array([0., 0., 1., 0.])
+
+        self.check = check
+        self.rtol = rtol
+        self.atol = atol
+        self._reference = KalmanFilter() if check else None
+
+    def _variances(self, heights, std, aspect_std):
+        """Nx4 diagonal noise variances of a batch of tracks"""
+        return np.square(heights[:, None]*(std*self._height_scale)
+                        + aspect_std*self._aspect_offset)
+
+    def initiate(self, measurement):
+        """Create track from unassociated measurement
+
+        Parameters:
+        - measurement: ndarray
+            bounding box coordinate (x, y, a, h) with center position (x,y)
+            aspect ratio a, and height h
+
+        Return:
+        - (ndarray, ndarray)
+            Return the mean vector (8 dimensional) and covariance blocks (4x3
+            dimensional) of the new track.
+        """
+        mean, covariance = self.initiate_batch(np.reshape(measurement, (1, 4)))
+        return mean[0], covariance[0]
+
+    def predict(self, mean, covariance):
+        """Run Kalman filter prediction step
+
+        The single track case is dominated by the overhead of numpy calls on
+        tiny arrays, so it is done with python floats.
+
+        Parameters:
+        - mean: ndarray
+            The 8 dimensional mean vector at the previous time step.
+        - covariance: ndarray
+            The 4x3 dimensional covariance blocks at the previous time step.
+
+        Return:
+        - (ndarray, ndarray)
+            Returns the mean vector and covariance blocks of the predicted state
+        """
+        x = mean.tolist()
+        h = x[3]
+        position_noise = (self._std_position*h)**2
+        velocity_noise = (self._std_velocity*h)**2
+
+        # x' = x + v, P' = F P F^T + Q on each 2x2 block
+        blocks = []
+        for i, (p, c, v) in enumerate(covariance.tolist()):
+            q_p, q_v = (1e-2**2, 1e-5**2) if i == 2 else (position_noise, velocity_noise)
+            blocks.append((p + 2*c + v + q_p, c + v, v + q_v))
+        predicted_mean = np.array([x[0]+x[4], x[1]+x[5], x[2]+x[6], x[3]+x[7]] + x[4:])
+        predicted_covariance = np.array(blocks)
+
+        if self.check:
+            expected = self._reference.predict(mean, self.to_full(covariance))
+            self._compare("predict", expected, (predicted_mean, predicted_covariance))
+        return predicted_mean, predicted_covariance
+
+    def update(self, mean, covariance, measurement):
+        """Run Kalman filter correction step
+
+        Parameters:
+        - mean: ndarray
+            The predicted state's mean vector (8 dimensional).
+        - covariance: ndarray
+            The state's covariance blocks (4x3 dimensional)
+        - measurement: ndarray
+            The 4 dimensional measurement vector (x, y, a, h)
+
+        Return:
+        - (ndarray, ndarray)
+            Returns the measurement-corrected state distribution
+        """
+        x = mean.tolist()
+        z = np.asarray(measurement, dtype=np.float64).tolist()
+        measurement_noise = (self._std_position*x[3])**2
+
+        # The innovation covariance of each coordinate is the scalar p + r,
+        # the kalman gain of its block is (p, c) / (p + r)
+        positions, velocities, blocks = [], [], []
+        for i, (p, c, v) in enumerate(covariance.tolist()):
+            r = 1e-1**2 if i == 2 else measurement_noise
+            s = 1. / (p + r)
+            innovation = z[i] - x[i]
+            positions.append(x[i] + p*s*innovation)
+            velocities.append(x[4+i] + c*s*innovation)
+            blocks.append((p*r*s, c*r*s, v - c*c*s))
+        updated_mean = np.array(positions + velocities)
+        updated_covariance = np.array(blocks)
+
+        if self.check:
+            expected = self._reference.update(mean, self.to_full(covariance), measurement)
+            self._compare("update", expected, (updated_mean, updated_covariance))
+        return updated_mean, updated_covariance
+
+    def initiate_batch(self, measurements):
+        """Create tracks from a batch of unassociated measurements
+
+        Parameters:
+        - measurements: ndarray
+            Nx4 dimensional bounding box coordinates (x, y, a, h)
+
+        Return:
+        - (ndarray, ndarray)
+            Return the Nx8 mean matrix and Nx4x3 covariance blocks of the new
+            tracks.
+        """
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+
+        means = np.zeros((len(measurements), 8))
+        means[:, :4] = measurements
+
+        heights = measurements[:, 3]
+        covariances = np.zeros((len(measurements), 4, 3))
+        covariances[:, :, 0] = self._variances(heights, 2*self._std_position, 1e-2)
+        covariances[:, :, 2] = self._variances(heights, 10*self._std_velocity, 1e-5)
+
+        if self.check:
+            expected = self._reference.initiate_batch(measurements)
+            self._compare("initiate_batch", expected, (means, covariances))
+        return means, covariances
+
+    def predict_batch(self, means, covariances):
+        """Run Kalman filter prediction step on a batch of tracks
+
+        Parameters:
+        - means: ndarray
+            The Nx8 dimensional mean matrix at the previous time step.
+        - covariances: ndarray
+            The Nx4x3 dimensional covariance blocks at the previous time step.
+
+        Return:
+        - (ndarray, ndarray)
+            Returns the mean matrix and covariance blocks of the predicted states
+        """
+        p, c, v = covariances[:, :, 0], covariances[:, :, 1], covariances[:, :, 2]
+        heights = means[:, 3]
+
+        predicted_means = means.copy()
+        predicted_means[:, :4] += means[:, 4:]
+
+        predicted_covariances = np.empty_like(covariances)
+        np.add(c, v, out=predicted_covariances[:, :, 1])
+        predicted_covariances[:, :, 0] = p + c + predicted_covariances[:, :, 1] \
+                        + self._variances(heights, self._std_position, 1e-2)
+        predicted_covariances[:, :, 2] = v + self._variances(heights, self._std_velocity, 1e-5)
+
+        if self.check:
+            expected = self._reference.predict_batch(means, self.to_full(covariances))
+            self._compare("predict_batch", expected, (predicted_means, predicted_covariances))
+        return predicted_means, predicted_covariances
+
+    def update_batch(self, means, covariances, measurements):
+        """Run Kalman filter correction step on a batch of tracks
+
+        Parameters:
+        - means: ndarray
+            The Nx8 dimensional predicted mean matrix.
+        - covariances: ndarray
+            The Nx4x3 dimensional predicted covariance blocks.
+        - measurements: ndarray
+            The Nx4 dimensional measurement matrix, one (x, y, a, h) row for
+            each track.
+
+        Return:
+        - (ndarray, ndarray)
+            Returns the measurement-corrected state distributions
+        """
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+        p, c, v = covariances[:, :, 0], covariances[:, :, 1], covariances[:, :, 2]
+        noises = self._variances(means[:, 3], self._std_position, 1e-1)
+        inv_innovations = 1. / (p + noises)
+        innovations = (measurements - means[:, :4]) * inv_innovations
+
+        updated_means = np.empty_like(means)
+        updated_means[:, :4] = means[:, :4] + p*innovations
+        updated_means[:, 4:] = means[:, 4:] + c*innovations
+
+        updated_covariances = np.empty_like(covariances)
+        noises *= inv_innovations
+        np.multiply(p, noises, out=updated_covariances[:, :, 0])
+        np.multiply(c, noises, out=updated_covariances[:, :, 1])
+        updated_covariances[:, :, 2] = v - c*c*inv_innovations
+
+        if self.check:
+            expected = self._reference.update_batch(
+                                    means, self.to_full(covariances), measurements)
+            self._compare("update_batch", expected, (updated_means, updated_covariances))
+        return updated_means, updated_covariances
+
+    def gating_distance(self, means, covariances, measurements, only_position=False):
+        """Compute squared mahalanobis distance between tracks and measurements
+
+        The innovation covariances are diagonal, so the distance is a sum of
+        squared normalized innovations over the coordinates.
+
+        Parameters:
+        - means: ndarray
+            The Nx8 dimensional predicted mean matrix of the tracks.
+        - covariances: ndarray
+            The Nx4x3 dimensional predicted covariance blocks of the tracks.
+        - measurements: ndarray
+            The Mx4 dimensional measurement matrix, each row is (x, y, a, h)
+        - only_position: bool
+            If True, distance computation is done with respect to the bounding
+            box center position (x, y) only.
+
+        Return:
+        - ndarray
+            The NxM dimensional distance matrix, to compare against `chi2inv95`
+        """
+        means = np.asarray(means, dtype=np.float64).reshape(-1, 8)
+        covariances = np.asarray(covariances, dtype=np.float64).reshape(-1, 4, 3)
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+
+        n_dim = 2 if only_position else 4
+        precisions = 1. / (covariances[:, :n_dim, 0] + self._variances(
+                                    means[:, 3], self._std_position, 1e-1)[:, :n_dim])
+
+        # Same centered expansion as `KalmanFilter.gating_distance`, with
+        # diagonal precisions
+        positions = measurements[:, :n_dim]
+        center = positions.mean(axis=0) if len(positions) else 0.
+        positions = positions - center
+        projected_means = means[:, :n_dim] - center
+
+        weighted_means = precisions * projected_means
+        squared_maha = _expanded_distances(
+                            precisions,
+                            np.square(positions),
+                            weighted_means,
+                            np.einsum('ni,ni->n', weighted_means, projected_means),
+                            positions)
+
+        if self.check:
+            expected = self._reference.gating_distance(
+                                    means, self.to_full(covariances),
+                                    measurements, only_position)
+            self._compare("gating_distance", (expected,), (squared_maha,), blocks=(False,))
+        return squared_maha
+
+    @staticmethod
+    def to_full(covariance):
+        """Expand 4x3 (or Nx4x3) covariance blocks to 8x8 (or Nx8x8) matrices"""
+        covariance = np.asarray(covariance, dtype=np.float64)
+        full = np.zeros(covariance.shape[:-2] + (8, 8))
+        position, velocity = np.arange(4), np.arange(4, 8)
+        full[..., position, position] = covariance[..., 0]
+        full[..., position, velocity] = covariance[..., 1]
+        full[..., velocity, position] = covariance[..., 1]
+        full[..., velocity, velocity] = covariance[..., 2]
+        return full
+
+    @staticmethod
+    def from_full(covariance):
+        """Extract the 4x3 (or Nx4x3) blocks of 8x8 (or Nx8x8) covariances
+
+        Terms coupling different coordinates are dropped, they are zero for
+        any track created by `initiate`.
+        """
+        covariance = np.asarray(covariance, dtype=np.float64)
+        position, velocity = np.arange(4), np.arange(4, 8)
+        return np.stack([
+            covariance[..., position, position],
+            covariance[..., position, velocity],
+            covariance[..., velocity, velocity]], axis=-1)
+
+    def _compare(self, name, expected, actual, blocks=(False, True)):
+        """Check results against the general filter in accuracy mode
+
+        `blocks` flags the outputs that are covariance blocks, expanded to
+        full matrices before the comparison, by default for (mean, covariance).
+        """
+        for reference, value, block in zip(expected, actual, blocks):
+            reference = np.asarray(reference)
+            if block:
+                value = self.to_full(value)
+            if not np.allclose(value, reference, rtol=self.rtol, atol=self.atol):
+                error = np.max(np.abs(value - reference))
+                raise AssertionError(
+                    "FastKalmanFilter.{} differs from KalmanFilter (max error {:.3g})"
+                    .format(name, error))
@@ -0,0 +1,300 @@
+import numpy as np
+
+from .kalman import KalmanFilter, FastKalmanFilter, chi2inv95
+from .hungarian import matching_cascade, assignment
+from .boxes import iou_cost, xyah_to_tlbr
+from ..recognition.gallery import FeatureGallery
+
+
+class TrackState:
+    """Enumeration of the track states
+
+    Newly created tracks are tentative until enough evidence has been
+    collected. Then, the track state is changed to confirmed. Tracks that are
+    no longer alive are marked deleted and removed at the end of the frame.
+    """
+    TENTATIVE = 1
+    CONFIRMED = 2
+    DELETED = 3
+
+
+class Tracker:
+    """Multi-object tracker keeping all the tracks in struct-of-arrays form
+
+    Each track is a row in a set of preallocated arrays. Active tracks always
+    occupy the leading rows [0, n_tracks), so every step of the per-frame
+    pipeline (predict, gate, assign, update, spawn/delete) is expressed as an
+    array operation over all tracks, without per-track python objects.
+
+    Here are the arrays kept for each track:
+        - means: (8,) kalman state (x, y, a, h, vx, vy, va, vh)
+        - covariances: (8, 8) kalman state covariance, or its (4, 3) blocks
+            with the fast kalman filter
+        - ages: number of frames since the track was created
+        - hits: number of measurement updates
+        - time_since_update: number of frames since the last measurement update
+        - states: one of the `TrackState` values
+        - ids: unique track identity
+
+    Appearance features, when used, are kept in a `FeatureGallery` keyed by
+    track id.
+    """
+    def __init__(self, max_age=30, n_init=3, max_iou_distance=0.7,
+                max_cosine_distance=0.2, nn_budget=100,
+                gating_threshold=chi2inv95[4], capacity=64, fast_kalman=False):
+        """
+        Parameters:
+            - max_age: maximum number of missed frames before a track is deleted
+            - n_init: number of consecutive hits before a track is confirmed
+            - max_iou_distance: maximum (1 - IoU) cost of the IoU matching
+            - max_cosine_distance: maximum appearance cost of the matching
+                cascade, only used when detections come with features
+            - nn_budget: maximum number of appearance features kept per track
+            - gating_threshold: gating threshold of the squared mahalanobis
+                distance between a track and a detection
+            - capacity: initial number of preallocated track rows, the arrays
+                grow automatically when more tracks are alive
+            - fast_kalman: use the closed-form `FastKalmanFilter` instead of
+                the general `KalmanFilter`
+        """
+        self.max_age = max_age
+        self.n_init = n_init
+        self.max_iou_distance = max_iou_distance
+        self.max_cosine_distance = max_cosine_distance
+        self.nn_budget = nn_budget
+        self.gating_threshold = gating_threshold
+        self.gallery = None
+
+        self.kalman = FastKalmanFilter() if fast_kalman else KalmanFilter()
+        self.n_tracks = 0
+        self._next_id = 1
+        self._allocate(max(int(capacity), 1))
+
+    def _allocate(self, capacity):
+        """Allocate (or grow) the track arrays to hold `capacity` tracks"""
+        arrays = {
+            '_means': np.zeros((capacity, 8)),
+            '_covariances': np.zeros((capacity,) + self.kalman.covariance_shape),
+            '_ages': np.zeros(capacity, dtype=np.int64),
+            '_hits': np.zeros(capacity, dtype=np.int64),
+            '_time_since_update': np.zeros(capacity, dtype=np.int64),
+            '_states': np.zeros(capacity, dtype=np.int8),
+            '_ids': np.zeros(capacity, dtype=np.int64),
+        }
+        for name, array in arrays.items():
+            if hasattr(self, name):
+                array[:self.n_tracks] = getattr(self, name)[:self.n_tracks]
+            setattr(self, name, array)
+        self.capacity = capacity
+
+    @property
+    def means(self):
+        return self._means[:self.n_tracks]
+
+    @property
+    def covariances(self):
+        return self._covariances[:self.n_tracks]
+
+    @property
+    def ages(self):
+        return self._ages[:self.n_tracks]
+
+    @property
+    def hits(self):
+        return self._hits[:self.n_tracks]
+
+    @property
+    def time_since_update(self):
+        return self._time_since_update[:self.n_tracks]
+
+    @property
+    def states(self):
+        return self._states[:self.n_tracks]
+
+    @property
+    def ids(self):
+        return self._ids[:self.n_tracks]
+
+    def predict(self):
+        """Propagate all the track state distributions one time step forward"""
+        n = self.n_tracks
+        if n == 0:
+            return
+
+        self._means[:n], self._covariances[:n] = self.kalman.predict_batch(
+                                                    self._means[:n],
+                                                    self._covariances[:n])
+        self._ages[:n] += 1
+        self._time_since_update[:n] += 1
+
+    def update(self, measurements, features=None):
+        """Run one tracking step with the detections of the current frame
+
+        `predict` should be called once before each call to `update`.
+
+        Parameters:
+        - measurements: ndarray
+            Mx4 dimensional detections (x, y, a, h) of the current frame
+        - features: ndarray
+            Optional MxD dimensional appearance features of the detections.
+            When given, the matching cascade uses the appearance distance to
+            the feature gallery of the tracks instead of the mahalanobis one.
+
+        Return:
+        - ndarray
+            M dimensional vector, the id of the track each detection has been
+            assigned to (either an existing track or a newly spawned one).
+        """
+        measurements = np.asarray(measurements, dtype=np.float64).reshape(-1, 4)
+
+        if features is not None:
+            features = np.asarray(features, dtype=np.float32)
+            features = features.reshape(-1, features.shape[-1])
+            if len(features) != len(measurements):
+                raise ValueError("Got %d feature vectors for %d detections" % (
+                                len(features), len(measurements)))
+            if self.gallery is None:
+                self.gallery = FeatureGallery(features.shape[1],
+                                            budget=self.nn_budget,
+                                            capacity=self.capacity)
+
+        # Associate tracks and detections
+        matches, unmatched_rows, unmatched_dets = self._match(measurements, features)
+
+        # Update matched tracks
+        rows, dets = matches[:, 0], matches[:, 1]
+        if len(rows) > 0:
+            self._means[rows], self._covariances[rows] = self.kalman.update_batch(
+                                                    self._means[rows],
+                                                    self._covariances[rows],
+                                                    measurements[dets])
+            self._hits[rows] += 1
+            self._time_since_update[rows] = 0
+            confirmed = rows[(self._states[rows] == TrackState.TENTATIVE)
+                            & (self._hits[rows] >= self.n_init)]
+            self._states[confirmed] = TrackState.CONFIRMED
+
+        # Mark missed tracks as deleted
+        missed = unmatched_rows[
+                    (self._states[unmatched_rows] == TrackState.TENTATIVE)
+                    | (self._time_since_update[unmatched_rows] > self.max_age)]
+        self._states[missed] = TrackState.DELETED
+
+        # Remove deleted tracks and spawn new tracks
+        assigned_ids = np.zeros(len(measurements), dtype=np.int64)
+        assigned_ids[dets] = self._ids[rows]
+        self._compact()
+        assigned_ids[unmatched_dets] = self._spawn(measurements[unmatched_dets])
+
+        # Keep appearance features of the alive tracks only
+        if self.gallery is not None:
+            self.gallery.retain(self.ids)
+            if features is not None:
+                self.gallery.update(assigned_ids, features)
+
+        return assigned_ids
+
+    def step(self, measurements, features=None):
+        """Run predict and update for one frame"""
+        self.predict()
+        return self.update(measurements, features)
+
+    def confirmed(self):
+        """Return ids and (x, y, a, h) boxes of the confirmed tracks that
+        have been updated in the current frame
+        """
+        mask = ((self.states == TrackState.CONFIRMED)
+                & (self.time_since_update == 0))
+        return self.ids[mask], self.means[mask, :4]
+
+    def _match(self, measurements, features=None):
+        """Associate tracks with detections
+
+        Confirmed tracks are matched first in the matching cascade ordered by
+        the time since their last update. Tentative tracks and confirmed tracks
+        missed only in the last frame are then matched against the leftover
+        detections by IoU.
+        """
+        n = self.n_tracks
+        cost_matrix = self.kalman.gating_distance(
+                                    self._means[:n],
+                                    self._covariances[:n],
+                                    measurements)
+
+        confirmed_rows = np.flatnonzero(self.states == TrackState.CONFIRMED)
+        tentative_rows = np.flatnonzero(self.states != TrackState.CONFIRMED)
+
+        # Matching cascade on confirmed tracks, with appearance cost gated by
+        # the mahalanobis distance when features are available
+        cascade_cost, max_cost = cost_matrix[confirmed_rows], self.gating_threshold
+        if features is not None:
+            appearance_cost = self.gallery.distance(self._ids[confirmed_rows], features)
+            appearance_cost[cascade_cost > self.gating_threshold] = np.inf
+            cascade_cost, max_cost = appearance_cost, self.max_cosine_distance
+
+        cascade_matches, _, unmatched_dets = matching_cascade(
+                                    cascade_cost,
+                                    self._time_since_update[confirmed_rows],
+                                    max_cost,
+                                    self.max_age)
+        cascade_matches[:, 0] = confirmed_rows[cascade_matches[:, 0]]
+
+        # IoU matching of the remaining candidates
+        missed_rows = np.setdiff1d(confirmed_rows, cascade_matches[:, 0])
+        iou_rows = np.concatenate([
+                        tentative_rows,
+                        missed_rows[self._time_since_update[missed_rows] == 1]])
+        iou_cost_matrix = iou_cost(
+                        xyah_to_tlbr(self._means[iou_rows, :4]),
+                        xyah_to_tlbr(measurements[unmatched_dets]),
+                        self.max_iou_distance)
+        iou_matches, _, remaining = assignment(
+                        iou_cost_matrix, self.max_iou_distance)
+        iou_matches = np.stack([
+                        iou_rows[iou_matches[:, 0]],
+                        unmatched_dets[iou_matches[:, 1]]], axis=1)
+
+        matches = np.concatenate([cascade_matches, iou_matches])
+        unmatched_rows = np.setdiff1d(np.arange(n), matches[:, 0])
+        unmatched_dets = unmatched_dets[remaining]
+
+        return matches, unmatched_rows, unmatched_dets
+
+    def _compact(self):
+        """Remove deleted tracks by moving alive tracks to the leading rows"""
+        n = self.n_tracks
+        alive = np.flatnonzero(self._states[:n] != TrackState.DELETED)
+        if len(alive) == n:
+            return
+
+        for name in ('_means', '_covariances', '_ages', '_hits',
+                    '_time_since_update', '_states', '_ids'):
+            array = getattr(self, name)
+            array[:len(alive)] = array[alive]
+        self.n_tracks = len(alive)
+
+    def _spawn(self, measurements):
+        """Create new tentative tracks from unassociated detections"""
+        n_new = len(measurements)
+        if n_new == 0:
+            return np.empty(0, dtype=np.int64)
+
+        if self.n_tracks + n_new > self.capacity:
+            capacity = self.capacity
+            while self.n_tracks + n_new > capacity:
+                capacity *= 2
+            self._allocate(capacity)
+
+        start, end = self.n_tracks, self.n_tracks + n_new
+        self._means[start:end], self._covariances[start:end] = \
+                                    self.kalman.initiate_batch(measurements)
+        self._ages[start:end] = 1
+        self._hits[start:end] = 1
+        self._time_since_update[start:end] = 0
+        self._states[start:end] = TrackState.TENTATIVE
+        self._ids[start:end] = np.arange(self._next_id, self._next_id+n_new)
+
+        self._next_id += n_new
+        self.n_tracks = end
+
+        return self._ids[start:end].copy()
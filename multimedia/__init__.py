@@ -1 +1,2 @@
 from .stream import VideoStream
+from .parallel import ParallelVideoStream
@@ -0,0 +1,243 @@
+import multiprocessing as mp
+from queue import Empty
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+def _is_live(source):
+    """Cameras and network streams cannot be split by frame range"""
+    return source.isdecimal() or "://" in source
+
+
+def _decode_worker(source, start, end, resolution, shm_name, shape,
+                    free_queue, ready_queue, run_event, stop_event, latest=False):
+    """Decode frames [start, end) of the source into the shared frame ring
+
+    Only the slots owned by this worker are written. A slot index is taken from
+    `free_queue`, filled with the resized frame and announced on `ready_queue`
+    as (frame index, slot). A None item marks the end of the frame range.
+    Decoding waits while `run_event` is cleared. With `latest`, the source
+    frames are dropped while no slot is free instead of piling up in the
+    capture buffers, so the next decoded frame is a recent one.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    stream = cv2.VideoCapture(int(source) if source.isdecimal() else source)
+    if start > 0:
+        stream.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+    raw = None
+    frame_idx = start
+    try:
+        while end is None or frame_idx < end:
+            slot = None
+            grabbed = True
+            while slot is None and grabbed and not stop_event.is_set():
+                if not run_event.wait(timeout=0.5):
+                    continue
+                try:
+                    slot = free_queue.get(block=not latest, timeout=0.5)
+                except Empty:
+                    if latest:
+                        grabbed = stream.grab()
+            if slot is None:
+                break
+
+            ret, raw = stream.read(raw)
+            if not ret:
+                break
+
+            cv2.resize(raw, resolution, dst=frames[slot])
+            ready_queue.put((frame_idx, slot))
+            frame_idx += 1
+    finally:
+        ready_queue.put(None)
+        stream.release()
+        del frames
+        shm.close()
+
+
+class ParallelVideoStream:
+    """Video reader decoding in worker processes into shared memory
+
+    A video file is split into `workers` contiguous frame ranges, each decoded
+    by its own process, so offline decoding scales with the number of cores
+    instead of competing for the GIL with the tracker. A live source (camera
+    or network stream) is decoded by a single process.
+
+    Frames are written into a `multiprocessing.shared_memory` ring where each
+    worker owns `queue_size` slots. The consumer reads the frame ranges in
+    order, which restores the frame order, and `read` returns a view into
+    shared memory without any copy. The returned frame stays valid until the
+    next call to `read`.
+
+    The buffering policies are the ones of `VideoStream`:
+        - lossless: every frame is returned (default for video files)
+        - latest: `read` skips to the newest decoded frame and the decoder
+            drops frames while the ring is full, so the consumer always gets
+            a recent frame (default for live sources)
+
+    `pause` suspends decoding until the next `start`, the frames already in
+    the ring can still be read.
+
+    Seeking relies on `CAP_PROP_POS_FRAMES`, which is frame accurate for most
+    but not all codecs.
+    """
+
+    POLICIES = ("lossless", "latest")
+
+    def __init__(self, source="0", queue_size=8, resolution=(1024, 768), workers=None,
+                policy=None):
+        self.source = source
+        self.queue_size = max(int(queue_size), 2)
+        self.resolution = resolution
+        self.policy = policy or ("latest" if _is_live(source) else "lossless")
+        if self.policy not in self.POLICIES:
+            raise ValueError("Unknown buffering policy '%s'" % self.policy)
+        self.state = "pause"
+
+        # Split the video into frame ranges
+        if _is_live(source):
+            ranges = [ (0, None) ]
+        else:
+            stream = cv2.VideoCapture(source)
+            if not stream.isOpened():
+                raise Exception("Fail to connect to video source %s" % source)
+            n_frames = int(stream.get(cv2.CAP_PROP_FRAME_COUNT))
+            stream.release()
+
+            workers = max(1, min(workers or mp.cpu_count(), n_frames))
+            bounds = np.linspace(0, n_frames, workers+1).astype(int)
+            ranges = [ (int(s), int(e)) for s, e in zip(bounds[:-1], bounds[1:]) ]
+            ranges[-1] = (ranges[-1][0], None)  # read until the end of the file
+
+        # Shared frame ring, queue_size slots per worker
+        width, height = resolution
+        shape = (len(ranges)*self.queue_size, height, width, 3)
+        self._shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        self._frames = np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf)
+
+        self._run_event = mp.Event()
+        self._stop_event = mp.Event()
+        self._free_queues = []
+        self._ready_queues = []
+        self._processes = []
+        for i, (start, end) in enumerate(ranges):
+            free_queue, ready_queue = mp.Queue(), mp.Queue()
+            for slot in range(i*self.queue_size, (i+1)*self.queue_size):
+                free_queue.put(slot)
+
+            process = mp.Process(target=_decode_worker,
+                                args=(source, start, end, resolution,
+                                    self._shm.name, shape,
+                                    free_queue, ready_queue,
+                                    self._run_event, self._stop_event,
+                                    self.policy == "latest"),
+                                daemon=True)
+            self._free_queues.append(free_queue)
+            self._ready_queues.append(ready_queue)
+            self._processes.append(process)
+
+        self._current = 0
+        self._held = None
+        self._range_over = False
+
+    def __str__(self):
+        return "[%s] - Decoders: %d - Resolution: %s" % (
+                    self.source, len(self._processes), str(self.resolution))
+
+    def start(self):
+        """Start decoding, or resume it after `pause`"""
+        if self._frames is None:
+            return
+        self.state = "start"
+        self._run_event.set()
+        for process in self._processes:
+            if process.pid is None:
+                process.start()
+
+    def pause(self):
+        self.state = "pause"
+        self._run_event.clear()
+
+    def stop(self):
+        if self._frames is None:
+            return
+        self.state = "stop"
+        self._stop_event.set()
+        for process in self._processes:
+            if process.pid is None:
+                continue
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+        # The shared memory can only be closed once no view refers to it
+        self._held = None
+        self._frames = None
+        self._shm.close()
+        self._shm.unlink()
+
+    def read(self):
+        """Return the next frame in order, or None when the stream is over"""
+        if self._frames is None:
+            return None
+
+        # The previously returned frame is no longer used by the consumer
+        if self._held is not None:
+            worker, slot = self._held
+            self._free_queues[worker].put(slot)
+            self._held = None
+
+        while self._current < len(self._ready_queues):
+            if self._range_over:
+                self._range_over = False
+                self._current += 1
+                continue
+
+            item = self._ready_queues[self._current].get()
+
+            # Frame range of the current worker is over, move to the next one
+            if item is None:
+                self._current += 1
+                continue
+
+            if self.policy == "latest":
+                item = self._newest(item)
+
+            _, slot = item
+            self._held = (self._current, slot)
+            return self._frames[slot]
+
+        self.state = "stop"
+        return None
+
+    def _newest(self, item):
+        """Skip the frames of the current worker decoded before its newest
+        one, their slots are given back to the worker right away
+        """
+        ready_queue = self._ready_queues[self._current]
+        free_queue = self._free_queues[self._current]
+        while True:
+            try:
+                newer = ready_queue.get_nowait()
+            except Empty:
+                return item
+
+            # Return the last frame of the range before moving to the next one
+            if newer is None:
+                self._range_over = True
+                return item
+
+            free_queue.put(item[1])
+            item = newer
+
+    def size(self):
+        if self._frames is None or self._current >= len(self._ready_queues):
+            return 0
+        try:
+            return self._ready_queues[self._current].qsize()
+        except NotImplementedError:
+            return 0
@@ -1,23 +1,49 @@
-import time
-from queue import Queue
-from threading import Thread
+from collections import deque
+from threading import Thread, Condition
 
 import cv2
 import numpy as np
 from PIL import Image
 
 class VideoStream:
+    """Threaded video reader backed by a fixed pool of frame buffers
 
-    def __init__(self, source="0", queue_size=256, resolution=(1024, 768)):
+    Frames are decoded and resized by a background thread straight into a
+    preallocated ring of `queue_size` frame buffers, so memory is bounded and
+    nothing is allocated per frame. The reader and the consumer wake each other
+    up with a condition variable instead of polling.
+
+    Here are the buffering policies:
+        - lossless: the reader waits for a free buffer, no frame is dropped
+            (default for video files)
+        - latest: the reader overwrites the oldest unread frame, so the
+            consumer always gets the most recent frames (default for cameras)
+
+    The frame returned by `read` stays valid until the next call to `read`.
+    """
+    POLICIES = ("lossless", "latest")
+
+    def __init__(self, source="0", queue_size=32, resolution=(1024, 768), policy=None):
         self.source = source
-        self.queue_size = queue_size
+        self.queue_size = max(int(queue_size), 2)
         self.resolution = resolution
+        self.policy = policy or ("latest" if source.isdecimal() else "lossless")
+        if self.policy not in self.POLICIES:
+            raise ValueError("Unknown buffering policy '%s'" % self.policy)
 
         self.stream = cv2.VideoCapture(int(source) if source.isdecimal() else source)
-        self.frame_queue = Queue(maxsize=queue_size)
         self.thread = Thread(target=self._update, args=())
         self.thread.daemon = True
-        self.state = "pause"
+
+        # Frame pool, one buffer is reserved for the frame held by the consumer
+        width, height = resolution
+        self._frames = np.empty((self.queue_size, height, width, 3), dtype=np.uint8)
+        self._free = deque(range(self.queue_size))
+        self._ready = deque()
+        self._held = None
+        self._cond = Condition()
+        self._state = "pause"
+        self._finished = False
 
         if not self.stream.isOpened():
             raise Exception("Fail to connect to video source %s" % source)
@@ -27,11 +53,21 @@ class VideoStream:
             content = "[Webcam %s] - Resolution: %s" % (self.source, str(self.resolution))
         else:
             content = "[%s]\n - Number of frames: %d\n - Video FPS: %d\n - Resolution: %s" % (self.source,
-                int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)),
-                int(self.cap.get(cv2.CAP_PROP_FPS)),
+                int(self.stream.get(cv2.CAP_PROP_FRAME_COUNT)),
+                int(self.stream.get(cv2.CAP_PROP_FPS)),
                 str(self.resolution))
         return content
 
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        with self._cond:
+            self._state = state
+            self._cond.notify_all()
+
     def start(self):
         self.state = "start"
         self.thread.start()
@@ -44,25 +80,68 @@ class VideoStream:
         self.thread.join()
 
     def read(self):
-        return self.frame_queue.get()
+        """Return the next frame, or None when the stream is over"""
+        with self._cond:
+            # The previously returned frame is no longer used by the consumer
+            if self._held is not None:
+                self._free.append(self._held)
+                self._held = None
+                self._cond.notify_all()
+
+            self._cond.wait_for(lambda: self._ready or self._finished)
+            if not self._ready:
+                return None
+
+            self._held = self._ready.popleft()
+            self._cond.notify_all()
+            return self._frames[self._held]
 
     def size(self):
-        return self.frame_queue.qsize()
+        return len(self._ready)
+
+    def _acquire_slot(self):
+        """Wait for a buffer to decode the next frame into
+
+        Return:
+            the slot index, or None if the stream has been stopped
+        """
+        with self._cond:
+            while True:
+                if self._state == "stop":
+                    return None
+                if self._state != "pause":
+                    if self._free:
+                        return self._free.popleft()
+                    # Drop the oldest unread frame in favor of the newest one
+                    if self.policy == "latest" and self._ready:
+                        return self._ready.popleft()
+                self._cond.wait()
 
     def _update(self):
         """Thread to fill the stream frame buffer"""
-        while self.state != "stop":
-            if not self.frame_queue.full() and self.state != "pause":
-                ret, frame = self.stream.read()
+        width, height = self.resolution
+        raw = None
 
-                if not ret:
-                    self.state = "stop"
-                    continue
+        while True:
+            slot = self._acquire_slot()
+            if slot is None:
+                break
 
-                frame = cv2.resize(frame, self.resolution)
-                self.frame_queue.put(frame)
-            else:
-                # wait 10ms  for consumer consuming the frames
-                time.sleep(0.1)
+            ret, raw = self.stream.read(raw)
+            if not ret:
+                with self._cond:
+                    self._free.append(slot)
+                    self._state = "stop"
+                break
+
+            cv2.resize(raw, (width, height), dst=self._frames[slot])
+
+            with self._cond:
+                self._ready.append(slot)
+                self._cond.notify_all()
 
         self.stream.release()
+
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
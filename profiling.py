@@ -0,0 +1,193 @@
+"""On-demand profiling of a fixed window of frames
+
+A `FrameProfiler` is armed for N frames, either at startup through the
+environment or at runtime (by an operator through the server stats endpoint,
+or by a control message of a client when the server allows it), then
+profiles the thread processing those frames and writes the results to disk:
+
+    DEEPSORT_PROFILE=<frames>[:<mode>]   profile the first frames of every
+                                         session / pipeline stage
+    DEEPSORT_PROFILE_DIR=<directory>     output directory (default: profiles)
+
+Modes are `cprofile` (python call graph, .prof file readable with pstats or
+snakeviz, plus a text summary), `torch` (torch.profiler operator table and
+chrome trace) or `both`. When no profiling is armed the only cost on the hot
+path is checking the `active` and `requested` attributes. The number of
+profiled frames can be capped, which bounds the size of the traces.
+
+A profiler created with `per_call=True` does not profile the thread calling
+`start`, only the functions run through `call`, on whatever thread runs them.
+This is how a session of the asyncio server is profiled: its event loop thread
+is shared with the other sessions, and its work runs on executor threads.
+"""
+import os
+import time
+import cProfile
+import pstats
+from threading import Lock
+
+MODES = ("cprofile", "torch", "both")
+
+# Only one torch profiler can run at a time in a process
+_torch_lock = Lock()
+
+
+class FrameProfiler:
+    """Profile the calling thread over a fixed number of frames"""
+
+    def __init__(self, name, output_dir=None, max_frames=None, per_call=False):
+        """
+        Parameters:
+            - name: name of the profiled session or stage, used in file names
+            - output_dir: directory of the results, DEEPSORT_PROFILE_DIR or
+                "profiles" by default
+            - max_frames: maximum number of frames of a profiling window, None
+                for no limit
+            - per_call: profile only the functions run through `call` instead
+                of the thread calling `start`
+        """
+        self.name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+        self.output_dir = output_dir or os.environ.get("DEEPSORT_PROFILE_DIR", "profiles")
+        self.max_frames = max_frames
+        self.per_call = per_call
+        self.active = False
+        self.requested = None
+
+        self._remaining = 0
+        self._profile = None
+        self._torch_profile = None
+
+    @staticmethod
+    def env_setting():
+        """Return the (frames, mode) window of DEEPSORT_PROFILE, or None if unset"""
+        setting = os.environ.get("DEEPSORT_PROFILE")
+        if not setting:
+            return None
+
+        frames, _, mode = setting.partition(":")
+        return int(frames), mode or "cprofile"
+
+    @staticmethod
+    def from_env(name, max_frames=None):
+        """Create a profiler armed from DEEPSORT_PROFILE, or None if unset"""
+        setting = FrameProfiler.env_setting()
+        if setting is None:
+            return None
+
+        profiler = FrameProfiler(name, max_frames=max_frames)
+        profiler.start(*setting)
+        return profiler
+
+    def start(self, frames, mode="cprofile"):
+        """Profile the next `frames` frames processed by the calling thread"""
+        if mode not in MODES:
+            raise ValueError("Unknown profiling mode '%s', expected one of %s" % (mode, MODES))
+        if self.active or frames <= 0:
+            return
+        if self.max_frames is not None:
+            frames = min(frames, self.max_frames)
+
+        if mode in ("torch", "both"):
+            self._start_torch()
+        if mode in ("cprofile", "both"):
+            self._profile = cProfile.Profile()
+            try:
+                if not self.per_call:
+                    self._profile.enable()
+            except ValueError:
+                # Another profiler is already enabled on this thread
+                print("[{}] thread already profiled, skip cprofile".format(self.name))
+                self._profile = None
+
+        self._remaining = frames
+        self.active = True
+        print("[{}] Profile {} frames ({})".format(self.name, frames, mode))
+
+    def request(self, frames, mode="cprofile"):
+        """Ask for a profiling window from another thread
+
+        The profiled thread starts it on its next call to `poll`.
+        """
+        if mode not in MODES:
+            raise ValueError("Unknown profiling mode '%s', expected one of %s" % (mode, MODES))
+        self.requested = (int(frames), mode)
+
+    def poll(self):
+        """Start the requested profiling window, on the profiled thread"""
+        requested, self.requested = self.requested, None
+        if requested is not None:
+            self.start(*requested)
+
+    def call(self, func, *args):
+        """Run `func(*args)`, profiled when a per call window is active
+
+        The calls of one profiler must not overlap, which holds for the
+        successive steps of a session.
+        """
+        if not self.per_call or self._profile is None:
+            return func(*args)
+        return self._profile.runcall(func, *args)
+
+    def _start_torch(self):
+        try:
+            import torch
+            import torch.profiler
+        except ImportError:
+            print("[{}] torch is not available, skip torch profiling".format(self.name))
+            return
+
+        if not _torch_lock.acquire(blocking=False):
+            print("[{}] torch profiler already running, skip torch profiling".format(self.name))
+            return
+
+        activities = [ torch.profiler.ProfilerActivity.CPU ]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._torch_profile = torch.profiler.profile(activities=activities, record_shapes=True)
+        self._torch_profile.start()
+
+    def step(self, frames=1):
+        """Count processed frames, stop when the window is over"""
+        self._remaining -= frames
+        if self._remaining <= 0:
+            self.stop()
+
+    def stop(self):
+        """Stop profiling and write the results
+
+        Return:
+            list of written file paths
+        """
+        if not self.active:
+            return []
+        self.active = False
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir,
+                            "{}-{}".format(self.name, time.strftime("%Y%m%d-%H%M%S")))
+        paths = []
+
+        if self._profile is not None:
+            if not self.per_call:
+                self._profile.disable()
+            self._profile.dump_stats(prefix + ".prof")
+            with open(prefix + ".prof.txt", "w") as f:
+                stats = pstats.Stats(self._profile, stream=f)
+                stats.sort_stats("cumulative").print_stats(50)
+            paths += [ prefix + ".prof", prefix + ".prof.txt" ]
+            self._profile = None
+
+        if self._torch_profile is not None:
+            try:
+                self._torch_profile.stop()
+                self._torch_profile.export_chrome_trace(prefix + ".trace.json")
+                with open(prefix + ".torch.txt", "w") as f:
+                    f.write(self._torch_profile.key_averages().table(
+                                                sort_by="self_cpu_time_total", row_limit=50))
+                paths += [ prefix + ".trace.json", prefix + ".torch.txt" ]
+            finally:
+                self._torch_profile = None
+                _torch_lock.release()
+
+        print("[{}] Profiling results written to {}".format(self.name, ", ".join(paths)))
+        return paths
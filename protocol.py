@@ -0,0 +1,296 @@
+"""Binary wire protocol shared by the tracking client and server
+
+Every message starts with a fixed size header
+
+    +-------+---------+------+----------+----------------+
+    | magic | version | type | sequence | payload length |
+    |  2s   |    B    |  B   |    I     |       I        |
+    +-------+---------+------+----------+----------------+
+
+followed by `payload length` bytes of payload, at most `MAX_PAYLOAD` bytes by
+default so that a peer cannot make the receiver allocate an arbitrary amount
+of memory with a single header. Tracking messages use a compact
+payload made of a flag byte, the number of boxes, an optional region of
+interest (x1, y1, x2, y2), the boxes as big-endian float64 (x, y, a, h) rows
+and the raw JPEG frame (if any) as the remaining bytes. No pickle is involved
+on either side of the connection.
+"""
+import time
+import struct
+
+import numpy as np
+
+MAGIC = b'DS'
+VERSION = 1
+
+HEADER = struct.Struct("!2sBBII")
+TRACK_META = struct.Struct("!BH")
+PROFILE_META = struct.Struct("!IB")
+BOX_DTYPE = np.dtype('>f8')
+
+# Default limit of the payload length accepted by the receivers
+MAX_PAYLOAD = 16 << 20
+
+# Message types
+MSG_TRACK = 1       # client -> server: tracking status with frame
+MSG_RESULT = 2      # server -> client: tracking result
+MSG_PROFILE = 3     # client -> server: profile the next frames of the session
+MSG_REJECT = 4      # server -> client: connection refused or closed, with reason
+
+# Profiling modes of profile messages
+PROFILE_MODES = ("cprofile", "torch", "both")
+
+# Flags of tracking messages
+FLAG_STATE = 0x01
+FLAG_ROI = 0x02     # payload carries a region of interest
+FLAG_PREDICTED = 0x04   # result comes from the motion model only, no detection
+
+
+class ProtocolError(Exception):
+    """Raised when the peer sends a malformed message"""
+    pass
+
+
+class RejectedError(ProtocolError):
+    """Raised when the server refuses or closes the session"""
+    pass
+
+
+class MessageReader:
+    """Receive messages from a socket into a reusable buffer
+
+    The payload is received with `recv_into` straight into a preallocated
+    bytearray that only grows when a larger message arrives, so receiving a
+    message costs neither a copy nor an allocation in steady state. The
+    returned payload is a memoryview into that buffer and is only valid until
+    the next call to `recv`.
+
+    `header_time` is the `time.perf_counter()` at which the header of the
+    last message arrived, so that receiving the payload can be timed apart
+    from waiting for the peer.
+    """
+
+    def __init__(self, sock, buffer_size=1<<16, max_payload=MAX_PAYLOAD):
+        """
+        Parameters:
+            - sock: connected socket
+            - buffer_size: initial size of the receive buffer in bytes
+            - max_payload: largest accepted payload in bytes, larger messages
+                raise a `ProtocolError`
+        """
+        self.sock = sock
+        self.max_payload = max_payload
+        self.header_time = None
+        self._header = bytearray(HEADER.size)
+        self._buffer = bytearray(buffer_size)
+
+    def _recv_exactly(self, view):
+        """Fill the memoryview with exactly len(view) bytes from the socket"""
+        received = 0
+        while received < len(view):
+            n = self.sock.recv_into(view[received:])
+            if n == 0:
+                raise ConnectionError("Connection closed by peer")
+            received += n
+
+    def recv(self):
+        """Receive the next message
+
+        Return:
+            (msg_type, sequence, payload) where payload is a memoryview
+        """
+        self._recv_exactly(memoryview(self._header))
+        msg_type, sequence, length = _parse_header(self._header, self.max_payload)
+        self.header_time = time.perf_counter()
+
+        if length > len(self._buffer):
+            self._buffer = bytearray(min(max(length, 2*len(self._buffer)), self.max_payload))
+
+        payload = memoryview(self._buffer)[:length]
+        self._recv_exactly(payload)
+
+        return msg_type, sequence, payload
+
+
+def _frame_buffers(msg_type, sequence, buffers):
+    """Prepend the message header to the payload buffers"""
+    buffers = [ memoryview(b).cast('B') for b in buffers ]
+    length = sum(len(b) for b in buffers)
+    buffers.insert(0, memoryview(HEADER.pack(MAGIC, VERSION, msg_type, sequence, length)))
+    return buffers
+
+
+def _parse_header(header, max_payload=MAX_PAYLOAD):
+    magic, version, msg_type, sequence, length = HEADER.unpack(header)
+
+    if magic != MAGIC:
+        raise ProtocolError("Invalid magic %r" % magic)
+    if version != VERSION:
+        raise ProtocolError("Unsupported protocol version %d" % version)
+    if length > max_payload:
+        raise ProtocolError("Payload of %d bytes exceeds the limit of %d bytes" % (length, max_payload))
+
+    return msg_type, sequence, length
+
+
+def send_message(sock, msg_type, sequence, buffers):
+    """Send one message made of the given payload buffers
+
+    The header and the payload buffers are handed to the kernel together with
+    `sendmsg` (scatter-gather), so a JPEG frame is never concatenated into a
+    new bytes object before sending.
+    """
+    buffers = _frame_buffers(msg_type, sequence, buffers)
+
+    if not hasattr(sock, 'sendmsg'):
+        sock.sendall(b''.join(buffers))
+        return
+
+    while buffers:
+        sent = sock.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if buffers and sent > 0:
+            buffers[0] = buffers[0][sent:]
+
+
+class AsyncMessageReader:
+    """Receive messages from an asyncio StreamReader
+
+    Counterpart of `MessageReader` for the asyncio server, with the same
+    payload limit and `header_time` attribute.
+    """
+
+    def __init__(self, stream, max_payload=MAX_PAYLOAD):
+        """
+        Parameters:
+            - stream: asyncio StreamReader
+            - max_payload: largest accepted payload in bytes, larger messages
+                raise a `ProtocolError`
+        """
+        self.stream = stream
+        self.max_payload = max_payload
+        self.header_time = None
+
+    async def recv(self):
+        """Receive the next message
+
+        Return:
+            (msg_type, sequence, payload) where payload is a memoryview
+        """
+        header = await self.stream.readexactly(HEADER.size)
+        msg_type, sequence, length = _parse_header(header, self.max_payload)
+        self.header_time = time.perf_counter()
+        payload = await self.stream.readexactly(length)
+
+        return msg_type, sequence, memoryview(payload)
+
+
+def write_message(writer, msg_type, sequence, buffers):
+    """Queue one message on an asyncio StreamWriter, the caller should await
+    `writer.drain()` afterwards
+    """
+    writer.writelines(_frame_buffers(msg_type, sequence, buffers))
+
+
+def encode_tracking(state, tlahs, frame=None, roi=None, predicted=False):
+    """Encode a tracking message payload
+
+    Parameters:
+        - state: tracking state
+        - tlahs: sequence of (x, y, a, h) boxes
+        - frame: JPEG encoded frame as uint8 ndarray or bytes, or None
+        - roi: region of interest (x1, y1, x2, y2), or None. In a request it is
+            the frame region the JPEG frame was cropped from, in a reply it is
+            the search window suggested for the next frame.
+        - predicted: whether the boxes of a reply have only been predicted by
+            the motion model, without running the object detector
+
+    Return:
+        list of buffers to pass to `send_message`
+    """
+    boxes = np.asarray(tlahs, dtype=BOX_DTYPE).reshape(-1, 4)
+    flags = FLAG_STATE if state else 0
+    flags |= FLAG_ROI if roi is not None else 0
+    flags |= FLAG_PREDICTED if predicted else 0
+
+    buffers = [ TRACK_META.pack(flags, len(boxes)) ]
+    if roi is not None:
+        buffers.append(np.asarray(roi, dtype=BOX_DTYPE).reshape(4).tobytes())
+    buffers.append(boxes.tobytes())
+    if frame is not None:
+        buffers.append(frame)
+
+    return buffers
+
+
+def decode_tracking(payload):
+    """Decode a tracking message payload
+
+    Return:
+        (state, tlahs, frame, roi, predicted) where tlahs is a (N, 4) float64
+        array, frame is a uint8 ndarray view of the JPEG bytes (or None if
+        there is none), roi is a list (x1, y1, x2, y2) or None and predicted
+        tells whether the boxes come from the motion model only
+    """
+    if len(payload) < TRACK_META.size:
+        raise ProtocolError("Truncated tracking message")
+    flags, n_boxes = TRACK_META.unpack_from(payload)
+
+    offset = TRACK_META.size
+    roi = None
+    if flags & FLAG_ROI:
+        end = offset + 4*BOX_DTYPE.itemsize
+        if len(payload) < end:
+            raise ProtocolError("Truncated tracking message")
+        roi = np.frombuffer(payload[offset:end], dtype=BOX_DTYPE).tolist()
+        offset = end
+
+    end = offset + n_boxes*4*BOX_DTYPE.itemsize
+    if len(payload) < end:
+        raise ProtocolError("Truncated tracking message")
+
+    tlahs = np.frombuffer(payload[offset:end], dtype=BOX_DTYPE).reshape(-1, 4)
+    tlahs = tlahs.astype(np.float64)
+    frame = np.frombuffer(payload[end:], dtype=np.uint8) if len(payload) > end else None
+
+    return bool(flags & FLAG_STATE), tlahs, frame, roi, bool(flags & FLAG_PREDICTED)
+
+
+def encode_profile(frames, mode="cprofile"):
+    """Encode a profile control message payload
+
+    Parameters:
+        - frames: number of frames to profile
+        - mode: one of `PROFILE_MODES`
+
+    Return:
+        list of buffers to pass to `send_message`
+    """
+    return [ PROFILE_META.pack(frames, PROFILE_MODES.index(mode)) ]
+
+
+def decode_profile(payload):
+    """Decode a profile control message payload
+
+    Return:
+        (frames, mode)
+    """
+    if len(payload) < PROFILE_META.size:
+        raise ProtocolError("Truncated profile message")
+    frames, mode = PROFILE_META.unpack_from(payload)
+    if mode >= len(PROFILE_MODES):
+        raise ProtocolError("Unknown profiling mode %d" % mode)
+
+    return frames, PROFILE_MODES[mode]
+
+
+def encode_reject(reason):
+    """Encode a reject message payload made of the UTF-8 reason"""
+    return [ reason.encode('utf-8') ]
+
+
+def decode_reject(payload):
+    """Decode a reject message payload into the reason"""
+    return bytes(payload).decode('utf-8', errors='replace')
@@ -1,8 +1,11 @@
 import time
+import math
 import socket
-import pickle
+import asyncio
 import argparse
-from threading import Thread
+from queue import Queue, Empty
+from threading import Thread, Condition, Lock
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -10,19 +13,651 @@ import torch
 import torchvision
 from torchvision.models.detection import fasterrcnn_resnet50_fpn
 
+import protocol
+from metrics import ServerStats
+from profiling import FrameProfiler
+from mot.detector.preprocess import FramePreprocessor
 from mot.tracker.kalman import KalmanFilter
+from mot.tracker.boxes import iou_matrix, xyah_to_tlbr, tlbr_to_xyah
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--ip", default="127.0.0.1", help="server ip to connect")
 parser.add_argument("--port", default="9999", help="server service port")
+parser.add_argument("--max_batch", default="8", help="maximum number of frames in a detection batch")
+parser.add_argument("--max_wait", default="10", help="maximum milliseconds to wait for a batch to fill")
+parser.add_argument("--mode", default="thread", choices=["thread", "asyncio"], help="thread per client or asyncio event loop")
+parser.add_argument("--workers", default="4", help="executor threads for cpu work in asyncio mode")
+parser.add_argument("--backlog", default="128", help="listen backlog")
+parser.add_argument("--max_sessions", default="16", help="maximum number of sessions served at once")
+parser.add_argument("--max_pending", default="16", help="maximum number of connections waiting for a session slot")
+parser.add_argument("--queue_timeout", default="5", help="seconds a connection waits for a session slot before being rejected")
+parser.add_argument("--max_payload", default="16", help="maximum size of a client message in MB")
+parser.add_argument("--idle_timeout", default="120", help="seconds without messages before a session is evicted")
+parser.add_argument("--roi_margin", default="1.0", help="margin of the search window relative to target size")
+parser.add_argument("--latency_budget", default="40", help="milliseconds budget per frame and session, 0 to detect every frame")
+parser.add_argument("--max_interval", default="10", help="maximum number of frames between two detections")
+parser.add_argument("--stats_port", default="0", help="local port of the json stats and operator endpoint, 0 to disable")
+parser.add_argument("--max_profile_frames", default="300", help="maximum number of frames of a profiling window")
+parser.add_argument("--client_profile", action="store_true", help="let clients profile their own session with profile messages")
+parser.add_argument("--stats_interval", default="0", help="seconds between two stats log lines, 0 to disable")
+parser.add_argument("--max_uncertainty", default="0.25", help="predicted position deviation relative to target height that triggers a detection")
+
+class InferenceWorker(Thread):
+    """Thread owning the single object detector shared by all clients
+
+    Client threads submit frames to the worker and wait on the returned future.
+    The worker collects the pending frames of all the connected clients into a
+    batch, bounded by `max_batch` frames and `max_wait` seconds after the first
+    frame arrived, runs one forward pass and hands each result back to the
+    future of the client that submitted it.
+
+    Submitted uint8 frames are converted to detector inputs by a separate
+    preprocessing thread that runs ahead of the forward pass, writing into
+    pooled buffers that are recycled once the batch is done.
+    """
+
+    def __init__(self, device, max_batch=8, max_wait=0.01, metrics=None):
+        """
+        Parameters:
+            - device: cuda or cpu device
+            - max_batch: maximum number of frames in a batch
+            - max_wait: maximum seconds to wait for a batch to fill
+            - metrics: `metrics.Metrics` recording the preprocessing and
+                forward pass latencies, or None
+        """
+        super().__init__()
+        self.daemon = True
+        self.device = device
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.metrics = metrics
+
+        self.detector = fasterrcnn_resnet50_fpn(num_classes=91, pretrained=True)
+        self.detector.to(device)
+        self.detector.eval()
+
+        # Frames larger than the detector input are downscaled before the
+        # conversion, the detector would resize them anyway
+        self.preprocessor = FramePreprocessor(
+                                input_size=max(self.detector.transform.min_size),
+                                pool_size=2*max_batch)
+
+        self.requests = Queue()
+        self.ready = Queue(maxsize=2*max_batch)
+        self._preprocess_thread = Thread(target=self._preprocess, daemon=True)
+
+    def submit(self, frame, min_size=None):
+        """Submit a frame for detection
+
+        Parameters:
+            - frame: uint8 BGR frame of shape (H, W, 3)
+            - min_size: size the shorter image side is resized to inside the
+                detector, None for the detector default. Cropped regions use
+                their own size so that they are not upscaled.
+
+        Return:
+            a future resolved with a dictionary of numpy arrays
+            {
+                'boxes': # (N, 4) tlbr boxes,
+                'labels': # (N,) class labels,
+                'scores': # (N,) confidence scores
+            }
+        """
+        future = Future()
+        self.requests.put((frame, min_size, future))
+        return future
+
+    def _preprocess(self):
+        """Thread converting submitted frames into detector inputs"""
+        while True:
+            frame, min_size, future = self.requests.get()
+            start = time.perf_counter()
+            try:
+                tensor, scale = self.preprocessor(frame)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+
+            if self.metrics is not None:
+                self.metrics.record("preprocess", time.perf_counter()-start)
+
+            # Cropped regions keep the size they have been converted to
+            if min_size is not None:
+                min_size = min(tensor.shape[1:])
+
+            self.ready.put((tensor, scale, min_size, future))
+
+    def _collect_batch(self):
+        """Block until a frame is ready, then gather more until the batch is
+        full or the waiting time is over
+        """
+        batch = [self.ready.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.ready.get(timeout=timeout))
+            except Empty:
+                break
+
+        return batch
+
+    def run(self):
+
+        self._preprocess_thread.start()
+        default_min_size = self.detector.transform.min_size
+
+        while True:
+            batch = self._collect_batch()
+
+            # Frames resized to different scales run in separate forward passes
+            groups = {}
+            for tensor, scale, min_size, future in batch:
+                groups.setdefault(min_size, []).append((tensor, scale, future))
+
+            for min_size, group in groups.items():
+                frames = [ tensor.to(self.device) for tensor, _, _ in group ]
+
+                try:
+                    start = time.perf_counter()
+                    self.detector.transform.min_size = \
+                        default_min_size if min_size is None else (min_size,)
+                    with torch.no_grad():
+                        predictions = self.detector(frames)
+                    if self.metrics is not None:
+                        self.metrics.record("inference", time.perf_counter()-start)
+                except Exception as e:
+                    for _, _, future in group:
+                        future.set_exception(e)
+                    continue
+
+                finally:
+                    for tensor, _, _ in group:
+                        self.preprocessor.release(tensor)
+
+                for (_, scale, future), prediction in zip(group, predictions):
+                    future.set_result({
+                        'boxes': prediction['boxes'].detach().cpu().numpy() / scale,
+                        'labels': prediction['labels'].detach().cpu().numpy(),
+                        'scores': prediction['scores'].detach().cpu().numpy() })
+
+
+def decode_request(msg_type, seq, payload):
+    """Decode a client message into a request dictionary
+
+    Return:
+        a dictionary with following format
+        {
+            'seq': 0,
+            'tlahs': [(x, y, a, h)],
+            'state': True,
+            'frame': # compressed frame in jpeg format
+            'roi': # (x1, y1, x2, y2) region the frame was cropped from, or None
+        }
+    """
+    if msg_type != protocol.MSG_TRACK:
+        raise protocol.ProtocolError("Unexpected message type %d" % msg_type)
+
+    state, tlahs, frame, roi, _ = protocol.decode_tracking(payload)
+    return { 'seq': seq, 'tlahs': tlahs.tolist(), 'state': state, 'frame': frame, 'roi': roi }
+
+def encode_reply(data):
+    """Encode a reply dictionary into protocol buffers
+
+    Data format:
+        {
+            'seq': 0,
+            'tlahs': [(x, y, a, h)],
+            'state': True,
+            'roi': # search window (x1, y1, x2, y2) for the next frame, or None
+            'predicted': # whether the result comes from the kalman filter only
+        }
+    """
+    return protocol.encode_tracking(data['state'], data['tlahs'],
+                                    roi=data.get('roi'), predicted=data.get('predicted', False))
+
+
+def session_options(args):
+    """Extract the tracking session parameters from the command line arguments"""
+    return {
+        'roi_margin': float(args['roi_margin']),
+        'latency_budget': float(args['latency_budget'])/1000,
+        'max_interval': int(args['max_interval']),
+        'max_uncertainty': float(args['max_uncertainty']) }
+
+def profiling_options(args):
+    """Extract the session profiling parameters from the command line arguments"""
+    return {
+        'max_frames': int(args['max_profile_frames']),
+        'client_profile': args['client_profile'] }
+
+def session_profiler(name, max_frames=None, per_call=False):
+    """Create the profiler of a session, with profiling windows capped to
+    `max_frames` frames
+
+    The profiler is not started here: a DEEPSORT_PROFILE window is requested,
+    and starts on the first frame served, so a rejected connection never
+    leaves a profiler running.
+    """
+    name = "session-" + name.replace(":", "-")
+    profiler = FrameProfiler(name, max_frames=max_frames, per_call=per_call)
+    setting = FrameProfiler.env_setting()
+    if setting is not None:
+        profiler.request(*setting)
+    return profiler
+
+def client_profile_request(profiler, payload, client_profile=False):
+    """Start profiling on a client profile message, if the server allows it"""
+    frames, mode = protocol.decode_profile(payload)
+    if not client_profile:
+        print("[{}] Ignore client profiling request, run the server with --client_profile "
+            "or use the stats endpoint".format(profiler.name))
+        return
+    profiler.start(frames, mode)
+
+
+class DetectionScheduler:
+    """Decide on which frames of a session the object detector runs
+
+    Between two detections the target is coasted on the kalman filter
+    prediction alone. The detection interval k adapts to the measured
+    detection latency so that, on average, a session stays within its
+    per-frame latency budget: a detector taking 400ms with a 40ms budget runs
+    every 10 frames, one taking 20ms runs on every frame. The detector also
+    runs sooner when the predicted position becomes too uncertain, since the
+    kalman covariance grows on each frame without a measurement.
+    """
+
+    def __init__(self, latency_budget=0.04, max_interval=10, max_uncertainty=0.25, smoothing=0.2):
+        """
+        Parameters:
+            - latency_budget: seconds of processing budget per frame, 0 to
+                detect on every frame
+            - max_interval: maximum number of frames between two detections
+            - max_uncertainty: maximum standard deviation of the predicted
+                position relative to the target height
+            - smoothing: weight of the newest sample in the latency average
+        """
+        self.latency_budget = latency_budget
+        self.max_interval = max_interval
+        self.max_uncertainty = max_uncertainty
+        self.smoothing = smoothing
+
+        self.latency = None # moving average of the detection latency
+        self._coasted = 0
+        self._force = True
+
+    def interval(self):
+        """Current number of frames between two detections"""
+        if self.latency_budget <= 0 or self.latency is None:
+            return 1
+        interval = math.ceil(self.latency / self.latency_budget)
+        return int(min(max(interval, 1), self.max_interval))
+
+    def should_detect(self, mean, covariance):
+        """Whether to run the detector on the frame with this predicted state"""
+        if self._force or self._coasted+1 >= self.interval():
+            return True
+
+        std = np.sqrt(max(covariance[0, 0], covariance[1, 1]))
+        return std > self.max_uncertainty*mean[3]
+
+    def force(self):
+        """Run the detector on the next frame"""
+        self._force = True
+
+    def detected(self, latency):
+        """Record a frame processed with the detector"""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing*(latency-self.latency)
+        self._coasted = 0
+        self._force = False
+
+    def coasted(self):
+        """Record a frame processed with the kalman filter prediction only"""
+        self._coasted += 1
+
+
+class TrackingSession:
+    """Single object tracking state of one connected client
+
+    The processing of a request is split in two halves around the object
+    detection, so that the server can run them on any thread and hand the
+    detection itself to the shared inference worker:
+
+        preprocess(request) -> decoded frame ---> [InferenceWorker]
+                                                           |
+        postprocess(request, prediction) -> reply <--------+
+
+    Each reply carries a search window around the predicted target location.
+    Clients in ROI mode send only that crop of the next frame, the detected
+    boxes are then mapped back to full frame coordinates. When the target is
+    not found in the crop, the reply asks for a full frame search before the
+    target is declared lost.
+
+    Frames skipped by the detection scheduler are not even decoded, the
+    target is coasted on the kalman filter prediction and the reply is marked
+    as predicted.
+    """
+
+    def __init__(self, roi_margin=1.0, latency_budget=0.04, max_interval=10, max_uncertainty=0.25):
+        """
+        Parameters:
+            - roi_margin: margin added around the predicted target on each
+                side of the search window, relative to the target size
+            - latency_budget: seconds of processing budget per frame, 0 to
+                detect on every frame
+            - max_interval: maximum number of frames between two detections
+            - max_uncertainty: predicted position deviation relative to the
+                target height above which the detector runs
+        """
+        self.kalman = KalmanFilter()
+        self.scheduler = DetectionScheduler(latency_budget=latency_budget,
+                                            max_interval=max_interval,
+                                            max_uncertainty=max_uncertainty)
+        self.roi_margin = roi_margin
+        self.mean = None
+        self.covariance = None
+        self._detect_start = None
+
+    def reset(self):
+        self.mean = None
+        self.covariance = None
+        self.scheduler.force()
+
+    def _search_window(self):
+        """Compute the search window (x1, y1, x2, y2) of the next frame from
+        the predicted target location and its uncertainty
+        """
+        mean, covariance = self.kalman.predict(self.mean, self.covariance)
+        cx, cy, a, h = mean[:4]
+        w = a*h
+
+        # Margin relative to target size plus three standard deviations
+        half_w = w/2*(1+2*self.roi_margin) + 3*np.sqrt(covariance[0, 0])
+        half_h = h/2*(1+2*self.roi_margin) + 3*np.sqrt(covariance[1, 1])
+
+        return [cx-half_w, cy-half_h, cx+half_w, cy+half_h]
+
+    def preprocess(self, data):
+        """Decode the frame of a tracking request
+
+        Return:
+            (decoded frame, min_size) to submit to the inference worker, or None
+            if the request is handled without running object detection
+            (kalman filter initialization or coasting)
+        """
+        # Initialize kalman filter state
+        if self.mean is None and self.covariance is None:
+            self.mean, self.covariance = self.kalman.initiate(np.array(data['tlahs'][0]))
+            self.scheduler.force()
+            return None
+
+        # Coast on the kalman filter prediction between two detections
+        mean, covariance = self.kalman.predict(self.mean, self.covariance)
+        if not self.scheduler.should_detect(mean, covariance):
+            self.mean, self.covariance = mean, covariance
+            self.scheduler.coasted()
+            data['predicted'] = True
+            return None
+
+        self._detect_start = time.monotonic()
+        frame = cv2.imdecode(data['frame'], cv2.IMREAD_COLOR)
+
+        # Detect cropped regions at their own scale
+        if data['roi'] is not None:
+            return frame, min(frame.shape[:2])
+
+        return frame, None
+
+    def postprocess(self, data, prediction):
+        """Update kalman filter with the detection result and build the reply
+
+        Parameters:
+            - data: the tracking request
+            - prediction: detection result of the inference worker, or None if
+                no detection has been run for this request
+        """
+        # Update kalman filter with the detected objects
+        if prediction is not None:
+            self.scheduler.detected(time.monotonic()-self._detect_start)
+
+            # Map boxes detected in a cropped region back to the full frame
+            boxes = prediction['boxes']
+            if data['roi'] is not None:
+                x1, y1 = data['roi'][:2]
+                boxes = boxes + np.array([x1, y1, x1, y1])
+
+            # Filter out only bboxes with respect to person class
+            people = boxes[(prediction['labels'] == 1) & (prediction['scores'] > 0.7)]
+
+            # Assign bbox based on IOU
+            mean, covariance = self.kalman.predict(self.mean, self.covariance)
+            ious = iou_matrix(xyah_to_tlbr(mean[None, :4]), people)[0]
+
+            # Target is not in the cropped region, coast on the prediction and
+            # search the full frame next time
+            if (len(ious) == 0 or np.max(ious) < 0.5) and data['roi'] is not None:
+                self.mean, self.covariance = mean, covariance
+                self.scheduler.force()
+                del data['frame']
+                data['tlahs'] = [self.mean.tolist()[:4]]
+                data['roi'] = None
+                data['predicted'] = True
+                return data
+
+            # Target is lost
+            elif len(ious) == 0 or np.max(ious) < 0.5:
+                data['state'] = False
+                data['tlahs'] = [self.mean.tolist()[:4]]
+                self.reset()
+
+            # Update Kalman filter
+            else:
+                measurement = tlbr_to_xyah(people[np.argmax(ious)])
+                self.mean, self.covariance = self.kalman.update(
+                                                mean, covariance, measurement)
+
+        # Prepare data to send to client
+        del data['frame']
+        data['roi'] = None
+
+        if data['state']:
+            data['tlahs'] = [self.mean.tolist()[:4]]
+            data['roi'] = self._search_window()
+
+        return data
+
+
+class SessionManager:
+    """Admission control and lifetime of the client sessions
+
+    At most `max_sessions` sessions are served at once. A connection arriving
+    when all the slots are taken waits up to `queue_timeout` seconds for a
+    free slot, up to `max_pending` connections can wait at the same time.
+    Connections that cannot be admitted get a reject message with the reason
+    before being closed, so the client knows the server is busy instead of
+    hanging.
+
+    Sessions are released as soon as their client disconnects or stays idle
+    for more than `idle_timeout` seconds, which frees their slot, their
+    tracking state and their statistics right away.
+
+    The threaded server admits with the blocking `admit` / `release`, the
+    asyncio server with `admit_async` / `release_async`, which wait on the
+    event loop instead of holding a thread.
+    """
+
+    def __init__(self, stats, max_sessions=16, max_pending=16,
+                queue_timeout=5., idle_timeout=120.):
+        """
+        Parameters:
+            - stats: `metrics.ServerStats` of the server
+            - max_sessions: maximum number of sessions served at once
+            - max_pending: maximum number of connections waiting for a slot
+            - queue_timeout: seconds a connection waits for a slot
+            - idle_timeout: seconds without any message before a session is
+                evicted
+        """
+        self.stats = stats
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+
+        self.sessions = {}
+        self.pending = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.evicted = 0
+        self._cond = Condition()
+        self._async_cond = None
+
+    def saturated(self):
+        """Whether a new connection would be rejected without waiting"""
+        with self._cond:
+            return (len(self.sessions) >= self.max_sessions
+                    and self.pending >= self.max_pending)
+
+    def try_admit(self, name, profiler=None):
+        """Admit a session if a slot is free, without waiting"""
+        with self._cond:
+            if len(self.sessions) >= self.max_sessions:
+                return False
+            self.sessions[name] = profiler
+            self.admitted += 1
+            return True
+
+    def admit(self, name, profiler=None):
+        """Wait for a free slot and admit the session
+
+        Parameters:
+            - name: name of the session
+            - profiler: `FrameProfiler` of the session, used by `profile`
+
+        Return:
+            True if the session is admitted, False if it is rejected
+        """
+        with self._cond:
+            if len(self.sessions) >= self.max_sessions and self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+
+            self.pending += 1
+            admitted = self._cond.wait_for(
+                            lambda: len(self.sessions) < self.max_sessions,
+                            timeout=self.queue_timeout)
+            self.pending -= 1
+
+            if not admitted:
+                self.rejected += 1
+                return False
+
+            self.sessions[name] = profiler
+            self.admitted += 1
+            return True
+
+    async def admit_async(self, name, profiler=None):
+        """Asyncio version of `admit`, to be called from the event loop only
+
+        Return:
+            True if the session is admitted, False if it is rejected
+        """
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()
+
+        if self.try_admit(name, profiler):
+            return True
+
+        with self._cond:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+
+        try:
+            async with self._async_cond:
+                await asyncio.wait_for(
+                        self._async_cond.wait_for(lambda: self.try_admit(name, profiler)),
+                        timeout=self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.reject()
+            return False
+        finally:
+            with self._cond:
+                self.pending -= 1
+
+    def reject(self):
+        with self._cond:
+            self.rejected += 1
+
+    def release(self, name, evicted=False):
+        """Free the slot of a session"""
+        with self._cond:
+            self.sessions.pop(name, None)
+            if evicted:
+                self.evicted += 1
+            self._cond.notify()
+        self.stats.remove(name)
+
+    async def release_async(self, name, evicted=False):
+        """Asyncio version of `release`, wakes up a waiting `admit_async`"""
+        self.release(name, evicted=evicted)
+        if self._async_cond is not None:
+            async with self._async_cond:
+                self._async_cond.notify()
+
+    def profile(self, session, frames, mode="cprofile"):
+        """Operator action profiling the next frames of a running session
+
+        The window starts on the session thread when it handles its next
+        frame, and is capped by the maximum length of the session profiler.
+        """
+        with self._cond:
+            profiler = self.sessions.get(session)
+        if profiler is None:
+            raise KeyError("no profiler for session %s" % session)
+
+        frames = int(frames)
+        if profiler.max_frames is not None:
+            frames = min(frames, profiler.max_frames)
+        profiler.request(frames, mode)
+        return { 'session': session, 'frames': frames, 'mode': mode }
+
+    def summary(self):
+        with self._cond:
+            return {
+                'active': len(self.sessions),
+                'pending': self.pending,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'evicted': self.evicted }
+
+
+def reject_connection(conn, reason):
+    """Send a reject message to a client and close the connection"""
+    try:
+        conn.settimeout(1.)
+        protocol.send_message(conn, protocol.MSG_REJECT, 0, protocol.encode_reject(reason))
+    except OSError:
+        pass
+    finally:
+        conn.close()
 
-HEADER_SIZE = 10
 
 class ClientThread(Thread):
     """Thread for handling client connection
 
     Each time a client connected with the server, the server will spawn a new
-    thread to deal with the new client
+    thread to deal with the new client. The thread first waits to be admitted
+    by the session manager, and ends when the client disconnects or is
+    evicted for being idle.
 
     Here are the expected actions:
     [Client]: Send initial tracking status
@@ -37,188 +672,313 @@ class ClientThread(Thread):
     +----------------------------->>>>  tracking result from kalman filter
     """
 
-    def __init__(self, conn ,addr, device):
+    def __init__(self, conn ,addr, worker, manager, options=None,
+                max_payload=protocol.MAX_PAYLOAD, profiling=None):
         """
         Parameters:
             - conn: socket of connected client
             - addr: (ip, port) information
-            - device: cuda or cpu device
+            - worker: shared inference worker running the object detector
+            - manager: `SessionManager` of the server
+            - options: keyword arguments of the tracking session
+            - max_payload: maximum size of a client message in bytes
+            - profiling: session profiling options (see `profiling_options`)
         """
         super().__init__()
+        self.daemon = True
         self.conn = conn
         self.addr = addr
-        self.device = device
-
-        self.detector = fasterrcnn_resnet50_fpn(num_classes=91, pretrained=True)
-        self.detector.to(device)
-        self.detector.eval()
-
-        self.kalman = KalmanFilter()
-        self.mean = None
-        self.covariance = None
+        self.name = "{}:{}".format(addr[0], addr[1])
+        self.worker = worker
+        self.manager = manager
+        self.options = options or {}
+        self.profiling = profiling or {}
+        self.reader = protocol.MessageReader(conn, max_payload=max_payload)
+        self.session = None
+        self.metrics = None
+        self.profiler = None
 
     def _recv_data(self):
-        """Receive data from client in an agreed format
-
-        Return:
-            a dictionary with following format
-            {
-                'tlahs': [(x, y, a, h)],
-                'state': True,
-                'frame': # compressed frame in jpeg format
-            }
+        """Receive data from client in an agreed format, handling the control
+        messages received in between
         """
-        full_msg = b''
-        new_msg = True
-
         while True:
-            msg = self.conn.recv(4096)
+            msg_type, seq, payload = self.reader.recv()
+            if msg_type != protocol.MSG_PROFILE:
+                return decode_request(msg_type, seq, payload)
 
-            if new_msg:
-                msglen = int(msg[:HEADER_SIZE])
-                new_msg = False
-
-            full_msg += msg
-
-            if len(full_msg)-HEADER_SIZE == msglen:
-                data = pickle.loads(full_msg[HEADER_SIZE:])
-                return data
+            client_profile_request(self.profiler, payload,
+                                self.profiling.get('client_profile', False))
 
     def _send_data(self, data):
-        """Send data to client in an agreed format
+        """Send data to client in an agreed format"""
+        protocol.send_message(self.conn,
+                            protocol.MSG_RESULT, data['seq'], encode_reply(data))
 
-        Data format:
-            {
-                'tlahs': [(x, y, a, h)],
-                'state': True
-            }
-        """
-        global HEADER_SIZE
+    def run(self):
 
-        msg = pickle.dumps(data)
-        msg = bytes(f"{len(msg):<{HEADER_SIZE}}", 'utf-8')+msg
-        self.conn.sendall(msg)
+        # Profiling runs on this thread, requested by DEEPSORT_PROFILE or on demand
+        self.profiler = session_profiler(self.name, self.profiling.get('max_frames'))
 
-    def _compute_iou(self, boxA, boxB):
-        # determine the (x, y)-coordinates of the intersection rectangle
-        xA = max(boxA[0], boxB[0])
-        yA = max(boxA[1], boxB[1])
-        xB = min(boxA[2], boxB[2])
-        yB = min(boxA[3], boxB[3])
+        if not self.manager.admit(self.name, self.profiler):
+            print("Reject {}: server busy".format(self.name))
+            reject_connection(self.conn, "server busy")
+            return
 
-        # compute the area of intersection rectangle
-        interArea = max(0, xB - xA + 1) * max(0, yB - yA + 1)
+        self.conn.settimeout(self.manager.idle_timeout)
+        self.session = TrackingSession(**self.options)
+        self.metrics = self.manager.stats.session(self.name)
 
-        # compute the area of both the prediction and ground-truth
-        # rectangles
-        boxAArea = (boxA[2] - boxA[0] + 1) * (boxA[3] - boxA[1] + 1)
-        boxBArea = (boxB[2] - boxB[0] + 1) * (boxB[3] - boxB[1] + 1)
+        evicted = False
+        try:
+            self._serve()
 
-        # compute the intersection over union by taking the intersection
-        # area and dividing it by the sum of prediction + ground-truth
-        # areas - the interesection area
-        iou = interArea / float(boxAArea + boxBArea - interArea)
+        except socket.timeout:
+            print("Evict idle session {}".format(self.name))
+            evicted = True
+            reject_connection(self.conn, "idle timeout")
 
-        # return the intersection over union value
-        return iou
+        except (ConnectionError, protocol.ProtocolError) as e:
+            print("Disconnection from {} ({})".format(self.name, e))
 
-    def run(self):
+        finally:
+            self.profiler.stop()
+            self.manager.release(self.name, evicted=evicted)
+            self.conn.close()
+            self.session = None
+            self.metrics = None
 
+    def _serve(self):
         while True:
             # Receive tracking status from client
-            try:
-                data = self._recv_data()
-            except Exception as e:
-                time.sleep(0.1)
-                continue
+            # Time the payload only, not the wait for the client
+            data = self._recv_data()
+            self.metrics.record("recv", time.perf_counter()-self.reader.header_time)
+
+            if self.profiler.requested is not None:
+                self.profiler.poll()
 
             if not data['state']:
-                self.mean = None
-                self.covariance = None
+                self.session.reset()
                 continue
 
-            frame = cv2.imdecode(data['frame'], cv2.IMREAD_COLOR)
-
             # Run Tracking algorithm
             # ======================
+            start = time.perf_counter()
+            with self.metrics.time("decode"):
+                input = self.session.preprocess(data)
+
+            # Using faster-rcnn to perform object detection
+            prediction = None
+            if input is not None:
+                with self.metrics.time("detect"):
+                    prediction = self.worker.submit(*input).result()
+
+            with self.metrics.time("associate"):
+                data = self.session.postprocess(data, prediction)
+            with self.metrics.time("send"):
+                self._send_data(data)
+
+            self.metrics.record("frame", time.perf_counter()-start)
+            self.metrics.tick()
+            if self.profiler.active:
+                self.profiler.step()
+
+
+async def reject_stream(writer, reason):
+    """Send a reject message to a client and close the stream"""
+    try:
+        protocol.write_message(writer, protocol.MSG_REJECT, 0, protocol.encode_reject(reason))
+        await asyncio.wait_for(writer.drain(), timeout=1.)
+    except (ConnectionError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+
+async def handle_client(reader, writer, worker, executor, manager, options=None,
+                        max_payload=protocol.MAX_PAYLOAD, profiling=None):
+    """Coroutine handling one client connection in asyncio mode
+
+    Socket I/O runs on the event loop. Frame decoding and kalman filter
+    association run on the bounded executor, and object detection is handed
+    to the shared inference worker, so no thread is held by an idle or slow
+    connection. Messages larger than `max_payload` bytes close the connection.
+
+    The event loop thread is shared with the other sessions, so cprofile only
+    covers the executor calls of the session, not the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    addr = writer.get_extra_info('peername')
+    name = "{}:{}".format(addr[0], addr[1])
+    print("Connection from {}".format(name))
+
+    profiling = profiling or {}
+    profiler = session_profiler(name, profiling.get('max_frames'), per_call=True)
+
+    if not await manager.admit_async(name, profiler):
+        print("Reject {}: server busy".format(name))
+        await reject_stream(writer, "server busy")
+        return
+
+    session = TrackingSession(**(options or {}))
+    metrics = manager.stats.session(name)
+    messages = protocol.AsyncMessageReader(reader, max_payload)
+    evicted = False
+    try:
+        while True:
+            msg_type, seq, payload = await asyncio.wait_for(messages.recv(),
+                                                        timeout=manager.idle_timeout)
+            metrics.record("recv", time.perf_counter()-messages.header_time)
+            if msg_type == protocol.MSG_PROFILE:
+                client_profile_request(profiler, payload,
+                                    profiling.get('client_profile', False))
+                continue
+            data = decode_request(msg_type, seq, payload)
 
-            # Initialize kalman filter state
-            if self.mean is None and self.covariance is None:
-                self.mean, self.covariance = self.kalman.initiate(np.array(data['tlahs'][0]))
-
-            # Detect objects in frame with faster-RCNN and update kalman filter
-            else:
-                # Using faster-rcnn to perform object detection
-                input = [torch.from_numpy(frame/255.).permute(2,0,1).float().to(self.device)]
-                prediction = self.detector(input)[0]
-                boxes = prediction['boxes'].detach().cpu().numpy().tolist()
-                labels = prediction['labels'].detach().cpu().numpy().tolist()
-                scores = prediction['scores'].detach().cpu().numpy().tolist()
-
-                # Filter out only bboxes with respect to person class
-                people = []
-                for box, label, score in zip(boxes, labels, scores):
-                    if label == 1 and score > 0.7:
-                        people.append(box)
-
-                # Assign bbox based on IOU
-                mean, covariance = self.kalman.predict(self.mean, self.covariance)
-
-                ious = []
-                cx, cy, a, h = mean.tolist()[:4]
-                ref_tl_x, ref_tl_y = cx-(a*h/2), cy-(h/2)
-                ref_br_x, ref_br_y = cx+(a*h/2), cy+(h/2)
-
-                for person in people:
-                    tl_x, tl_y, br_x, br_y = person[0], person[1], person[2], person[3]
-                    iou = self._compute_iou(
-                                    [ref_tl_x, ref_tl_y, ref_br_x, ref_br_y],
-                                    [tl_x, tl_y, br_x, br_y])
-                    ious.append(iou)
-
-                print("IOU between measurement and mean:", np.max(ious))
-                if np.max(ious) < 0.5:
-                    data['state'] = False
-                    data['tlahs'] = [self.mean.tolist()[:4]]
-                    self.mean = None
-                    self.covariance = None
-
-                # Update Kalman filter
-                measurement = people[np.argmax(ious)]
-                cx, cy = (measurement[0]+measurement[2])/2, (measurement[1]+measurement[3])/2
-                a = ((measurement[2]-measurement[0])/(measurement[3]-measurement[1]))
-                h = (measurement[3]-measurement[1])
-                self.mean, self.covariance = self.kalman.update(
-                                                mean, covariance,
-                                                np.array([cx, cy, a, h]))
-
-            # Prepare data to send to client
-            del data['frame']
+            if profiler.requested is not None:
+                profiler.poll()
 
-            if data['state']:
-                data['tlahs'] = [self.mean.tolist()[:4]]
+            if not data['state']:
+                session.reset()
+                continue
 
-            self._send_data(data)
+            start = time.perf_counter()
+            with metrics.time("decode"):
+                input = await loop.run_in_executor(executor, profiler.call, session.preprocess, data)
+
+            prediction = None
+            if input is not None:
+                with metrics.time("detect"):
+                    prediction = await asyncio.wrap_future(worker.submit(*input))
+
+            with metrics.time("associate"):
+                data = await loop.run_in_executor(executor, profiler.call,
+                                        session.postprocess, data, prediction)
+            with metrics.time("send"):
+                protocol.write_message(writer, protocol.MSG_RESULT, data['seq'], encode_reply(data))
+                await writer.drain()
+
+            metrics.record("frame", time.perf_counter()-start)
+            metrics.tick()
+            if profiler.active:
+                profiler.step()
+
+    except asyncio.TimeoutError:
+        print("Evict idle session {}".format(name))
+        evicted = True
+        await reject_stream(writer, "idle timeout")
+
+    except (asyncio.IncompleteReadError, ConnectionError, protocol.ProtocolError):
+        print("Disconnection from {}".format(name))
+
+    finally:
+        profiler.stop()
+        await manager.release_async(name, evicted=evicted)
+        writer.close()
+
+class CountingExecutor(ThreadPoolExecutor):
+    """Thread pool counting its submitted tasks that are not finished yet"""
+
+    def __init__(self, max_workers):
+        super().__init__(max_workers=max_workers)
+        self.max_workers = max_workers
+        self.in_flight = 0
+        self._count_lock = Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._count_lock:
+            self.in_flight += 1
+        future = super().submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._count_lock:
+            self.in_flight -= 1
+
+    def queued(self):
+        """Number of tasks waiting for a free thread"""
+        return max(self.in_flight - self.max_workers, 0)
+
+async def serve_async(args, worker, manager):
+    """Serve all the clients on one asyncio event loop"""
+    executor = CountingExecutor(max_workers=int(args['workers']))
+    manager.stats.gauge("executor_queue", executor.queued)
+
+    async def on_connect(reader, writer):
+        await handle_client(reader, writer, worker, executor, manager,
+                            options=session_options(args),
+                            max_payload=int(float(args['max_payload'])*(1 << 20)),
+                            profiling=profiling_options(args))
+
+    server = await asyncio.start_server(on_connect,
+                                        args['ip'], int(args['port']),
+                                        backlog=int(args['backlog']))
+    async with server:
+        await server.serve_forever()
 
 def main(args):
 
     device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
-    clients = []
+
+    # Server statistics
+    # =================
+    stats = ServerStats()
+    if int(args['stats_port']) > 0:
+        stats.serve("127.0.0.1", int(args['stats_port']))
+        print("Serve stats on http://127.0.0.1:{}".format(args['stats_port']))
+    if float(args['stats_interval']) > 0:
+        stats.log_periodically(float(args['stats_interval']))
+
+    # Launch shared object detector
+    # =============================
+    worker = InferenceWorker(device,
+                            max_batch=int(args['max_batch']),
+                            max_wait=float(args['max_wait'])/1000,
+                            metrics=stats.metrics)
+    worker.start()
+    stats.gauge("requests_queue", worker.requests.qsize)
+    stats.gauge("ready_queue", worker.ready.qsize)
+
+    # Sessions are admitted, evicted and released by the session manager
+    manager = SessionManager(stats,
+                            max_sessions=int(args['max_sessions']),
+                            max_pending=int(args['max_pending']),
+                            queue_timeout=float(args['queue_timeout']),
+                            idle_timeout=float(args['idle_timeout']))
+    stats.gauge("sessions", manager.summary)
+
+    # Operators profile a running session with
+    #   curl -X POST "http://127.0.0.1:<stats_port>/profile?session=<ip:port>&frames=<n>&mode=cprofile"
+    stats.action("profile", manager.profile)
 
     # Launch Server
     # =============
     print("Launch server {}:{}".format(args['ip'], args['port']))
+    if args['mode'] == "asyncio":
+        asyncio.run(serve_async(args, worker, manager))
+        return
+
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.bind((args['ip'], int(args['port'])))
-    server_socket.listen(10)
+    server_socket.listen(int(args['backlog']))
 
     # Main thread for listening client connection
     while True:
         conn, addr = server_socket.accept()
         print("Connection from {}:{}".format(addr[0], addr[1]))
-        client = ClientThread(conn, addr, device)
+
+        # No thread is spawned for connections that cannot even wait
+        if manager.saturated():
+            manager.reject()
+            print("Reject {}:{}: server busy".format(addr[0], addr[1]))
+            reject_connection(conn, "server busy")
+            continue
+
+        client = ClientThread(conn, addr, worker, manager, options=session_options(args),
+                            max_payload=int(float(args['max_payload'])*(1 << 20)),
+                            profiling=profiling_options(args))
         client.start()
-        clients.append(client)
 
 if __name__ == "__main__":
     args = vars(parser.parse_args())
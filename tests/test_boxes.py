@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from mot.tracker.boxes import (iou_cost, iou_matrix, tlbr_to_tlwh, tlbr_to_xyah,
+                            tlwh_to_tlbr, tlwh_to_xyah, xyah_to_tlbr, xyah_to_tlwh)
+
+
+def test_iou_counts_inclusive_pixels():
+    boxes = np.array([[0., 0., 1., 1.], [0., 0., 3., 3.]])
+    others = np.array([[0., 0., 1., 1.], [1., 1., 2., 2.], [2., 2., 3., 3.], [5., 5., 5., 5.]])
+
+    expected = np.array([
+        [1., 1/7, 0., 0.],
+        [4/16, 4/16, 4/16, 0.]])
+    assert np.allclose(iou_matrix(boxes, others), expected)
+
+def test_iou_of_single_pixel_boxes():
+    pixel = np.array([[4., 4., 4., 4.]])
+    assert np.allclose(iou_matrix(pixel, pixel), 1.)
+    assert np.allclose(iou_matrix(pixel, pixel + [1., 0., 1., 0.]), 0.)
+
+def test_iou_matches_pairwise_definition():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 50, (6, 2))
+    boxes = np.hstack([corners, corners + rng.uniform(1, 20, (6, 2))])
+
+    ious = iou_matrix(boxes[:3], boxes[3:])
+    for i, a in enumerate(boxes[:3]):
+        for j, b in enumerate(boxes[3:]):
+            w = max(0., min(a[2], b[2]) - max(a[0], b[0]) + 1)
+            h = max(0., min(a[3], b[3]) - max(a[1], b[1]) + 1)
+            area_a = (a[2]-a[0]+1) * (a[3]-a[1]+1)
+            area_b = (b[2]-b[0]+1) * (b[3]-b[1]+1)
+            assert np.isclose(ious[i, j], w*h / (area_a + area_b - w*h))
+
+def test_iou_cost_gating():
+    boxes = np.array([[0., 0., 9., 9.]])
+    others = np.array([[0., 0., 9., 9.], [0., 0., 9., 4.], [20., 20., 29., 29.]])
+
+    cost = iou_cost(boxes, others, max_cost=0.6)
+    assert np.allclose(cost, [[0., 0.5, np.inf]])
+    cost = iou_cost(boxes, others, gate=np.array([[False, True, True]]))
+    assert np.allclose(cost, [[np.inf, 0.5, 1.]])
+
+def test_empty_inputs():
+    assert iou_matrix(np.zeros((0, 4)), np.zeros((3, 4))).shape == (0, 3)
+    assert iou_matrix(np.zeros((2, 4)), np.zeros((0, 4))).shape == (2, 0)
+
+@pytest.mark.parametrize("forward, backward", [
+    (xyah_to_tlbr, tlbr_to_xyah),
+    (xyah_to_tlwh, tlwh_to_xyah),
+    (lambda b: tlwh_to_tlbr(xyah_to_tlwh(b)), lambda b: tlwh_to_xyah(tlbr_to_tlwh(b)))])
+def test_conversions_round_trip(forward, backward):
+    boxes = np.array([[50., 60., .5, 80.], [10., 10., 1., 2.]])
+    assert np.allclose(backward(forward(boxes)), boxes)
+    assert np.allclose(xyah_to_tlbr(boxes[0]), [30., 20., 70., 100.])
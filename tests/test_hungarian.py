@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+import scipy.sparse
+
+from mot.tracker.hungarian import (assignment, linear_assignment,
+                                    matching_cascade, sparse_assignment)
+
+
+def random_costs(rng, n_rows, n_cols, density):
+    cost_matrix = rng.random((n_rows, n_cols))
+    cost_matrix[rng.random((n_rows, n_cols)) > density] = np.inf
+    return cost_matrix
+
+def total_cost(cost_matrix, matches):
+    return cost_matrix[matches[:, 0], matches[:, 1]].sum()
+
+def to_dense(cost_matrix):
+    """Dense copy of a sparse cost matrix, missing entries are gated out"""
+    dense = np.full(cost_matrix.shape, np.inf)
+    coo = cost_matrix.tocoo()
+    dense[coo.row, coo.col] = coo.data
+    return dense
+
+def check_partition(result, n_rows, n_cols):
+    matches, unmatched_rows, unmatched_cols = result
+    assert sorted(np.concatenate([matches[:, 0], unmatched_rows])) == list(range(n_rows))
+    assert sorted(np.concatenate([matches[:, 1], unmatched_cols])) == list(range(n_cols))
+
+
+@pytest.mark.parametrize("max_cost", [0.5, 0.9, np.inf])
+def test_sparse_matches_dense(max_cost):
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n_rows, n_cols = rng.integers(0, 25, 2)
+        cost_matrix = random_costs(rng, n_rows, n_cols, rng.random())
+
+        dense = linear_assignment(cost_matrix, max_cost)
+        sparse = sparse_assignment(cost_matrix, max_cost)
+        check_partition(sparse, n_rows, n_cols)
+
+        assert len(sparse[0]) == len(dense[0])
+        assert np.isclose(total_cost(cost_matrix, sparse[0]), total_cost(cost_matrix, dense[0]))
+        assert np.all(cost_matrix[sparse[0][:, 0], sparse[0][:, 1]] <= max_cost)
+
+def test_scipy_sparse_input():
+    cost_matrix = scipy.sparse.random(40, 30, density=0.1, random_state=2, format='csr')
+    dense = to_dense(cost_matrix)
+
+    expected = linear_assignment(dense, 0.8)
+    for result in (linear_assignment(cost_matrix, 0.8),
+                    sparse_assignment(cost_matrix, 0.8),
+                    assignment(cost_matrix, 0.8)):
+        check_partition(result, 40, 30)
+        assert len(result[0]) == len(expected[0])
+        assert np.isclose(total_cost(dense, result[0]), total_cost(dense, expected[0]))
+
+def test_assignment_picks_either_solver():
+    rng = np.random.default_rng(3)
+    for n, density in ((10, 1.), (600, 0.002), (600, 0.5)):
+        cost_matrix = random_costs(rng, n, n, density)
+        result = assignment(cost_matrix, 0.7)
+        expected = linear_assignment(cost_matrix, 0.7)
+        assert len(result[0]) == len(expected[0])
+        assert np.isclose(total_cost(cost_matrix, result[0]), total_cost(cost_matrix, expected[0]))
+
+def test_empty_problems():
+    for shape in ((0, 0), (0, 3), (4, 0)):
+        for solver in (linear_assignment, sparse_assignment, assignment):
+            matches, rows, cols = solver(np.zeros(shape))
+            assert matches.shape == (0, 2)
+            assert len(rows) == shape[0] and len(cols) == shape[1]
+
+    matches, rows, cols = sparse_assignment(np.full((3, 2), np.inf))
+    assert len(matches) == 0 and len(rows) == 3 and len(cols) == 2
+
+@pytest.mark.parametrize("sparse", [None, True, False])
+def test_matching_cascade_prefers_recent_tracks(sparse):
+    # Both tracks want the single detection, the most recently updated wins
+    # even though its cost is higher
+    cost_matrix = np.array([[0.1], [0.3]])
+    matches, unmatched_rows, unmatched_cols = matching_cascade(
+                                    cost_matrix, [2, 1], max_cost=0.5, sparse=sparse)
+    assert matches.tolist() == [[1, 0]]
+    assert unmatched_rows.tolist() == [0]
+    assert len(unmatched_cols) == 0
+
+@pytest.mark.parametrize("sparse", [None, True, False])
+def test_matching_cascade_sparse_input(sparse):
+    rng = np.random.default_rng(4)
+    cost_matrix = scipy.sparse.random(20, 15, density=0.2, random_state=5, format='csr')
+    ages = rng.integers(1, 4, 20)
+
+    dense = to_dense(cost_matrix)
+
+    result = matching_cascade(cost_matrix, ages, max_cost=0.9, sparse=sparse)
+    expected = matching_cascade(dense, ages, max_cost=0.9, sparse=False)
+    check_partition(result, 20, 15)
+    assert len(result[0]) > 0
+    assert np.isclose(total_cost(dense, result[0]), total_cost(dense, expected[0]))
@@ -0,0 +1,147 @@
+import numpy as np
+import pytest
+
+from mot.tracker import FastKalmanFilter, KalmanFilter, Tracker
+
+
+def random_xyah(rng, n):
+    boxes = np.empty((n, 4))
+    boxes[:, 0] = rng.uniform(0, 1920, n)
+    boxes[:, 1] = rng.uniform(0, 1080, n)
+    boxes[:, 2] = rng.uniform(0.3, 0.6, n)
+    boxes[:, 3] = rng.uniform(40, 200, n)
+    return boxes
+
+def run_filter(kf, measurements, steps, rng, batch=True):
+    """Alternate predictions and noisy updates, return all the states"""
+    if batch:
+        means, covariances = kf.initiate_batch(measurements)
+    else:
+        states = [ kf.initiate(m) for m in measurements ]
+        means = np.stack([ m for m, _ in states ])
+        covariances = np.stack([ c for _, c in states ])
+
+    history = []
+    for step in range(steps):
+        if batch:
+            means, covariances = kf.predict_batch(means, covariances)
+        else:
+            states = [ kf.predict(m, c) for m, c in zip(means, covariances) ]
+            means, covariances = np.stack([ m for m, _ in states ]), np.stack([ c for _, c in states ])
+        history.append((means, covariances))
+
+        if step % 3 != 2:
+            observed = means[:, :4] + rng.normal(0, [2, 2, 0.01, 2], (len(means), 4))
+            if batch:
+                means, covariances = kf.update_batch(means, covariances, observed)
+            else:
+                states = [ kf.update(m, c, z) for m, c, z in zip(means, covariances, observed) ]
+                means, covariances = np.stack([ m for m, _ in states ]), np.stack([ c for _, c in states ])
+            history.append((means, covariances))
+
+    return history
+
+
+@pytest.mark.parametrize("kf", [KalmanFilter(), FastKalmanFilter()])
+def test_batch_matches_single(kf):
+    measurements = random_xyah(np.random.default_rng(0), 20)
+    batch = run_filter(kf, measurements, 10, np.random.default_rng(1), batch=True)
+    single = run_filter(kf, measurements, 10, np.random.default_rng(1), batch=False)
+
+    for (means, covariances), (expected_means, expected_covariances) in zip(batch, single):
+        assert np.allclose(means, expected_means)
+        assert np.allclose(covariances, expected_covariances)
+
+def test_fast_matches_general():
+    measurements = random_xyah(np.random.default_rng(2), 30)
+    general = run_filter(KalmanFilter(), measurements, 20, np.random.default_rng(3))
+    fast = run_filter(FastKalmanFilter(), measurements, 20, np.random.default_rng(3))
+
+    for (means, covariances), (fast_means, fast_covariances) in zip(general, fast):
+        assert np.allclose(fast_means, means, rtol=1e-9)
+        assert np.allclose(FastKalmanFilter.to_full(fast_covariances), covariances, rtol=1e-9)
+
+def test_fast_check_mode():
+    kf = FastKalmanFilter(check=True)
+    run_filter(kf, random_xyah(np.random.default_rng(4), 10), 10, np.random.default_rng(5))
+    run_filter(kf, random_xyah(np.random.default_rng(4), 3), 5, np.random.default_rng(5), batch=False)
+
+    means, covariances = kf.initiate_batch(random_xyah(np.random.default_rng(6), 5))
+    kf.gating_distance(means, covariances, random_xyah(np.random.default_rng(7), 4))
+    # A gating matrix shaped like a covariance block is not mistaken for one
+    kf.gating_distance(means[:4], covariances[:4], random_xyah(np.random.default_rng(7), 3))
+
+    # A corrupted covariance block is caught by the accuracy mode
+    kf._reference.predict_batch = lambda m, c: (m, c)
+    with pytest.raises(AssertionError):
+        kf.predict_batch(means, covariances)
+
+def test_block_conversions():
+    kf = FastKalmanFilter()
+    _, covariances = kf.initiate_batch(random_xyah(np.random.default_rng(8), 4))
+    covariances[:, :, 1] = 3.
+    full = FastKalmanFilter.to_full(covariances)
+    assert full.shape == (4, 8, 8)
+    assert np.allclose(full, np.swapaxes(full, 1, 2))
+    assert np.array_equal(FastKalmanFilter.from_full(full), covariances)
+
+@pytest.mark.parametrize("only_position", [False, True])
+def test_gating_distance_matches_naive(only_position):
+    rng = np.random.default_rng(9)
+    measurements = random_xyah(rng, 8)
+    kf = KalmanFilter()
+    means, covariances = kf.predict_batch(*kf.initiate_batch(random_xyah(rng, 6)))
+
+    n_dim = 2 if only_position else 4
+    expected = np.empty((6, 8))
+    for i, (mean, covariance) in enumerate(zip(means, covariances)):
+        projected_mean, projected_covariance = kf._project(mean, covariance)
+        precision = np.linalg.inv(projected_covariance[:n_dim, :n_dim])
+        for j, measurement in enumerate(measurements):
+            d = measurement[:n_dim] - projected_mean[:n_dim]
+            expected[i, j] = d @ precision @ d
+
+    fast = FastKalmanFilter()
+    assert np.allclose(kf.gating_distance(means, covariances, measurements, only_position), expected)
+    assert np.allclose(fast.gating_distance(means, FastKalmanFilter.from_full(covariances),
+                                            measurements, only_position), expected)
+
+@pytest.mark.parametrize("only_position", [False, True])
+def test_gating_distance_correlated_covariances(only_position):
+    rng = np.random.default_rng(12)
+    n_dim = 2 if only_position else 4
+    factors = rng.normal(0, 3, (5, 8, 8))
+    covariances = np.matmul(factors, np.swapaxes(factors, 1, 2)) + np.eye(8)
+    means = np.hstack([random_xyah(rng, 5), rng.normal(0, 1, (5, 4))])
+    measurements = means[:, :4] + rng.normal(0, 5, (5, 4))
+
+    kf = KalmanFilter()
+    distances = kf.gating_distance(means, covariances, measurements, only_position)
+    for i in range(5):
+        projected_mean, projected_covariance = kf._project(means[i], covariances[i])
+        for j in range(5):
+            d = measurements[j, :n_dim] - projected_mean[:n_dim]
+            assert np.isclose(distances[i, j],
+                            d @ np.linalg.solve(projected_covariance[:n_dim, :n_dim], d))
+
+def test_gating_distance_empty_inputs():
+    for kf in (KalmanFilter(), FastKalmanFilter()):
+        means, covariances = kf.initiate_batch(random_xyah(np.random.default_rng(10), 3))
+        assert kf.gating_distance(means, covariances, np.zeros((0, 4))).shape == (3, 0)
+        assert kf.gating_distance(means[:0], covariances[:0], means[:, :4]).shape == (0, 3)
+
+def test_tracker_fast_kalman_is_identical():
+    rng = np.random.default_rng(11)
+    boxes = random_xyah(rng, 40)
+    velocities = rng.normal(0, 3, (40, 2))
+    general, fast = Tracker(), Tracker(fast_kalman=True)
+
+    for _ in range(30):
+        boxes[:, :2] += velocities
+        detections = boxes + rng.normal(0, [1, 1, 0.005, 1], (40, 4))
+        detections = detections[rng.random(40) > 0.1]
+        assert np.array_equal(general.step(detections), fast.step(detections))
+
+    assert np.allclose(general.means, fast.means)
+    assert np.allclose(general.covariances, FastKalmanFilter.to_full(fast.covariances))
+    assert len(general.confirmed()[0]) > 30
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from mot.store import TrackStore, TrackWriter
+from tools.merge_tracks import TrackSource, frame_runs, merge, write_columnar, write_csv
+
+
+def write_track(path, frames, tid=None):
+    """Write a "frame,x,y,a,h" (or "frame,id,x,y,a,h") text track file"""
+    with open(path, "w") as f:
+        for frame in frames:
+            prefix = "{}".format(frame) if tid is None else "{},{}".format(frame, tid)
+            f.write("{},{},{},0.5,{}\n".format(prefix, frame, 2*frame, 10+frame))
+
+def naive_merge(tracks):
+    """Records (frame, id, x) of all tracks sorted by frame, then by track"""
+    records = [ (frame, tid, frame) for tid, frames in enumerate(tracks) for frame in frames ]
+    return sorted(records, key=lambda r: (r[0], r[1]))
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 4096])
+def test_frame_runs_across_blocks(tmp_path, block_size):
+    path = str(tmp_path / "track.txt")
+    with open(path, "w") as f:
+        for frame, tid in [(0, 1), (0, 2), (0, 3), (1, 1), (3, 1), (3, 2)]:
+            f.write("{},{},1,2,0.5,4\n".format(frame, tid))
+
+    runs = list(frame_runs(TrackSource(path, block_size=block_size)))
+    assert [ int(frame) for frame, _, _ in runs ] == [0, 1, 3]
+    assert [ ids.tolist() for _, ids, _ in runs ] == [[1, 2, 3], [1], [1, 2]]
+
+@pytest.mark.parametrize("block_size", [2, 4096])
+def test_merge_orders_by_frame_then_source(tmp_path, block_size):
+    # Tracks of different lengths, starting and ending at different frames
+    tracks = [range(5, 40), range(0, 10), range(20, 25), range(0, 60, 3)]
+    sources = []
+    for tid, frames in enumerate(tracks):
+        path = str(tmp_path / "{}.txt".format(tid))
+        write_track(path, frames)
+        sources.append(TrackSource(path, tid=tid, block_size=block_size))
+
+    merged = list(merge(sources))
+    frames = [ int(frame) for frame, _, _ in merged ]
+    assert frames == sorted(set(frames))
+
+    records = [ (int(frame), int(tid), float(x))
+                for frame, ids, xyahs in merged for tid, x in zip(ids, xyahs[:, 0]) ]
+    assert records == naive_merge(tracks)
+
+def test_merge_columnar_and_text_sources(tmp_path):
+    with TrackWriter(str(tmp_path / "columnar")) as writer:
+        for frame in range(0, 10, 2):
+            writer.append(frame, [7, 8], [[frame, 0, 0.5, 1], [frame, 1, 0.5, 1]])
+    write_track(str(tmp_path / "text.txt"), range(1, 10, 2), tid=9)
+
+    merged = list(merge([ TrackSource(str(tmp_path / "columnar"), block_size=3),
+                        TrackSource(str(tmp_path / "text.txt"), block_size=3) ]))
+    assert [ int(frame) for frame, _, _ in merged ] == list(range(10))
+    assert [ ids.tolist() for _, ids, _ in merged[:2] ] == [[7, 8], [9]]
+
+@pytest.mark.parametrize("block_size", [1, 2, 4096])
+def test_merge_repeated_frames(tmp_path, block_size):
+    # Both sources repeat frame 1 and the same (frame, id) record
+    records = [
+        [(0, 1, 0.), (1, 1, 1.), (1, 1, 2.), (1, 2, 3.), (2, 1, 4.)],
+        [(1, 1, 5.), (1, 1, 6.), (3, 4, 7.)]]
+    sources = []
+    for k, lines in enumerate(records):
+        path = str(tmp_path / "{}.txt".format(k))
+        with open(path, "w") as f:
+            for frame, tid, x in lines:
+                f.write("{},{},{},0,0.5,1\n".format(frame, tid, x))
+        sources.append(TrackSource(path, block_size=block_size))
+
+    merged = list(merge(sources))
+    assert [ int(frame) for frame, _, _ in merged ] == [0, 1, 2, 3]
+    assert merged[1][1].tolist() == [1, 1, 2, 1, 1]
+    assert merged[1][2][:, 0].tolist() == [1., 2., 3., 5., 6.]
+
+def test_merge_of_nothing():
+    assert list(merge([])) == []
+
+def test_writers_agree(tmp_path):
+    tracks = [range(0, 30), range(10, 15), range(5, 50, 5)]
+    sources = []
+    for tid, frames in enumerate(tracks):
+        path = str(tmp_path / "{}.txt".format(tid))
+        write_track(path, frames)
+        sources.append(path)
+
+    write_csv(str(tmp_path / "merged.csv"),
+            merge([ TrackSource(p, tid=tid) for tid, p in enumerate(sources) ]), block_size=7)
+    write_columnar(str(tmp_path / "merged"),
+            merge([ TrackSource(p, tid=tid) for tid, p in enumerate(sources) ]))
+
+    text = np.loadtxt(str(tmp_path / "merged.csv"), delimiter=",")
+    store = TrackStore(str(tmp_path / "merged"))
+    assert len(store) == len(text)
+    assert np.array_equal(np.asarray(store.columns['frame']), text[:, 0])
+    assert np.array_equal(np.asarray(store.columns['id']), text[:, 1])
+    assert np.allclose(store.xyahs(store.columns), text[:, 2:])
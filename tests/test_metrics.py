@@ -0,0 +1,73 @@
+import sys
+import time
+from threading import Thread
+
+import pytest
+
+from metrics import FrameCounter, LatencyHistogram, Metrics
+
+
+@pytest.fixture
+def fast_switching():
+    """Switch threads often to expose unguarded read-modify-writes"""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+def run_threads(target, n_threads=8):
+    threads = [ Thread(target=target) for _ in range(n_threads) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_frame_counter_concurrent_ticks(fast_switching):
+    counter = FrameCounter()
+
+    def ticks():
+        for _ in range(20000):
+            counter.tick()
+
+    run_threads(ticks)
+    assert counter.count == 8 * 20000
+    assert counter.fps() > 0.
+
+def test_frame_counter_fps():
+    counter = FrameCounter(window=4)
+    assert counter.fps() == 0.
+    for _ in range(10):
+        counter.tick()
+        time.sleep(0.01)
+    assert 20. < counter.fps() <= 110.
+    assert counter.fps(timeout=0.) == 0.
+
+def test_session_ticks_reach_parent(fast_switching):
+    server = Metrics()
+    sessions = [ Metrics(parent=server) for _ in range(4) ]
+
+    def ticks():
+        for session in sessions:
+            for _ in range(2000):
+                session.tick()
+                session.record("frame", 0.001)
+
+    run_threads(ticks)
+    summary = server.summary()
+    assert summary['frames'] == 8 * 4 * 2000
+    assert summary['stages']['frame']['count'] == 8 * 4 * 2000
+    assert all(session.summary()['frames'] == 8 * 2000 for session in sessions)
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for ms in range(1, 101):
+        histogram.record(ms / 1000)
+
+    summary = histogram.summary()
+    assert summary['count'] == 100
+    assert summary['mean_ms'] == pytest.approx(50.5)
+    assert summary['max_ms'] == pytest.approx(100.)
+    # Percentiles are bucket upper bounds, within the bucket growth of 10%
+    for key, value in [('p50_ms', 50.), ('p95_ms', 95.), ('p99_ms', 99.)]:
+        assert value <= summary[key] <= value * 1.1
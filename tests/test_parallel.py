@@ -0,0 +1,69 @@
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from multimedia import ParallelVideoStream
+
+
+N_FRAMES = 40
+
+@pytest.fixture
+def video(tmp_path):
+    """Video whose frame i is uniformly filled with the value 5*i"""
+    path = str(tmp_path / "video.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (64, 48))
+    for i in range(N_FRAMES):
+        writer.write(np.full((48, 64, 3), 5*i, dtype=np.uint8))
+    writer.release()
+    return path
+
+def frame_index(frame):
+    return int(round(frame.mean() / 5))
+
+
+def test_lossless_reads_all_frames_in_order(video):
+    stream = ParallelVideoStream(video, queue_size=4, resolution=(32, 24), workers=3)
+    assert stream.policy == "lossless"
+    stream.start()
+
+    indices = []
+    while True:
+        frame = stream.read()
+        if frame is None:
+            break
+        indices.append(frame_index(frame))
+    stream.stop()
+
+    assert indices == list(range(N_FRAMES))
+
+def test_latest_skips_to_newest_frame(video):
+    stream = ParallelVideoStream(video, queue_size=4, resolution=(32, 24), workers=1,
+                                policy="latest")
+    stream.start()
+    time.sleep(1.)
+
+    # Frames are dropped while the ring is full, read returns the newest of
+    # the ring and the stream is over right after
+    frame = stream.read()
+    assert 3 <= frame_index(frame) < N_FRAMES
+    assert stream.read() is None
+    stream.stop()
+
+def test_stop_is_idempotent(video):
+    stream = ParallelVideoStream(video, queue_size=4, resolution=(32, 24), workers=2)
+    stream.start()
+    assert stream.read() is not None
+
+    stream.stop()
+    stream.stop()
+    assert stream.read() is None
+    assert stream.size() == 0
+
+    # Stopping a stream that never started
+    ParallelVideoStream(video, workers=1).stop()
+
+def test_unknown_policy(video):
+    with pytest.raises(ValueError):
+        ParallelVideoStream(video, workers=1, policy="oldest")
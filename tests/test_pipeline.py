@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+import pytest
+
+from mot.pipeline import OfflinePipeline, Stage
+from mot.store import TrackStore
+from mot.tracker import Tracker
+
+
+class FakeStream:
+    """Stream of blank frames, counting the decoded frames"""
+
+    def __init__(self, n_frames, delay=0.):
+        self.n_frames = n_frames
+        self.delay = delay
+        self.decoded = 0
+
+    def read(self):
+        if self.decoded >= self.n_frames:
+            return None
+        self.decoded += 1
+        time.sleep(self.delay)
+        return np.zeros((8, 8, 3), dtype=np.uint8)
+
+def moving_box_detector(frames, frame_ids):
+    """One box moving right by one pixel per frame"""
+    return [ { 'boxes': np.array([[10.+i, 10., 30.+i, 50.]]) } for i in frame_ids ]
+
+def failing_detector(frames, frame_ids):
+    raise RuntimeError("boom")
+
+
+def test_pipeline_writes_tracks(tmp_path):
+    stream = FakeStream(50)
+    pipeline = OfflinePipeline(stream, moving_box_detector, Tracker(), batch_size=4, queue_size=4)
+
+    reports = pipeline.run(str(tmp_path / "tracks.txt"))
+    assert [ r['stage'] for r in reports ] == ["decode", "detect", "track", "write"]
+    assert all(r['frames'] == 50 for r in reports)
+
+    lines = (tmp_path / "tracks.txt").read_text().splitlines()
+    frames = [ int(line.split(",")[0]) for line in lines ]
+    assert frames == sorted(frames)
+    # The track is confirmed after n_init frames and then reported every frame
+    assert len(lines) == 50 - Tracker().n_init + 1
+    assert len(set(line.split(",")[1] for line in lines)) == 1
+
+def test_pipeline_writes_columnar_tracks(tmp_path):
+    pipeline = OfflinePipeline(FakeStream(20), moving_box_detector, Tracker(), batch_size=3)
+    pipeline.run(str(tmp_path / "tracks"), columnar=True)
+
+    store = TrackStore(str(tmp_path / "tracks"))
+    assert store.frame_range() == (Tracker().n_init - 1, 19)
+    assert len(store.track_ids()) == 1
+
+def test_detector_error_aborts_decoding():
+    stream = FakeStream(3000, delay=0.001)
+    pipeline = OfflinePipeline(stream, failing_detector, Tracker(), batch_size=8, queue_size=16)
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="boom"):
+        pipeline.run("/dev/null")
+
+    assert time.monotonic() - start < 1.
+    # Only the frames buffered in the queues before the failure are decoded
+    assert stream.decoded < 100
+
+def test_tracker_error_aborts_pipeline():
+    class FailingTracker:
+        def step(self, measurements):
+            raise ValueError("tracker failure")
+
+    stream = FakeStream(3000, delay=0.001)
+    pipeline = OfflinePipeline(stream, moving_box_detector, FailingTracker())
+    with pytest.raises(ValueError, match="tracker failure"):
+        pipeline.run("/dev/null")
+    assert stream.decoded < 200
+
+def test_source_stage_stops_on_abort():
+    def endless():
+        while True:
+            yield 1
+
+    stage = Stage("source", endless())
+    stage.abort.set()
+    stage.start()
+    stage.join(timeout=1.)
+    assert not stage.is_alive()
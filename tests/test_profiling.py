@@ -0,0 +1,74 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from profiling import FrameProfiler
+
+
+def busy_work(n):
+    return sum(i*i for i in range(n))
+
+
+def test_window_profiles_calling_thread(tmp_path):
+    profiler = FrameProfiler("stage", output_dir=str(tmp_path))
+    profiler.start(2)
+    assert sys.getprofile() is not None
+
+    busy_work(1000)
+    profiler.step()
+    assert profiler.active
+    profiler.step()
+
+    assert not profiler.active
+    assert sys.getprofile() is None
+    summary, = tmp_path.glob("stage-*.prof.txt")
+    assert "busy_work" in summary.read_text()
+
+def test_window_is_capped(tmp_path):
+    profiler = FrameProfiler("stage", output_dir=str(tmp_path), max_frames=3)
+    profiler.start(100)
+    for _ in range(3):
+        profiler.step()
+    assert not profiler.active
+
+def test_per_call_profiles_executor_threads_only(tmp_path):
+    profiler = FrameProfiler("session", output_dir=str(tmp_path), per_call=True)
+    profiler.start(1)
+
+    # The thread starting the window is left alone
+    assert sys.getprofile() is None
+    with ThreadPoolExecutor(2) as executor:
+        assert executor.submit(profiler.call, busy_work, 1000).result() == busy_work(1000)
+        assert executor.submit(sys.getprofile).result() is None
+
+    paths = profiler.stop()
+    summary = [ p for p in paths if p.endswith(".prof.txt") ][0]
+    assert "busy_work" in open(summary).read()
+
+def test_call_without_window():
+    profiler = FrameProfiler("session", per_call=True)
+    assert profiler.call(busy_work, 10) == busy_work(10)
+    assert profiler.stop() == []
+
+def test_request_starts_on_poll(tmp_path):
+    profiler = FrameProfiler("session", output_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        profiler.request(5, "nope")
+
+    profiler.request(5)
+    assert not profiler.active
+    profiler.poll()
+    assert profiler.active and profiler.requested is None
+    profiler.stop()
+    assert sys.getprofile() is None
+
+def test_env_setting(monkeypatch):
+    monkeypatch.delenv("DEEPSORT_PROFILE", raising=False)
+    assert FrameProfiler.env_setting() is None
+    assert FrameProfiler.from_env("stage") is None
+
+    monkeypatch.setenv("DEEPSORT_PROFILE", "7")
+    assert FrameProfiler.env_setting() == (7, "cprofile")
+    monkeypatch.setenv("DEEPSORT_PROFILE", "3:both")
+    assert FrameProfiler.env_setting() == (3, "both")
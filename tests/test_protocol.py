@@ -0,0 +1,132 @@
+import socket
+import asyncio
+from threading import Thread
+
+import numpy as np
+import pytest
+
+import protocol
+
+
+def payload_of(buffers):
+    return memoryview(b''.join(bytes(memoryview(b).cast('B')) for b in buffers))
+
+def send_and_receive(buffers, msg_type=protocol.MSG_TRACK, sequence=7, **reader_options):
+    sender, receiver = socket.socketpair()
+    try:
+        # Large messages exceed the socket buffer, send them from a thread
+        thread = Thread(target=protocol.send_message, args=(sender, msg_type, sequence, buffers))
+        thread.start()
+        result = protocol.MessageReader(receiver, buffer_size=16, **reader_options).recv()
+        thread.join()
+        return result
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_tracking_round_trip():
+    tlahs = np.array([[10., 20., 0.5, 100.], [1., 2., 3., 4.]])
+    frame = np.arange(1000, dtype=np.uint8)
+    payload = payload_of(protocol.encode_tracking(True, tlahs, frame,
+                                                roi=[1, 2, 3, 4], predicted=True))
+
+    state, decoded, decoded_frame, roi, predicted = protocol.decode_tracking(payload)
+    assert state and predicted
+    assert np.array_equal(decoded, tlahs)
+    assert np.array_equal(decoded_frame, frame)
+    assert roi == [1., 2., 3., 4.]
+
+def test_tracking_round_trip_without_optional_parts():
+    payload = payload_of(protocol.encode_tracking(False, []))
+    state, tlahs, frame, roi, predicted = protocol.decode_tracking(payload)
+    assert not state and not predicted
+    assert tlahs.shape == (0, 4)
+    assert frame is None and roi is None
+
+@pytest.mark.parametrize("size", [0, 1000, 1 << 20])
+def test_message_round_trip_over_socket(size):
+    frame = np.random.default_rng(0).integers(0, 256, size, dtype=np.uint8)
+    tlahs = [[1., 2., 3., 4.]]
+
+    msg_type, sequence, payload = send_and_receive(protocol.encode_tracking(True, tlahs, frame))
+    assert (msg_type, sequence) == (protocol.MSG_TRACK, 7)
+    _, decoded, decoded_frame, _, _ = protocol.decode_tracking(payload)
+    assert np.array_equal(decoded, tlahs)
+    if size == 0:
+        assert decoded_frame is None
+    else:
+        assert np.array_equal(decoded_frame, frame)
+
+def test_profile_and_reject_round_trip():
+    for mode in protocol.PROFILE_MODES:
+        payload = payload_of(protocol.encode_profile(300, mode))
+        assert protocol.decode_profile(payload) == (300, mode)
+
+    assert protocol.decode_reject(payload_of(protocol.encode_reject("server busy"))) == "server busy"
+
+@pytest.mark.parametrize("cut", [1, 9, 40])
+def test_truncated_tracking_message(cut):
+    payload = bytes(payload_of(protocol.encode_tracking(True, [[1., 2., 3., 4.]], roi=[0, 0, 1, 1])))
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_tracking(memoryview(payload[:len(payload)-cut]))
+
+def test_truncated_profile_message():
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_profile(memoryview(b'\x00\x01'))
+    with pytest.raises(protocol.ProtocolError):
+        protocol.decode_profile(memoryview(protocol.PROFILE_META.pack(10, 99)))
+
+def test_connection_closed_mid_message():
+    sender, receiver = socket.socketpair()
+    header = protocol.HEADER.pack(protocol.MAGIC, protocol.VERSION, protocol.MSG_TRACK, 0, 100)
+    sender.sendall(header + b'\x00'*10)
+    sender.close()
+    with pytest.raises(ConnectionError):
+        protocol.MessageReader(receiver).recv()
+    receiver.close()
+
+def test_invalid_header():
+    sender, receiver = socket.socketpair()
+    sender.sendall(protocol.HEADER.pack(b'XX', protocol.VERSION, protocol.MSG_TRACK, 0, 0))
+    with pytest.raises(protocol.ProtocolError):
+        protocol.MessageReader(receiver).recv()
+    sender.close()
+    receiver.close()
+
+def test_oversized_message_is_rejected_before_allocation():
+    sender, receiver = socket.socketpair()
+    # Only the header is sent, the reader must not wait for 4 GiB of payload
+    sender.sendall(protocol.HEADER.pack(protocol.MAGIC, protocol.VERSION,
+                                        protocol.MSG_TRACK, 0, (1 << 32) - 1))
+    reader = protocol.MessageReader(receiver)
+    with pytest.raises(protocol.ProtocolError):
+        reader.recv()
+    assert len(reader._buffer) <= protocol.MAX_PAYLOAD
+    sender.close()
+    receiver.close()
+
+def test_payload_limit_is_configurable():
+    buffers = protocol.encode_tracking(True, [], np.zeros(2000, dtype=np.uint8))
+    with pytest.raises(protocol.ProtocolError):
+        send_and_receive(buffers, max_payload=1000)
+    assert len(send_and_receive(buffers, max_payload=4000)[2]) > 2000
+
+def test_async_reader_limits_and_decodes():
+    async def run():
+        stream = asyncio.StreamReader()
+        for buffers in (protocol.encode_tracking(True, [[1., 2., 3., 4.]]),
+                        protocol.encode_tracking(True, [], np.zeros(500, dtype=np.uint8))):
+            for b in protocol._frame_buffers(protocol.MSG_TRACK, 3, buffers):
+                stream.feed_data(bytes(b))
+
+        reader = protocol.AsyncMessageReader(stream, max_payload=100)
+        msg_type, sequence, payload = await reader.recv()
+        assert (msg_type, sequence) == (protocol.MSG_TRACK, 3)
+        assert protocol.decode_tracking(payload)[1].tolist() == [[1., 2., 3., 4.]]
+        assert reader.header_time is not None
+
+        with pytest.raises(protocol.ProtocolError):
+            await reader.recv()
+
+    asyncio.run(run())
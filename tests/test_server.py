@@ -0,0 +1,58 @@
+import sys
+import socket
+import asyncio
+
+import pytest
+
+pytest.importorskip("torch")
+
+import profiling
+import protocol
+from metrics import ServerStats
+from server import ClientThread, SessionManager, handle_client
+
+
+@pytest.fixture
+def profiled(monkeypatch, tmp_path):
+    monkeypatch.setenv("DEEPSORT_PROFILE", "5:both")
+    monkeypatch.setenv("DEEPSORT_PROFILE_DIR", str(tmp_path))
+
+def full_manager():
+    return SessionManager(ServerStats(), max_sessions=0, max_pending=0)
+
+
+def test_rejected_thread_leaves_no_profiler(profiled):
+    server, client = socket.socketpair()
+    manager = full_manager()
+    thread = ClientThread(server, ("127.0.0.1", 1234), None, manager)
+    thread.start()
+    thread.join(5)
+
+    msg_type, _, payload = protocol.MessageReader(client).recv()
+    assert msg_type == protocol.MSG_REJECT
+    assert protocol.decode_reject(payload) == "server busy"
+    assert manager.rejected == 1
+    assert not thread.profiler.active
+    assert not profiling._torch_lock.locked()
+    client.close()
+
+def test_rejected_coroutine_leaves_no_profiler(profiled):
+    manager = full_manager()
+
+    async def run():
+        server = await asyncio.start_server(
+                    lambda r, w: handle_client(r, w, None, None, manager), "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        msg_type, _, payload = await protocol.AsyncMessageReader(reader, 1024).recv()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        # The event loop thread is shared by all the sessions
+        return msg_type, protocol.decode_reject(payload), sys.getprofile()
+
+    msg_type, reason, profile = asyncio.run(run())
+    assert msg_type == protocol.MSG_REJECT
+    assert reason == "server busy"
+    assert profile is None
+    assert not profiling._torch_lock.locked()
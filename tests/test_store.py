@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+import pytest
+
+from mot.store import INDEX_DTYPE, TrackStore, TrackWriter, count_rows, read_columns
+
+
+def random_records(rng, n_frames=50, n_ids=12):
+    """Records in frame order, a random subset of the ids in each frame"""
+    frames, ids = [], []
+    for frame in range(n_frames):
+        alive = np.flatnonzero(rng.random(n_ids) < 0.6)
+        frames.extend([frame]*len(alive))
+        ids.extend(alive.tolist())
+    xyahs = rng.random((len(frames), 4)).astype(np.float32)
+    return np.array(frames), np.array(ids), xyahs
+
+def write(path, frames, ids, xyahs, chunk=7, append=False):
+    with TrackWriter(path, append=append) as writer:
+        for start in range(0, len(frames), chunk):
+            end = start + chunk
+            writer.append(frames[start:end], ids[start:end], xyahs[start:end])
+
+
+@pytest.fixture
+def records():
+    return random_records(np.random.default_rng(0))
+
+def test_frame_lookups(tmp_path, records):
+    frames, ids, xyahs = records
+    path = str(tmp_path / "tracks")
+    write(path, frames, ids, xyahs)
+    store = TrackStore(path)
+
+    assert len(store) == len(frames)
+    assert store.frame_range() == (0, frames.max())
+    for first, last in [(0, 0), (3, 10), (49, 49), (45, 100)]:
+        mask = (frames >= first) & (frames <= last)
+        result = store.frames(first, last)
+        assert np.array_equal(result['frame'], frames[mask])
+        assert np.array_equal(result['id'], ids[mask])
+        assert np.array_equal(store.xyahs(result), xyahs[mask])
+
+    assert len(store.frames(100)['frame']) == 0
+
+def test_track_lookups(tmp_path, records):
+    frames, ids, xyahs = records
+    path = str(tmp_path / "tracks")
+    write(path, frames, ids, xyahs)
+    store = TrackStore(path)
+
+    assert store.track_ids().tolist() == sorted(set(ids.tolist()))
+    for tid in set(ids.tolist()):
+        mask = ids == tid
+        result = store.track(tid)
+        assert np.array_equal(result['frame'], frames[mask])
+        assert np.array_equal(store.xyahs(result), xyahs[mask])
+
+    assert len(store.track(999)['frame']) == 0
+
+def test_index_files(tmp_path, records):
+    frames, ids, xyahs = records
+    path = str(tmp_path / "tracks")
+    write(path, frames, ids, xyahs)
+
+    entries = np.fromfile(os.path.join(path, "frame.idx"), dtype=INDEX_DTYPE)
+    assert entries['key'].tolist() == sorted(set(frames.tolist()))
+    assert entries['count'].sum() == len(frames)
+    assert np.array_equal(entries['start'][1:], np.cumsum(entries['count'])[:-1])
+
+    entries = np.fromfile(os.path.join(path, "id.idx"), dtype=INDEX_DTYPE)
+    order = np.fromfile(os.path.join(path, "id.order"), dtype='<i8')
+    for key, start, count in entries.tolist():
+        rows = order[start:start+count]
+        assert np.all(ids[rows] == key)
+        assert np.all(np.diff(frames[rows]) > 0)
+
+def test_missing_indexes_are_rebuilt(tmp_path, records):
+    frames, ids, xyahs = records
+    path = str(tmp_path / "tracks")
+    write(path, frames, ids, xyahs)
+    expected = TrackStore(path).track(3)
+
+    for name in ("frame.idx", "id.idx", "id.order"):
+        os.remove(os.path.join(path, name))
+    store = TrackStore(path)
+    assert np.array_equal(store.track(3)['frame'], expected['frame'])
+    assert np.array_equal(store.frames(5)['id'], ids[frames == 5])
+
+def test_append_and_partial_records(tmp_path, records):
+    frames, ids, xyahs = records
+    path = str(tmp_path / "tracks")
+    half = np.searchsorted(frames, 25)
+    write(path, frames[:half], ids[:half], xyahs[:half])
+
+    # A record written to some columns only is dropped when appending
+    with open(os.path.join(path, "frame.bin"), "ab") as f:
+        f.write(np.int32(99).tobytes())
+    assert count_rows(path) == half
+
+    write(path, frames[half:], ids[half:], xyahs[half:], append=True)
+    store = TrackStore(path)
+    assert np.array_equal(np.asarray(read_columns(path)['frame']), frames)
+    assert np.array_equal(store.track(int(ids[0]))['frame'], frames[ids == ids[0]])
+    assert np.array_equal(store.frames(24, 25)['id'], ids[(frames >= 24) & (frames <= 25)])
+
+def test_records_must_be_in_frame_order(tmp_path):
+    with TrackWriter(str(tmp_path / "tracks")) as writer:
+        writer.append(5, [1], [[0, 0, 1, 1]])
+        with pytest.raises(ValueError):
+            writer.append(4, [1], [[0, 0, 1, 1]])
+        with pytest.raises(ValueError):
+            writer.append([6, 5], [1, 2], [[0, 0, 1, 1], [0, 0, 1, 1]])
+
+def test_empty_store(tmp_path):
+    path = str(tmp_path / "tracks")
+    TrackWriter(path).close()
+    store = TrackStore(path)
+    assert len(store) == 0
+    assert store.frame_range() is None
+    assert len(store.track_ids()) == 0
+    assert len(store.frames(0, 10)['frame']) == 0
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from mot.tracker import Tracker, TrackState
+
+
+BOXES = np.array([[100., 100., .5, 80.], [300., 300., .5, 80.], [600., 300., .4, 90.]])
+
+def features(n, seed=0):
+    return np.random.default_rng(seed).random((n, 16))
+
+
+@pytest.mark.parametrize("with_features", [False, True])
+def test_empty_frame_coasts_tracks(with_features):
+    tracker = Tracker()
+    feats = features(3) if with_features else None
+    for _ in range(4):
+        ids = tracker.step(BOXES, feats)
+    assert np.all(tracker.states == TrackState.CONFIRMED)
+
+    empty = np.zeros((0, 16)) if with_features else None
+    for frame in range(1, 4):
+        assert len(tracker.step(np.zeros((0, 4)), empty)) == 0
+        assert np.all(tracker.time_since_update == frame)
+        assert np.all(tracker.ages == 4 + frame)
+        assert np.all(tracker.states == TrackState.CONFIRMED)
+        assert len(tracker.confirmed()[0]) == 0
+
+    # The coasting tracks are picked up again
+    assert np.array_equal(tracker.step(BOXES, feats), ids)
+    assert np.all(tracker.time_since_update == 0)
+
+def test_empty_first_frame_with_features():
+    tracker = Tracker()
+    assert len(tracker.step(np.zeros((0, 4)), np.zeros((0, 16)))) == 0
+    assert np.array_equal(tracker.step(BOXES, features(3)), [1, 2, 3])
+
+def test_single_feature_vector():
+    tracker = Tracker()
+    assert np.array_equal(tracker.step(BOXES[:1], features(1)[0]), [1])
+
+def test_feature_count_mismatch():
+    with pytest.raises(ValueError):
+        Tracker().step(BOXES, features(2))
+
+def test_tracks_are_deleted_after_max_age():
+    tracker = Tracker(max_age=2)
+    for _ in range(4):
+        tracker.step(BOXES)
+    for _ in range(3):
+        tracker.step(np.zeros((0, 4)))
+    assert tracker.n_tracks == 0
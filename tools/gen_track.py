@@ -1,12 +1,30 @@
+import os
+import sys
 import argparse
 import cv2
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mot.store import TrackWriter
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--output", required=True, help="output file")
 parser.add_argument("--wsize", default="1024,768", help="size of window")
 parser.add_argument("--bsize", default="50,200", help="size of bounding box")
+parser.add_argument("--synthetic", action="store_true", help="generate tracks without user interaction")
+parser.add_argument("--detections", default=None, help="output track file of the noisy detections (synthetic mode)")
+parser.add_argument("--tracks", default="1000", help="number of tracks (synthetic mode)")
+parser.add_argument("--frames", default="10000", help="number of frames (synthetic mode)")
+parser.add_argument("--lifetime", default="300", help="mean track lifetime in frames (synthetic mode)")
+parser.add_argument("--motion", default="mixed", choices=["constant", "walk", "turn", "mixed"], help="motion model (synthetic mode)")
+parser.add_argument("--speed", default="3", help="mean speed in pixels per frame (synthetic mode)")
+parser.add_argument("--noise", default="2", help="detection position noise in pixels (synthetic mode)")
+parser.add_argument("--miss_rate", default="0.05", help="probability to miss a visible object (synthetic mode)")
+parser.add_argument("--false_rate", default="1", help="mean number of false detections per frame (synthetic mode)")
+parser.add_argument("--occlusion_rate", default="0.005", help="probability per frame that an object gets occluded (synthetic mode)")
+parser.add_argument("--occlusion_length", default="30", help="maximum occlusion length in frames (synthetic mode)")
+parser.add_argument("--seed", default="0", help="random seed (synthetic mode)")
 
 # Recording status
 STATUS = {
@@ -41,7 +59,170 @@ def draw_track(event, x, y, flags, param):
     elif event == cv2.EVENT_LBUTTONUP:
         STATUS['drawing'] = False
 
+class SceneGenerator:
+    """Headless generator of synthetic tracks and detections
+
+    Tracks are born uniformly over the sequence at random positions, live
+    for an exponentially distributed number of frames and die earlier when
+    they leave the window. Each track follows one of the motion models:
+        - constant: constant velocity with small acceleration noise
+        - walk: random walk of the velocity
+        - turn: constant speed along a slowly turning heading
+
+    Detections are the ground truth boxes with gaussian noise, except for the
+    objects that are missed or occluded, plus uniformly placed false
+    positives whose id is -1. All the objects of a frame are simulated at
+    once with vectorized operations.
+    """
+    MOTIONS = ("constant", "walk", "turn")
+
+    def __init__(self, args):
+        self.rng = np.random.default_rng(int(args['seed']))
+        self.width, self.height = tuple([ int(v) for v in args['wsize'].split(",") ])
+        bbox_width, bbox_height = tuple([ int(v) for v in args['bsize'].split(",") ])
+        self.aspect = bbox_width / bbox_height
+        self.bbox_height = bbox_height
+
+        self.n_tracks = int(args['tracks'])
+        self.n_frames = int(args['frames'])
+        self.lifetime = float(args['lifetime'])
+        self.motion = args['motion']
+        self.speed = float(args['speed'])
+        self.noise = float(args['noise'])
+        self.miss_rate = float(args['miss_rate'])
+        self.false_rate = float(args['false_rate'])
+        self.occlusion_rate = float(args['occlusion_rate'])
+        self.occlusion_length = int(args['occlusion_length'])
+
+        # Birth frame of every track, in order of track id
+        self.births = np.sort(self.rng.integers(0, self.n_frames, self.n_tracks))
+        self.next_id = 0
+
+        # State of the alive tracks
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.xyahs = np.zeros((0, 4))
+        self.velocities = np.zeros((0, 2))
+        self.turn_rates = np.zeros(0)
+        self.motions = np.zeros(0, dtype=np.int64)
+        self.deaths = np.zeros(0, dtype=np.int64)
+        self.occluded_until = np.zeros(0, dtype=np.int64)
+
+    def _spawn(self, iframe):
+        end = np.searchsorted(self.births, iframe, side='right')
+        n = end - self.next_id
+        if n <= 0:
+            return
+
+        xyahs = np.empty((n, 4))
+        xyahs[:, 0] = self.rng.uniform(0, self.width, n)
+        xyahs[:, 1] = self.rng.uniform(0, self.height, n)
+        xyahs[:, 2] = self.aspect * self.rng.uniform(0.8, 1.2, n)
+        xyahs[:, 3] = self.bbox_height * self.rng.uniform(0.5, 1.5, n)
+
+        heading = self.rng.uniform(0, 2*np.pi, n)
+        speed = self.rng.exponential(self.speed, n)
+        velocities = np.stack([np.cos(heading), np.sin(heading)], axis=1) * speed[:, None]
+
+        if self.motion == "mixed":
+            motions = self.rng.integers(0, len(self.MOTIONS), n)
+        else:
+            motions = np.full(n, self.MOTIONS.index(self.motion))
+
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, end)])
+        self.xyahs = np.concatenate([self.xyahs, xyahs])
+        self.velocities = np.concatenate([self.velocities, velocities])
+        self.turn_rates = np.concatenate([self.turn_rates, self.rng.normal(0, 0.02, n)])
+        self.motions = np.concatenate([self.motions, motions])
+        self.deaths = np.concatenate([self.deaths,
+                        iframe + 1 + self.rng.exponential(self.lifetime, n).astype(np.int64)])
+        self.occluded_until = np.concatenate([self.occluded_until, np.zeros(n, dtype=np.int64)])
+        self.next_id = end
+
+    def _move(self):
+        n = len(self.ids)
+        walk = self.motions == self.MOTIONS.index("walk")
+        turn = self.motions == self.MOTIONS.index("turn")
+        constant = self.motions == self.MOTIONS.index("constant")
+
+        self.velocities[constant] += self.rng.normal(0, 0.05, (constant.sum(), 2))
+        self.velocities[walk] += self.rng.normal(0, 0.5, (walk.sum(), 2))
+
+        # Rotate the velocity of turning objects
+        cos, sin = np.cos(self.turn_rates[turn]), np.sin(self.turn_rates[turn])
+        vx, vy = self.velocities[turn, 0].copy(), self.velocities[turn, 1].copy()
+        self.velocities[turn, 0] = cos*vx - sin*vy
+        self.velocities[turn, 1] = sin*vx + cos*vy
+
+        self.xyahs[:, :2] += self.velocities
+        self.xyahs[:, 3] *= np.exp(self.rng.normal(0, 0.005, n))
+
+    def _kill(self, iframe):
+        inside = ((self.xyahs[:, 0] >= 0) & (self.xyahs[:, 0] < self.width)
+                & (self.xyahs[:, 1] >= 0) & (self.xyahs[:, 1] < self.height))
+        alive = inside & (self.deaths > iframe)
+        for name in ('ids', 'xyahs', 'velocities', 'turn_rates',
+                    'motions', 'deaths', 'occluded_until'):
+            setattr(self, name, getattr(self, name)[alive])
+
+    def _detect(self, iframe):
+        n = len(self.ids)
+
+        # Objects start occlusions of random length
+        occluding = self.rng.random(n) < self.occlusion_rate
+        self.occluded_until[occluding] = iframe + self.rng.integers(
+                                    1, self.occlusion_length+1, occluding.sum())
+
+        visible = (self.occluded_until <= iframe) & (self.rng.random(n) >= self.miss_rate)
+        ids = self.ids[visible]
+        xyahs = self.xyahs[visible].copy()
+        xyahs[:, :2] += self.rng.normal(0, self.noise, (len(xyahs), 2))
+        xyahs[:, 3] += self.rng.normal(0, self.noise, len(xyahs))
+
+        # False positives
+        n_false = self.rng.poisson(self.false_rate)
+        false_xyahs = np.empty((n_false, 4))
+        false_xyahs[:, 0] = self.rng.uniform(0, self.width, n_false)
+        false_xyahs[:, 1] = self.rng.uniform(0, self.height, n_false)
+        false_xyahs[:, 2] = self.aspect * self.rng.uniform(0.5, 1.5, n_false)
+        false_xyahs[:, 3] = self.bbox_height * self.rng.uniform(0.3, 1.5, n_false)
+
+        return (np.concatenate([ids, np.full(n_false, -1)]),
+                np.concatenate([xyahs, false_xyahs]))
+
+    def __iter__(self):
+        """Yield (frame, ids, xyahs, detection ids, detection xyahs) per frame"""
+        for iframe in range(self.n_frames):
+            if len(self.ids) > 0:
+                self._move()
+                self._kill(iframe)
+            self._spawn(iframe)
+
+            det_ids, det_xyahs = self._detect(iframe)
+            yield iframe, self.ids, self.xyahs, det_ids, det_xyahs
+
+
+def generate(args):
+    """Write synthetic tracks (and detections) to columnar track files"""
+    generator = SceneGenerator(args)
+    tracks = TrackWriter(args['output'])
+    detections = TrackWriter(args['detections']) if args['detections'] else None
+
+    for iframe, ids, xyahs, det_ids, det_xyahs in generator:
+        tracks.append(iframe, ids, xyahs)
+        if detections is not None:
+            detections.append(iframe, det_ids, det_xyahs)
+
+    tracks.close()
+    print("Generated {} track records in {}".format(tracks.n_rows, args['output']))
+    if detections is not None:
+        detections.close()
+        print("Generated {} detection records in {}".format(detections.n_rows, args['detections']))
+
 def main(args):
+    if args['synthetic']:
+        generate(args)
+        return
+
     window_width, window_height = tuple([ int(v) for v in args['wsize'].split(",") ])
     bbox_width, bbox_height = tuple([ int(v) for v in args['bsize'].split(",") ])
 
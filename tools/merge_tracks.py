@@ -1,77 +1,184 @@
 import os
+import sys
+import heapq
 import argparse
+from itertools import islice
 
 import cv2
 import numpy as np
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mot.store import TrackWriter, read_columns
+
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--output", required=True, help="output file")
 parser.add_argument("--source", required=True, help="source directory for tracks file")
-
-
-def main(args):
-    # Get all track files
-    files = [ os.path.join(args['source'], f) for f in os.listdir(args['source']) ]
-
-    # Keep track files' information in dictionary
-    tracks = {}
-    for tid, f in enumerate(files):
-        with open(f, "r") as fin:
-            lines = fin.readlines()
-            tracks[tid] = lines
-
-    # Decide the period of time of the video
-    max_length = 100000000
-    for tid, records in tracks.items():
-        if max_length > len(records):
-            max_length = len(records)
-
-    # Synchronize every track file so that they are in the same length
-    for tid, records in tracks.items():
-        tracks[tid] = records[:max_length]
-
-    # Merged all tracks
-    merged_buffer = []
-    for iframe in range(max_length):
-        buf = []
-        for k in tracks:
-            terms = tracks[k][iframe].split(",")
-            terms.insert(1, str(k))
-            tracks[k][iframe] = ",".join(terms)
-            buf.append(",".join(terms))
-
-        merged_buffer.append("".join(buf))
-        if len(merged_buffer) > 100:
-            with open(args['output'], "a+") as output:
-                output.writelines(merged_buffer)
-            merged_buffer = []
-
-    # Visualize all the tracks
-    cv2.namedWindow("Merged")
+parser.add_argument("--format", default="csv", choices=["csv", "columnar"], help="output format")
+parser.add_argument("--block_size", default="4096", help="number of records read at once from each track file")
+parser.add_argument("--visualize", action="store_true", help="visualize the merged tracks")
+parser.add_argument("--wsize", default="1024,768", help="size of window")
+
+CSV_FORMAT = "%d,%d,%.8g,%.8g,%.8g,%.8g"
+
+
+class TrackSource:
+    """Read a track file incrementally as blocks of records sorted by frame
+
+    Supported track files are:
+        - text files of "frame,x,y,a,h" lines (one track per file, the track
+            id is given by the caller) or "frame,id,x,y,a,h" lines
+        - columnar track files written by `mot.store.TrackWriter`
+
+    Only one block of `block_size` records is held in memory at a time.
+    """
+    def __init__(self, path, tid=0, block_size=4096):
+        self.path = path
+        self.tid = tid
+        self.block_size = block_size
+
+    def _text_blocks(self):
+        with open(self.path, "r") as f:
+            while True:
+                lines = list(islice(f, self.block_size))
+                if len(lines) == 0:
+                    return
+                values = np.loadtxt(lines, delimiter=",", ndmin=2)
+                if values.shape[1] == 5:
+                    yield (values[:, 0].astype(np.int64),
+                        np.full(len(values), self.tid, dtype=np.int64),
+                        values[:, 1:])
+                else:
+                    yield (values[:, 0].astype(np.int64),
+                        values[:, 1].astype(np.int64),
+                        values[:, 2:])
+
+    def _columnar_blocks(self):
+        columns = read_columns(self.path)
+        for start in range(0, len(columns['frame']), self.block_size):
+            end = start + self.block_size
+            xyahs = np.stack([ columns[name][start:end] for name in "xyah" ], axis=1)
+            yield (np.asarray(columns['frame'][start:end], dtype=np.int64),
+                np.asarray(columns['id'][start:end], dtype=np.int64),
+                xyahs.astype(np.float64))
+
+    def __iter__(self):
+        if os.path.isdir(self.path):
+            return self._columnar_blocks()
+        return self._text_blocks()
+
+def frame_runs(source):
+    """Split the blocks of a track source into per frame runs
+
+    Yield:
+        (frame, ids, xyahs) for each frame of the source, in frame order
+    """
+    carry = None
+    for frames, ids, xyahs in source:
+        if carry is not None:
+            frames = np.concatenate([carry[0], frames])
+            ids = np.concatenate([carry[1], ids])
+            xyahs = np.concatenate([carry[2], xyahs])
+
+        # The records of the last frame may continue in the next block
+        bounds = np.flatnonzero(np.diff(frames)) + 1
+        starts = np.concatenate([[0], bounds])
+        ends = np.concatenate([bounds, [len(frames)]])
+        for start, end in zip(starts[:-1], ends[:-1]):
+            yield frames[start], ids[start:end], xyahs[start:end]
+        carry = (frames[starts[-1]:], ids[starts[-1]:], xyahs[starts[-1]:])
+
+    if carry is not None and len(carry[0]) > 0:
+        yield carry[0][0], carry[1], carry[2]
+
+def merge(sources):
+    """K-way merge of track sources by frame index
+
+    Tracks of different lengths are all kept, a frame only contains the
+    tracks alive in it. Records of the same frame are ordered by source.
+
+    Yield:
+        (frame, ids, xyahs) for each frame present in any source
+    """
+    # Ties between sources are broken by source order, the arrays of the
+    # runs are never compared
+    merged = heapq.merge(*[ frame_runs(source) for source in sources ],
+                        key=lambda run: run[0])
+
+    current, ids, xyahs = None, [], []
+    for frame, run_ids, run_xyahs in merged:
+        if frame != current and current is not None:
+            yield current, np.concatenate(ids), np.concatenate(xyahs)
+            ids, xyahs = [], []
+        current = frame
+        ids.append(run_ids)
+        xyahs.append(run_xyahs)
+
+    if current is not None:
+        yield current, np.concatenate(ids), np.concatenate(xyahs)
+
+def write_csv(path, frames, block_size=4096):
+    """Write merged frames as "frame,id,x,y,a,h" lines"""
+    with open(path, "w") as output:
+        buffer, n_buffered = [], 0
+        for frame, ids, xyahs in frames:
+            buffer.append(np.column_stack([np.full(len(ids), frame), ids, xyahs]))
+            n_buffered += len(ids)
+            if n_buffered >= block_size:
+                np.savetxt(output, np.concatenate(buffer), fmt=CSV_FORMAT)
+                buffer, n_buffered = [], 0
+
+        if n_buffered > 0:
+            np.savetxt(output, np.concatenate(buffer), fmt=CSV_FORMAT)
+
+def write_columnar(path, frames):
+    """Write merged frames to a columnar track file"""
+    with TrackWriter(path) as writer:
+        for frame, ids, xyahs in frames:
+            writer.append(frame, ids, xyahs)
+
+def visualize(path, wsize, block_size=4096):
+    """Replay the merged tracks, the trajectory of each track being drawn in
+    one of three colors
+    """
+    window_width, window_height = wsize
+    colors = np.array([(255, 0, 0), (0, 255, 0), (0, 0, 255)])
 
     # Create an canvas to draw track
-    canvas = np.zeros((768, 1024, 3), np.uint8)
-
-    for iframe in range(max_length):
-
-        for k in tracks:
-            (_, tid, x, y, a, h) = tracks[k][iframe].strip("\n").split(",")
+    cv2.namedWindow("Merged")
+    canvas = np.zeros((window_height, window_width, 3), np.uint8)
 
-            if int(tid) % 3 == 0:
-                cv2.circle(canvas, (int(x), int(y)), 5, (255, 0, 0), -1)
-            elif int(tid) % 3 == 1:
-                cv2.circle(canvas, (int(x), int(y)), 5, (0, 255, 0), -1)
-            elif int(tid) % 3 == 2:
-                cv2.circle(canvas, (int(x), int(y)), 5, (0, 0, 255), -1)
+    for _, ids, xyahs in frame_runs(TrackSource(path, block_size=block_size)):
+        for tid, (x, y) in zip(ids.tolist(), xyahs[:, :2].astype(int).tolist()):
+            cv2.circle(canvas, (x, y), 5, colors[tid % 3].tolist(), -1)
 
         cv2.imshow("Merged", canvas)
 
         key = cv2.waitKey(25) & 0xFF
         if key == ord('q') or key == 27: # q or esc key
-            cv2.destroyAllWindows()
             break
 
+    cv2.destroyAllWindows()
+
+def main(args):
+    block_size = int(args['block_size'])
+
+    # Get all track files, the id of a track is its rank in the directory
+    files = sorted(os.listdir(args['source']))
+    sources = [ TrackSource(os.path.join(args['source'], f), tid=tid, block_size=block_size)
+                for tid, f in enumerate(files) ]
+
+    # Merge all tracks frame by frame
+    if args['format'] == "columnar":
+        write_columnar(args['output'], merge(sources))
+    else:
+        write_csv(args['output'], merge(sources), block_size=block_size)
+
+    # Visualize all the tracks
+    if args['visualize']:
+        wsize = tuple([ int(v) for v in args['wsize'].split(",") ])
+        visualize(args['output'], wsize, block_size=block_size)
+
 if __name__ == "__main__":
     args = vars(parser.parse_args())
     main(args)